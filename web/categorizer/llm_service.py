@@ -27,6 +27,9 @@ class LLMService:
 
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # API clients keep a connection pool, so they are created once
+        self._anthropic_client = None
+        self._ollama_clients = {}
         self.llm_handlers = {
             LLMType.OPENAI_GPT4: lambda llm_type, prompt: self._call_openai(
                 llm_type, prompt
@@ -120,10 +123,11 @@ class LLMService:
                 "Please set it to your Anthropic API key."
             )
 
-        client = anthropic.Anthropic(api_key=api_key)
+        if self._anthropic_client is None:
+            self._anthropic_client = anthropic.Anthropic(api_key=api_key)
 
         try:
-            response = client.messages.create(
+            response = self._anthropic_client.messages.create(
                 model="claude-3-5-sonnet-20241022",
                 max_tokens=1024,
                 messages=[{"role": "user", "content": prompt}],
@@ -231,8 +235,9 @@ class LLMService:
         self.logger.info(f"Calling Ollama with model: {model}")
 
         try:
-            llm = Ollama(model=model)
-            response = llm.invoke(prompt)
+            if model not in self._ollama_clients:
+                self._ollama_clients[model] = Ollama(model=model)
+            response = self._ollama_clients[model].invoke(prompt)
             return response
         except Exception as e:
             self.logger.error(
@@ -0,0 +1,126 @@
+import fcntl
+import hashlib
+import os
+import struct
+import threading
+import zlib
+
+from django.conf import settings
+
+# Every record is the SHA-256 digest of the text and the length of the
+# compressed text, followed by the compressed text
+_HEADER = struct.Struct(">32sI")
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """
+    Append-only file of zlib-compressed texts, addressed by byte offset.
+
+    A text is stored once, however many times it is put: on opening, the
+    headers of all records are read into an index from content hash to
+    offset and length. Records are read back with positional reads, so
+    several threads can share a store. Texts are not read through a memory
+    map: every read goes through the offset of an item and nothing scans
+    the whole store, so a map would only need remapping as the file grows.
+
+    Records are appended under an exclusive lock of the file, after reading
+    the records other processes appended since. A record left incomplete by
+    a crash is cut off by the next append, as only a crashed writer can
+    leave one behind while the lock is held; readers leave it alone.
+
+    Records are never removed, so the file keeps the previous versions of
+    changed articles and the articles of deleted items: it grows by the
+    compressed size of every article version an import brings in. The
+    space is only reclaimed by deleting the file and rebuilding the
+    database from scratch, which replays the cached responses.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._index = {}
+        self._end = 0
+        self._load_index()
+
+    def _load_index(self, truncate=False):
+        """Read the headers of the complete records after the ones already
+        in the index, cutting off an incomplete record if truncate is set,
+        which requires holding the file lock."""
+        size = os.fstat(self._fd).st_size
+        offset = self._end
+        while offset + _HEADER.size <= size:
+            digest, length = _HEADER.unpack(os.pread(self._fd, _HEADER.size, offset))
+            start = offset + _HEADER.size
+            if start + length > size:
+                break
+            self._index[digest.hex()] = (start, length)
+            offset = start + length
+        if truncate and offset < size:
+            os.truncate(self._fd, offset)
+        self._end = offset
+
+    def put(self, text):
+        """
+        Store a text unless it is already stored.
+
+        Returns:
+            (offset, length, hash) of the stored text
+        """
+        key = text_hash(text)
+        with self._lock:
+            if key not in self._index:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                try:
+                    self._load_index(truncate=True)
+                    if key not in self._index:
+                        self._append(key, text)
+                finally:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            offset, length = self._index[key]
+        return offset, length, key
+
+    def _append(self, key, text):
+        data = zlib.compress(text.encode("utf-8"))
+        record = _HEADER.pack(bytes.fromhex(key), len(data)) + data
+        os.pwrite(self._fd, record, self._end)
+        self._index[key] = (self._end + _HEADER.size, len(data))
+        self._end += len(record)
+
+    def get(self, offset, length):
+        return zlib.decompress(os.pread(self._fd, length, offset)).decode("utf-8")
+
+    def size(self):
+        return self._end
+
+    def close(self):
+        os.close(self._fd)
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def shared_store():
+    """The blob store of the Wikipedia articles of the items."""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = BlobStore(settings.ARTICLE_STORE_PATH)
+        return _shared_store
+
+
+def use_store(store):
+    """Replace the shared store, e.g. by a scratch one.
+
+    Returns:
+        The store used before
+    """
+    global _shared_store
+    with _shared_store_lock:
+        previous, _shared_store = _shared_store, store
+    return previous
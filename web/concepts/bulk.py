@@ -0,0 +1,141 @@
+from concepts.models import Concept, Item, Link
+from concepts.utils import chunked
+from django.db import transaction
+
+# Number of rows written per transaction
+BATCH_SIZE = 500
+
+
+class LinkWriter:
+    """
+    Collects the links produced by an import and diffs them against those in
+    the database.
+
+    On exit, the links that are missing are inserted with bulk_create and the
+    links with one of the given labels that the import no longer produced
+    are deleted, all in a single transaction. Links are kept in memory as id
+    triples until then, which is cheap even for the full Wikidata import.
+    Links the caller keeps for later because their destination is not
+    imported yet can be counted in pending, to be reported as well.
+    """
+
+    def __init__(self, labels=(), dry_run=False, batch_size=BATCH_SIZE, changes=None):
+        """
+        Args:
+            labels: Labels of the links of which the import produces a
+                complete new snapshot, so that those not added are deleted
+            dry_run: Count the differences without writing them
+            batch_size: Number of links per query
+            changes: ConceptChanges recording the inserted and deleted links
+        """
+        self.labels = set(labels)
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.changes = changes
+        self.inserted = 0
+        self.deleted = 0
+        self.pending = 0
+        self._added = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, source_id, destination_id, label):
+        self._added.add((source_id, destination_id, label))
+
+    def flush(self):
+        added, self._added = self._added, set()
+        labels = self.labels.union(label for _, _, label in added)
+        # without the default ordering, which would join the items
+        links = Link.objects.filter(label__in=labels).order_by()
+        existing = {
+            (source_id, destination_id, label): pk
+            for pk, source_id, destination_id, label in links.values_list(
+                "id", "source_id", "destination_id", "label"
+            )
+        }
+        new_links = [
+            Link(source_id=source_id, destination_id=destination_id, label=label)
+            for source_id, destination_id, label in added.difference(existing)
+        ]
+        stale = {
+            key: pk
+            for key, pk in existing.items()
+            if key[2] in self.labels and key not in added
+        }
+        if not self.dry_run:
+            with transaction.atomic():
+                for batch in chunked(stale.values(), self.batch_size):
+                    Link.objects.filter(pk__in=batch).delete()
+                Link.objects.bulk_create(new_links, batch_size=self.batch_size)
+            if self.changes is not None:
+                self.changes.add_links(
+                    (link.source_id, link.destination_id) for link in new_links
+                )
+                self.changes.add_links(
+                    (source_id, destination_id)
+                    for source_id, destination_id, _ in stale
+                )
+        self.inserted += len(new_links)
+        self.deleted += len(stale)
+
+    def report(self):
+        message = f"links: {self.inserted} inserted, {self.deleted} deleted"
+        if self.pending:
+            message += f", {self.pending} pending"
+        return message
+
+
+class ConceptChanges:
+    """
+    Records what the writers of an import changed, so that the concepts can
+    be brought up to date afterwards by recomputing only the components the
+    changes touch, see ItemQuerySet.update_concepts.
+
+    Updated items and the endpoints of inserted and deleted links are
+    recorded, as well as the concepts of deleted items, which may fall
+    apart. Inserted items need not be recorded, as they are found by having
+    no concept yet.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.updated = 0
+        self._items = set()
+        self._concepts = set()
+
+    def add_items(self, pks):
+        self._items.update(pks)
+
+    def add_links(self, pairs):
+        for source_id, destination_id in pairs:
+            self._items.add(source_id)
+            self._items.add(destination_id)
+
+    def add_concepts(self, pks):
+        self._concepts.update(pks)
+
+    def apply(self):
+        """
+        Update the concepts of the changed components. Until the concepts
+        have been computed at all, which compute_concepts does for all
+        items at once, there is nothing to update.
+
+        Returns:
+            The number of components given a new concept
+        """
+        items, self._items = self._items, set()
+        concepts, self._concepts = self._concepts, set()
+        if not self.dry_run and Concept.objects.exists():
+            self.updated += Item.objects.filter(concept=None).update_concepts(
+                concepts, items
+            )
+        return self.updated
+
+    def report(self):
+        message = f"concepts: {self.updated} components updated"
+        return message
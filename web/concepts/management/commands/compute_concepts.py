@@ -1,10 +1,19 @@
-from concepts.models import Item
+from concepts.models import Concept, Item
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.db.models import Q
 
 
 class Command(BaseCommand):
+    @transaction.atomic
     def handle(self, *args, **options):
+        if Concept.objects.exists():
+            # the imports keep the concepts up to date, only items that
+            # were written without that still need one
+            print("update concepts")
+            Item.objects.filter(concept=None).update_concepts()
+            return
+
         print("compute singletons")
         # all items that do not appear in an edge are components
         singletons = Item.objects.filter(
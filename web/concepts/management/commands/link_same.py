@@ -1,3 +1,6 @@
+from collections import defaultdict
+
+from concepts.bulk import ConceptChanges, LinkWriter
 from concepts.models import Item, Link
 from django.core.management.base import BaseCommand
 from django.db.models import Count
@@ -6,13 +9,26 @@ from django.db.models.functions import Lower
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        for name_group in (
+        shared_names = (
             Item.objects.annotate(lname=Lower("name"))
             .values("lname")
             .annotate(total=Count("lname"))
             .filter(total__gte=2)
+            .values("lname")
+        )
+        name_groups = defaultdict(list)
+        for pk, lname in (
+            Item.objects.annotate(lname=Lower("name"))
+            .filter(lname__in=shared_names)
+            .order_by(*Item._meta.ordering)
+            .values_list("id", "lname")
         ):
-            items = Item.objects.filter(name__iexact=name_group["lname"])
-            for i in range(len(items) - 1):
-                for j in range(i + 1, len(items)):
-                    Link.save_new(items[i], items[j], Link.Label.NAME_EQ)
+            name_groups[lname].append(pk)
+        changes = ConceptChanges()
+        # links between items whose names no longer match are deleted
+        with LinkWriter([Link.Label.NAME_EQ], changes=changes) as writer:
+            for ids in name_groups.values():
+                for i in range(len(ids) - 1):
+                    for j in range(i + 1, len(ids)):
+                        writer.add(ids[i], ids[j], Link.Label.NAME_EQ)
+        changes.apply()
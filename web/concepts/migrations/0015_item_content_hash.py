@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concepts", "0014_categorizerresult"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:53
+
+from concepts.blob_store import BlobStore
+from django.conf import settings
+from django.db import migrations, models
+
+
+# The store is only opened if there are articles to move, so that building
+# an empty database, e.g. for tests, does not create it
+def move_articles_to_blob_store(apps, schema_editor):
+    Item = apps.get_model("concepts", "Item")
+    items = (
+        Item.objects.exclude(article_text=None)
+        .exclude(article_text="")
+        .only("id", "article_text")
+    )
+    if not items.exists():
+        return
+    store = BlobStore(settings.ARTICLE_STORE_PATH)
+    moved = []
+    try:
+        for item in items.iterator():
+            item.article_offset, item.article_length, item.article_hash = store.put(
+                item.article_text
+            )
+            moved.append(item)
+    finally:
+        store.close()
+    Item.objects.bulk_update(
+        moved, ["article_offset", "article_length", "article_hash"], batch_size=500
+    )
+
+
+def move_articles_to_table(apps, schema_editor):
+    Item = apps.get_model("concepts", "Item")
+    items = Item.objects.exclude(article_offset=None)
+    if not items.exists():
+        return
+    store = BlobStore(settings.ARTICLE_STORE_PATH)
+    moved = []
+    try:
+        for item in items.iterator():
+            item.article_text = store.get(item.article_offset, item.article_length)
+            moved.append(item)
+    finally:
+        store.close()
+    Item.objects.bulk_update(moved, ["article_text"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concepts", "0015_item_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="article_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="item",
+            name="article_length",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="item",
+            name="article_offset",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(move_articles_to_blob_store, move_articles_to_table),
+        migrations.RemoveField(
+            model_name="item",
+            name="article_text",
+        ),
+    ]
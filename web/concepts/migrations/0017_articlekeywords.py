@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concepts", "0016_item_article_blob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArticleKeywords",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("text_hash", models.CharField(max_length=64)),
+                ("pipeline", models.CharField(max_length=100)),
+                ("keywords", models.TextField(null=True)),
+            ],
+            options={
+                "unique_together": {("text_hash", "pipeline")},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:56
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_extracted_keywords(apps, schema_editor):
+    # keywords used to be extracted whenever an item had an article
+    Item = apps.get_model("concepts", "Item")
+    Item.objects.exclude(article_hash=None).update(keywords_hash=F("article_hash"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concepts", "0017_articlekeywords"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="keywords_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(mark_extracted_keywords, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concepts", "0018_item_keywords_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("run", models.CharField(max_length=200)),
+                ("step", models.CharField(max_length=100)),
+                ("position", models.PositiveIntegerField(default=0)),
+                ("marker", models.CharField(blank=True, max_length=200)),
+                ("done", models.BooleanField(default=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "unique_together": {("run", "step")},
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("concepts", "0019_importcheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingLink",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "destination_source",
+                    models.CharField(
+                        choices=[
+                            ("Wd", "Wikidata"),
+                            ("nL", "nLab"),
+                            ("MW", "MathWorld"),
+                            ("PW", "ProofWiki"),
+                            ("EoM", "Encyclopedia of Mathematics"),
+                            ("WpEN", "Wikipedia (English)"),
+                            ("AUm", "Agda Unimath"),
+                        ],
+                        max_length=4,
+                    ),
+                ),
+                ("destination_identifier", models.CharField(max_length=200)),
+                (
+                    "label",
+                    models.CharField(
+                        choices=[
+                            ("Wd", "Wikidata"),
+                            ("AUm", "Agda Unimath"),
+                            ("eq", "same name"),
+                        ],
+                        max_length=4,
+                    ),
+                ),
+                (
+                    "source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="concepts.item"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {
+                    ("source", "destination_source", "destination_identifier", "label")
+                },
+            },
+        ),
+    ]
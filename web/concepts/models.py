@@ -1,10 +1,18 @@
+import hashlib
+import json
 import logging
+from collections import defaultdict
 
-from concepts.utils import UnionFind
-from django.db import models
+from concepts.blob_store import shared_store, text_hash
+from concepts.utils import UnionFind, chunked
+from django.db import connection, models, transaction
+from django.db.models import F, Max, Q
 from django.db.models.functions import Lower
 from django.db.utils import IntegrityError
 
+# Number of concepts or items written per query
+CONCEPT_BATCH_SIZE = 500
+
 
 class Concept(models.Model):
     name = models.CharField(max_length=200, null=True)
@@ -17,47 +25,312 @@ class Concept(models.Model):
         ]
 
 
+def _lowered(name):
+    """The lowercase forms that LOWER() may give for a name: SQLite only
+    folds ASCII letters, other databases fold all of them like Python."""
+    return {name.lower(), "".join(c.lower() if c.isascii() else c for c in name)}
+
+
 class LinkQuerySet(models.QuerySet):
-    def to_tuples(self):
-        for link in self:
-            yield (link.source, link.destination)
+    def id_pairs(self):
+        """Stream the (source id, destination id) pairs of the links without
+        loading their items."""
+        return self.order_by().values_list("source_id", "destination_id").iterator()
+
+
+class PendingLinkQuerySet(models.QuerySet):
+    def resolve(self, changes=None):
+        """
+        Create the pending links whose destinations exist by now and forget
+        them in a single transaction, looking up the destinations with a
+        query per source and batch of CONCEPT_BATCH_SIZE identifiers.
+
+        Args:
+            changes: ConceptChanges recording the created links
+
+        Returns:
+            The number of resolved links
+        """
+        pending = list(
+            self.values_list(
+                "id",
+                "source_id",
+                "destination_source",
+                "destination_identifier",
+                "label",
+            )
+        )
+        identifiers = defaultdict(set)
+        for _, _, destination_source, identifier, _ in pending:
+            identifiers[destination_source].add(identifier)
+        destinations = {}
+        for destination_source, source_identifiers in identifiers.items():
+            for batch in chunked(source_identifiers, CONCEPT_BATCH_SIZE):
+                destinations.update(
+                    ((destination_source, identifier), pk)
+                    for pk, identifier in Item.objects.filter(
+                        source=destination_source, identifier__in=batch
+                    ).values_list("id", "identifier")
+                )
+        resolved = []
+        links = []
+        for pk, source_id, destination_source, identifier, label in pending:
+            destination_id = destinations.get((destination_source, identifier))
+            if destination_id is not None:
+                resolved.append(pk)
+                links.append(
+                    Link(
+                        source_id=source_id, destination_id=destination_id, label=label
+                    )
+                )
+        if resolved:
+            with transaction.atomic():
+                Link.objects.bulk_create(
+                    links, batch_size=CONCEPT_BATCH_SIZE, ignore_conflicts=True
+                )
+                for batch in chunked(resolved, CONCEPT_BATCH_SIZE):
+                    PendingLink.objects.filter(pk__in=batch).delete()
+            if changes is not None:
+                changes.add_links(
+                    (link.source_id, link.destination_id) for link in links
+                )
+        return len(resolved)
 
 
 class ItemQuerySet(models.QuerySet):
+    def without_keywords(self):
+        """Items with an article whose keywords have not been extracted
+        from the current version of the article."""
+        return self.exclude(article_hash=None).filter(
+            Q(keywords_hash=None) | ~Q(keywords_hash=F("article_hash"))
+        )
+
     def create_singleton_concepts(self):
-        for item in self:
-            try:
-                new_concept = item.to_concept()
-                new_concept.save()
-            except IntegrityError:
-                logging.log(
-                    logging.WARNING,
-                    f" A concept named '{new_concept.name}' already exists.",
-                )
-                new_concept = Concept.objects.get(name__iexact=new_concept.name)
-            item.concept = new_concept
-            item.save()
+        """Give every item a concept of its own, or the concept that already
+        has its name."""
+        self._assign_concepts(
+            ([pk], Concept(name=name, description=description))
+            for pk, name, description in self.values_list(
+                "id", "name", "description"
+            ).iterator()
+        )
 
     def create_concepts(self):
-        def take_first(lst):
-            return next(filter(lambda x: x is not None, lst), None)
-
-        components = UnionFind(self.all(), Link.objects.all().to_tuples())
-        for concept_items in components.get_item_components(sort_key=Item.Source.key()):
-            name = take_first([item.name for item in concept_items])
-            description = take_first([item.description for item in concept_items])
-            new_concept = Concept(name=name, description=description)
-            try:
-                new_concept.save()
-            except IntegrityError:
-                logging.log(
-                    logging.WARNING,
-                    f" A concept named '{new_concept.name}' already exists.",
+        """Give the items of every connected component of the links between
+        them a concept, named and described by its first item that has a
+        name or description, in the order of Item.Source.key()."""
+        # plain tuples rather than model instances, as there is one per item
+        items = {
+            item.id: item
+            for item in self.values_list(
+                "id", "source", "name", "description", named=True
+            ).iterator()
+        }
+        components = UnionFind(items)
+        components.union_all(Link.objects.id_pairs())
+        self._assign_concepts(
+            (component, _component_concept(items[pk] for pk in component))
+            for component in components.components()
+        )
+
+    def update_concepts(self, concepts=(), items=()):
+        """
+        Bring the concepts up to date after these items or their links
+        changed, recomputing only the components they belong to, so that the
+        cost depends on the size of the change rather than on all items.
+
+        The concept of every item is the persisted component structure: the
+        affected components are found by following the links of the given
+        items and taking in all items of the concepts they reach, with two
+        queries per step. Their new components then either keep their
+        concept, if they are exactly one concept with an unchanged name and
+        description, or get a new one, which merges concepts that got linked
+        and splits those that lost a link or an item. Items without a
+        concept become singletons or join the component they are linked to.
+        Lists of ids are sent in batches of CONCEPT_BATCH_SIZE, which adds
+        queries for large changes but keeps each under the parameter limit.
+
+        Args:
+            concepts: Ids of further concepts to recompute, e.g. those of
+                deleted items
+            items: Ids of further changed items
+
+        Returns:
+            The number of components given a new concept
+        """
+        fields = ["id", "concept_id", "source", "name", "description"]
+        changed_items, items = items, {}
+
+        def add(queryset):
+            new = [
+                item
+                for item in queryset.values_list(*fields, named=True)
+                if item.id not in items
+            ]
+            items.update((item.id, item) for item in new)
+            return [item.id for item in new]
+
+        def add_with_concepts(pks):
+            """Add the given items and all items of their concepts."""
+            new = []
+            for batch in chunked(pks, CONCEPT_BATCH_SIZE):
+                batch_concepts = (
+                    Item.objects.filter(pk__in=batch)
+                    .exclude(concept=None)
+                    .values("concept")
+                )
+                new += add(
+                    Item.objects.filter(Q(pk__in=batch) | Q(concept__in=batch_concepts))
                 )
-                new_concept = Concept.objects.get(name=name)
-            for item in concept_items:
-                item.concept = new_concept
-                item.save()
+            return new
+
+        frontier = add(
+            Item.objects.filter(
+                Q(pk__in=self.values("pk"))
+                | Q(concept__in=self.exclude(concept=None).values("concept"))
+            )
+        )
+        for batch in chunked(concepts, CONCEPT_BATCH_SIZE):
+            frontier += add(Item.objects.filter(concept__in=batch))
+        frontier += add_with_concepts(changed_items)
+        pairs = set()
+        while frontier:
+            found = set()
+            for batch in chunked(frontier, CONCEPT_BATCH_SIZE):
+                found.update(
+                    Link.objects.filter(Q(source__in=batch) | Q(destination__in=batch))
+                    .order_by()
+                    .values_list("source_id", "destination_id")
+                )
+            pairs |= found
+            neighbours = {pk for pair in found for pk in pair}.difference(items)
+            frontier = add_with_concepts(neighbours)
+
+        old = defaultdict(set)
+        for item in items.values():
+            if item.concept_id is not None:
+                old[item.concept_id].add(item.id)
+        affected = set(old).union(concepts)
+        current = Concept.objects.in_bulk(affected)
+        components = UnionFind(items)
+        components.union_all(pairs)
+        kept = set()
+        changed = []
+        for component in components.components():
+            concept = _component_concept(items[pk] for pk in component)
+            concept_id = items[component[0]].concept_id
+            previous = current.get(concept_id)
+            if (
+                previous is not None
+                and old[concept_id] == set(component)
+                and previous.name == concept.name
+                and previous.description == concept.description
+            ):
+                kept.add(concept_id)
+            else:
+                changed.append((component, concept))
+
+        names = {
+            lowered
+            for _, concept in changed
+            if concept.name is not None
+            for lowered in _lowered(concept.name)
+        }
+        with transaction.atomic():
+            for batch in chunked(affected - kept, CONCEPT_BATCH_SIZE):
+                Concept.objects.filter(pk__in=batch).delete()
+            self._assign_concepts(changed, names)
+        return len(changed)
+
+    def _assign_concepts(self, concepts, names=None):
+        """
+        Create concepts and assign them to their items in a single
+        transaction, with a query per batch of concepts or items. A concept
+        whose name is already taken, regardless of case as in the
+        unique_lower_name constraint, is replaced by the one taking it.
+
+        Args:
+            concepts: Pairs of a list of item ids and their new concept
+            names: Lowercase names the new concepts may have, so that only
+                the concepts with these names are looked up (default: look
+                up all concepts)
+        """
+        named = Concept.objects.exclude(name=None)
+        if names is None:
+            batches = [named]
+        else:
+            named = named.annotate(lower_name=Lower("name"))
+            batches = (
+                named.filter(lower_name__in=batch)
+                for batch in chunked(names, CONCEPT_BATCH_SIZE)
+            )
+        with transaction.atomic():
+            # lowercase name -> id of an existing concept, or new concept
+            taken = {
+                name.lower(): pk
+                for batch in batches
+                for pk, name in batch.values_list("id", "name")
+            }
+            new_concepts = []
+            assignments = []
+            for pks, concept in concepts:
+                key = concept.name.lower() if concept.name is not None else None
+                if key in taken:
+                    logging.log(
+                        logging.WARNING,
+                        f" A concept named '{concept.name}' already exists.",
+                    )
+                    concept = taken[key]
+                else:
+                    new_concepts.append(concept)
+                    if key is not None:
+                        taken[key] = concept
+                assignments.append((pks, concept))
+            _bulk_create_concepts(new_concepts)
+            batch = []
+            for pks, concept in assignments:
+                concept_id = getattr(concept, "pk", concept)
+                for pk in pks:
+                    batch.append(Item(pk=pk, concept_id=concept_id))
+                    if len(batch) == CONCEPT_BATCH_SIZE:
+                        Item.objects.bulk_update(batch, ["concept"])
+                        batch = []
+            Item.objects.bulk_update(batch, ["concept"])
+
+
+def _bulk_create_concepts(concepts):
+    """
+    Create concepts in batches and set their primary keys. Databases that
+    do not return the rows of a bulk insert, such as SQLite before 3.35,
+    leave them unset, so the ids are then read back: in a transaction,
+    they are the ids after the largest one before, in the order of the
+    concepts.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        Concept.objects.bulk_create(concepts, batch_size=CONCEPT_BATCH_SIZE)
+        return
+    last = Concept.objects.aggregate(last=Max("pk"))["last"] or 0
+    Concept.objects.bulk_create(concepts, batch_size=CONCEPT_BATCH_SIZE)
+    pks = list(
+        Concept.objects.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True)
+    )
+    if len(pks) != len(concepts):
+        raise IntegrityError(f"Expected {len(concepts)} new concepts, found {len(pks)}")
+    for concept, pk in zip(concepts, pks):
+        concept.pk = pk
+
+
+def _component_concept(items):
+    """New concept of the items of a component, see create_concepts."""
+
+    def take_first(lst):
+        return next(filter(lambda x: x is not None, lst), None)
+
+    items = sorted(items, key=Item.Source.key())
+    return Concept(
+        name=take_first([item.name for item in items]),
+        description=take_first([item.description for item in items]),
+    )
 
 
 class Item(models.Model):
@@ -89,8 +362,15 @@ class Item(models.Model):
     name = models.CharField(max_length=200, null=True)
     description = models.TextField(null=True)
     keywords = models.TextField(null=True, blank=True)
-    article_text = models.TextField(null=True, blank=True)
+    # article_hash of the article the keywords were extracted from
+    keywords_hash = models.CharField(max_length=64, null=True, blank=True)
+    # the Wikipedia article is kept outside the table, see article_text
+    article_offset = models.BigIntegerField(null=True, blank=True)
+    article_length = models.IntegerField(null=True, blank=True)
+    article_hash = models.CharField(max_length=64, null=True, blank=True)
     aliases = models.TextField(null=True, blank=True)
+    # fingerprint of the imported content, see compute_content_hash
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
     concept = models.ForeignKey(
         Concept,
         models.SET_NULL,
@@ -99,10 +379,52 @@ class Item(models.Model):
     )
     objects = ItemQuerySet.as_manager()
 
+    # fields filled in by the slurpers
+    CONTENT_FIELDS = [
+        "url",
+        "name",
+        "description",
+        "article_hash",
+        "aliases",
+    ]
+    # location of the article in the blob store
+    ARTICLE_FIELDS = ["article_offset", "article_length"]
+    # fields derived from the article by keyword extraction
+    KEYWORD_FIELDS = ["keywords", "keywords_hash"]
+
     class Meta:
         ordering = ["name", "source", "identifier"]
         unique_together = ["source", "identifier"]
 
+    @property
+    def article_text(self):
+        """The text of the Wikipedia article, read from the blob store only
+        when it is asked for."""
+        if getattr(self, "_article_text", None) is not None:
+            return self._article_text
+        if self.article_offset is None:
+            return None
+        return shared_store().get(self.article_offset, self.article_length)
+
+    @article_text.setter
+    def article_text(self, text):
+        # only written to the blob store with the item, see store_article
+        self._article_text = text or None
+        self.article_hash = text_hash(text) if text else None
+        self.article_offset = self.article_length = None
+
+    def store_article(self):
+        """Write an article that was set on the item to the blob store."""
+        if getattr(self, "_article_text", None) is not None:
+            self.article_offset, self.article_length, self.article_hash = (
+                shared_store().put(self._article_text)
+            )
+            self._article_text = None
+
+    def save(self, *args, **kwargs):
+        self.store_article()
+        super().save(*args, **kwargs)
+
     def to_dict(self):
         return {"name": self.name, "source": self.get_source_display(), "url": self.url}
 
@@ -118,6 +440,10 @@ class Item(models.Model):
     def get_linked_item_urls(self):
         return [i.get_url() for i in self.get_linked_items()]
 
+    def compute_content_hash(self):
+        content = json.dumps([getattr(self, field) for field in Item.CONTENT_FIELDS])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
     def to_concept(self):
         return Concept(name=self.name, description=self.description)
 
@@ -150,10 +476,7 @@ class Link(models.Model):
     @staticmethod
     def save_new(source: Item, destination: Item, label: Label):
         try:
-            new_link = Link.objects.create(
-                source=source, destination=destination, label=label
-            )
-            new_link.save()
+            Link.objects.create(source=source, destination=destination, label=label)
         except IntegrityError:
             logging.log(
                 logging.INFO,
@@ -164,6 +487,34 @@ class Link(models.Model):
         return f"{self.source} -[{self.get_label_display()}]-> {self.destination}"
 
 
+class PendingLink(models.Model):
+    """
+    A link whose destination has not been imported yet, e.g. from an Agda
+    Unimath concept to a Wikidata item that a later Wikidata import brings
+    in. The link is created once its destination exists.
+    """
+
+    source = models.ForeignKey(Item, on_delete=models.CASCADE)
+    destination_source = models.CharField(max_length=4, choices=Item.Source.choices)
+    destination_identifier = models.CharField(max_length=200)
+    label = models.CharField(max_length=4, choices=Link.Label.choices)
+    objects = PendingLinkQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [
+            "source",
+            "destination_source",
+            "destination_identifier",
+            "label",
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.source} -[{self.get_label_display()}]-> "
+            f"{self.destination_source} {self.destination_identifier} (pending)"
+        )
+
+
 class CategorizerResult(models.Model):
     """
     Stores the result of categorizing an item using an LLM.
@@ -192,3 +543,41 @@ class CategorizerResult(models.Model):
             f"{self.item} - {self.llm_type}: "
             f"{self.result_answer} ({self.result_confidence}%)"
         )
+
+
+class ArticleKeywords(models.Model):
+    """
+    Keywords extracted from an article text, cached by the hash of the text
+    and the spaCy pipeline that extracted them, so that articles which did
+    not change are never processed again.
+    """
+
+    text_hash = models.CharField(max_length=64)
+    pipeline = models.CharField(max_length=100)
+    keywords = models.TextField(null=True)
+
+    class Meta:
+        unique_together = ["text_hash", "pipeline"]
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of an interrupted import, saved in the same transaction as the
+    items it covers, so that the import can be resumed from the last batch
+    it committed. The checkpoints of a run are deleted once it completes.
+    """
+
+    # name of the import and the slurpers it was restricted to
+    run = models.CharField(max_length=200)
+    # slurper or stage of the import, e.g. "links"
+    step = models.CharField(max_length=100)
+    # number of results whose items are written
+    position = models.PositiveIntegerField(default=0)
+    # identifier of the last written result, to tell whether the results
+    # are the same when resuming
+    marker = models.CharField(max_length=200, blank=True)
+    done = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ["run", "step"]
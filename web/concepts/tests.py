@@ -1,3 +1,410 @@
-# from django.test import TestCase
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+from concepts.blob_store import BlobStore, text_hash
+from concepts.bulk import ConceptChanges, LinkWriter
+from concepts.models import CONCEPT_BATCH_SIZE, Concept, Item, Link
+from concepts.utils import UnionFind
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from web.query_budget import QueryBudgetMixin, count_queries
+
+
+def create_items(n):
+    """Create n Wikidata items and their Wikipedia articles, each pair
+    linked, and every fourth Wikidata item sharing its name with the next."""
+    items = Item.objects.bulk_create(
+        [
+            Item(
+                source=source,
+                identifier=f"{source}{i}",
+                url=f"https://example.org/{source}/{i}",
+                name=f"concept {i - i % 2 if i % 4 < 2 else i}",
+            )
+            for i in range(n)
+            for source in (Item.Source.WIKIDATA, Item.Source.WIKIPEDIA_EN)
+        ]
+    )
+    Link.objects.bulk_create(
+        [
+            Link(source=items[i], destination=items[i + 1], label=Link.Label.WIKIDATA)
+            for i in range(0, len(items), 2)
+        ]
+    )
+
+
+class UnionFindTest(SimpleTestCase):
+    def test_components(self):
+        components = UnionFind([50, 10, 40, 30, 20, 60])
+        components.union_all([(10, 30), (60, 40), (30, 50), (60, 99)])
+        self.assertEqual(
+            sorted(map(sorted, components.components())),
+            [[10, 30, 50], [20], [40, 60]],
+        )
+
+    def test_instances_are_independent(self):
+        UnionFind([1, 2]).union(1, 2)
+        self.assertEqual(len(UnionFind([1, 2]).components()), 2)
+
+    def test_long_chain(self):
+        # deep trees must not hit the recursion limit
+        n = 100000
+        components = UnionFind(range(n))
+        components.union_all((i, i + 1) for i in range(n - 1))
+        self.assertEqual(len(components.components()), 1)
+
+
+class PipelineQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def test_link_same(self):
+        create_items(40)
+        with self.assertQueryBudget(4, label="link_same"):
+            call_command("link_same")
+        self.assertTrue(Link.objects.filter(label=Link.Label.NAME_EQ).exists())
+
+    def test_compute_concepts(self):
+        create_items(40)
+        call_command("link_same")
+        with self.assertQueryBudget(10, label="compute_concepts"):
+            call_command("compute_concepts")
+        self.assertFalse(Item.objects.filter(concept=None).exists())
+
+    def test_compute_concepts_scales_with_batches(self):
+        create_items(600)
+        call_command("link_same")
+        with self.assertQueryBudget(12, label="compute_concepts"):
+            call_command("compute_concepts")
+        self.assertFalse(Item.objects.filter(concept=None).exists())
+
+
+class ComputeConceptsTest(TestCase):
+    def test_name_collisions(self):
+        create_items(4)
+        Concept.objects.create(name="Concept 0", description="existing")
+        Item.objects.bulk_create(
+            [
+                Item(
+                    source=Item.Source.NLAB, identifier="a", url="a", name="CONCEPT 2"
+                ),
+                Item(source=Item.Source.NLAB, identifier="b", url="b", name="unique"),
+                Item(source=Item.Source.NLAB, identifier="c", url="c", name="Unique"),
+                Item(source=Item.Source.NLAB, identifier="d", url="d"),
+                Item(source=Item.Source.NLAB, identifier="e", url="e"),
+            ]
+        )
+        call_command("compute_concepts")
+        concept_names = dict(Item.objects.values_list("identifier", "concept__name"))
+        self.assertEqual(concept_names[f"{Item.Source.WIKIDATA}0"], "Concept 0")
+        self.assertEqual(concept_names["a"].lower(), "concept 2")
+        self.assertEqual(concept_names[f"{Item.Source.WIKIDATA}2"], concept_names["a"])
+        self.assertEqual(concept_names["b"], concept_names["c"])
+        unnamed = Item.objects.filter(identifier__in=["d", "e"])
+        self.assertEqual(len({item.concept_id for item in unnamed}), 2)
+
+    def test_without_returned_rows(self):
+        # SQLite before 3.35 does not set the primary keys of bulk inserts
+        create_items(4)
+        Concept.objects.create(name="existing")
+        with mock.patch.object(
+            type(connection.features),
+            "can_return_rows_from_bulk_insert",
+            new_callable=mock.PropertyMock,
+            return_value=False,
+        ):
+            call_command("compute_concepts")
+        self.assertFalse(Item.objects.filter(concept=None).exists())
+        self.assertEqual(
+            set(Item.objects.values_list("concept__name", flat=True)),
+            set(Item.objects.values_list("name", flat=True)),
+        )
+
+    def test_no_item_instances(self):
+        # items are only read as tuples of their ids and fields
+        create_items(8)
+        with mock.patch.object(Item, "from_db", side_effect=AssertionError):
+            call_command("compute_concepts")
+            Item.objects.bulk_create(
+                [Item(source=Item.Source.NLAB, identifier="a", url="a")]
+            )
+            Item.objects.filter(concept=None).update_concepts()
+        self.assertFalse(Item.objects.filter(concept=None).exists())
+
+
+def concept_groups():
+    """The identifiers of the items of every concept."""
+    groups = defaultdict(set)
+    for identifier, concept_id in Item.objects.values_list("identifier", "concept"):
+        groups[concept_id].add(identifier)
+    return {frozenset(group) for group in groups.values()}
+
+
+class UpdateConceptsTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        Item.objects.bulk_create(
+            [
+                Item(source=Item.Source.NLAB, identifier=name, url=name, name=name)
+                for name in "abcd"
+            ]
+        )
+        self.ids = dict(Item.objects.values_list("identifier", "id"))
+        self.link("a", "b", "c", "d")
+        call_command("compute_concepts")
+
+    def link(self, *names, label=Link.Label.AGDA_UNIMATH):
+        """Link pairs of the named items, replacing the links with the label,
+        and update the concepts."""
+        changes = ConceptChanges()
+        with LinkWriter([label], changes=changes) as writer:
+            for source, destination in zip(names[::2], names[1::2]):
+                writer.add(self.ids[source], self.ids[destination], label)
+        changes.apply()
+
+    def test_links(self):
+        self.assertEqual(concept_groups(), {frozenset("ab"), frozenset("cd")})
+        self.link("a", "b", "c", "d", "b", "c")
+        self.assertEqual(concept_groups(), {frozenset("abcd")})
+        self.link("a", "b", "c", "d")
+        self.assertEqual(concept_groups(), {frozenset("ab"), frozenset("cd")})
+        self.assertEqual(
+            set(Concept.objects.values_list("name", flat=True)), {"a", "c"}
+        )
+
+    def test_matches_compute_concepts(self):
+        create_items(20)
+        call_command("link_same")
+        self.ids = dict(Item.objects.values_list("identifier", "id"))
+        self.link("a", "b", "c", "d", "c", f"{Item.Source.WIKIDATA}3")
+        updated = concept_groups()
+        call_command("clear_concepts")
+        call_command("compute_concepts")
+        self.assertEqual(concept_groups(), updated)
+
+    def test_budget(self):
+        # the cost of an update depends on the change, not on all items
+        create_items(600)
+        call_command("link_same")
+        changes = ConceptChanges()
+        changes.add_links([(self.ids["b"], self.ids["c"])])
+        Link.objects.create(
+            source_id=self.ids["b"],
+            destination_id=self.ids["c"],
+            label=Link.Label.AGDA_UNIMATH,
+        )
+        with self.assertQueryBudget(12, label="update_concepts"):
+            changes.apply()
+        self.assertEqual(Item.objects.get(identifier="a").concept.item_set.count(), 4)
+
+    def test_large_change(self):
+        # more changed items and concepts than fit in a batch
+        create_items(CONCEPT_BATCH_SIZE)
+        call_command("link_same")
+        changes = ConceptChanges()
+        with LinkWriter([Link.Label.NAME_EQ], changes=changes):
+            pass
+        changes.add_concepts(Concept.objects.values_list("id", flat=True))
+        with count_queries() as queries:
+            changes.apply()
+        largest = max(sql.count("%s") for sql in queries.statements)
+        self.assertLessEqual(largest, 2 * CONCEPT_BATCH_SIZE)
+        updated = concept_groups()
+        call_command("clear_concepts")
+        call_command("compute_concepts")
+        self.assertEqual(concept_groups(), updated)
+
+
+class LinkWriterTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.a, self.b, self.c = Item.objects.bulk_create(
+            [
+                Item(source=Item.Source.WIKIDATA, identifier=f"Q{i}", url=f"Q{i}")
+                for i in range(3)
+            ]
+        )
+        Link.objects.bulk_create(
+            [
+                Link(source=self.a, destination=self.b, label=Link.Label.WIKIDATA),
+                Link(source=self.b, destination=self.c, label=Link.Label.WIKIDATA),
+                Link(source=self.a, destination=self.c, label=Link.Label.AGDA_UNIMATH),
+            ]
+        )
+
+    def links(self):
+        return set(Link.objects.values_list("source", "destination", "label"))
+
+    def test_diff(self):
+        with self.assertQueryBudget(select=1, insert=1, delete=1):
+            with LinkWriter([Link.Label.WIKIDATA]) as writer:
+                writer.add(self.a.pk, self.b.pk, Link.Label.WIKIDATA)
+                writer.add(self.c.pk, self.a.pk, Link.Label.WIKIDATA)
+                writer.add(self.a.pk, self.b.pk, Link.Label.WIKIDATA)
+        self.assertEqual((writer.inserted, writer.deleted), (1, 1))
+        # links with other labels are kept
+        self.assertEqual(
+            self.links(),
+            {
+                (self.a.pk, self.b.pk, Link.Label.WIKIDATA),
+                (self.c.pk, self.a.pk, Link.Label.WIKIDATA),
+                (self.a.pk, self.c.pk, Link.Label.AGDA_UNIMATH),
+            },
+        )
+
+    def test_without_labels(self):
+        # links are only added
+        with LinkWriter() as writer:
+            writer.add(self.c.pk, self.b.pk, Link.Label.WIKIDATA)
+        self.assertEqual((writer.inserted, writer.deleted), (1, 0))
+        self.assertEqual(len(self.links()), 4)
+
+    def test_dry_run(self):
+        before = self.links()
+        with LinkWriter([Link.Label.WIKIDATA], dry_run=True) as writer:
+            writer.add(self.c.pk, self.a.pk, Link.Label.WIKIDATA)
+        self.assertEqual((writer.inserted, writer.deleted), (1, 2))
+        self.assertEqual(self.links(), before)
+
+
+class ViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        create_items(20)
+        for item in Item.objects.all():
+            item.concept, _ = Concept.objects.get_or_create(name=item.name)
+            item.save()
+        self.item = Item.objects.select_related("concept").first()
+
+    def test_home(self):
+        with self.assertQueryBudget(2, label="home page"):
+            response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_concept(self):
+        with self.assertQueryBudget(2, label="concept page"):
+            response = self.client.get(f"/concept/{self.item.concept.name}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_redirect_item_to_concept(self):
+        url = f"/concept/{self.item.source}/{self.item.identifier}"
+        with self.assertQueryBudget(1, label="item redirect"):
+            response = self.client.get(url)
+        self.assertRedirects(
+            response,
+            "/concept/" + quote(self.item.concept.name),
+            fetch_redirect_response=False,
+        )
+
+    def test_results(self):
+        with self.assertQueryBudget(1, label="search results"):
+            response = self.client.get("/results/concept")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["results"]), Concept.objects.count())
+
+
+class BlobStoreTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "articles.blob"
+
+    def test_dedup(self):
+        store = BlobStore(self.path)
+        self.addCleanup(store.close)
+        first = store.put("text")
+        self.assertEqual(store.put("text"), first)
+        self.assertNotEqual(store.put("other text")[0], first[0])
+        self.assertEqual(store.get(*first[:2]), "text")
+
+    def test_crash_tail(self):
+        store = BlobStore(self.path)
+        offset, length, _ = store.put("complete")
+        size = store.size()
+        store.close()
+        # a record cut short while it was appended
+        record = self.path.read_bytes()
+        with open(self.path, "ab") as f:
+            f.write(record[: len(record) - 2])
+
+        store = BlobStore(self.path)
+        self.addCleanup(store.close)
+        self.assertEqual(store.size(), size)
+        self.assertEqual(store.get(offset, length), "complete")
+        self.assertEqual(store.put("complete")[:2], (offset, length))
+        # only cut off by the next append, not by opening the store
+        self.assertEqual(self.path.stat().st_size, len(record) * 2 - 2)
+        offset, length, _ = store.put("after the crash")
+        # right after the complete record and its own 36 byte header
+        self.assertEqual(offset, size + 36)
+        self.assertEqual(store.get(offset, length), "after the crash")
+
+    def test_two_writers(self):
+        first = BlobStore(self.path)
+        self.addCleanup(first.close)
+        second = BlobStore(self.path)
+        self.addCleanup(second.close)
+        a = first.put("first")
+        b = second.put("second")
+        # each writer appends after the records of the other
+        self.assertEqual(second.put("first"), a)
+        self.assertEqual(first.put("second"), b)
+        self.assertEqual(first.get(*a[:2]), "first")
+        self.assertEqual(first.get(*b[:2]), "second")
+
+
+class ArticleMigrationTest(TransactionTestCase):
+    before = [("concepts", "0015_item_content_hash")]
+    after = [("concepts", "0016_item_article_blob")]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "articles.blob"
+        settings = self.settings(ARTICLE_STORE_PATH=str(self.path))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_articles(self):
+        Item = self.migrate(self.before).get_model("concepts", "Item")
+        Item.objects.bulk_create(
+            [
+                Item(source="WpEN", identifier=str(i), url="", article_text=text)
+                for i, text in enumerate(["article", "", None, "article"])
+            ]
+        )
+        Item = self.migrate(self.after).get_model("concepts", "Item")
+        items = list(Item.objects.order_by("identifier"))
+        store = BlobStore(self.path)
+        self.addCleanup(store.close)
+        self.assertEqual(
+            store.get(items[0].article_offset, items[0].article_length), "article"
+        )
+        self.assertEqual(items[0].article_hash, text_hash("article"))
+        self.assertEqual(items[3].article_offset, items[0].article_offset)
+        self.assertIsNone(items[1].article_offset)
+        self.assertIsNone(items[2].article_offset)
+
+        Item = self.migrate(self.before).get_model("concepts", "Item")
+        self.assertEqual(
+            list(
+                Item.objects.order_by("identifier").values_list(
+                    "article_text", flat=True
+                )
+            ),
+            ["article", None, None, "article"],
+        )
+
+    def test_empty_database(self):
+        self.migrate(self.before)
+        self.migrate(self.after)
+        self.assertFalse(self.path.exists())
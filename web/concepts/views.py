@@ -1,4 +1,5 @@
 from concepts.models import Concept, Item
+from django.db.models import Count
 from django.shortcuts import get_object_or_404, redirect, render
 
 
@@ -20,23 +21,31 @@ def concept(request, name):
 
 
 def home(request):
-    autocomplete_names = [c.name for c in Concept.objects.all() if c.name is not None]
+    autocomplete_names = list(
+        Concept.objects.exclude(name=None).values_list("name", flat=True)
+    )
+    items_per_source = dict(
+        Item.objects.order_by()
+        .values_list("source")
+        .annotate(total=Count("id"))
+        .values_list("source", "total")
+    )
     context = {
         "concepts": autocomplete_names,
         "number_of_links": {
-            "wikidata": Item.objects.filter(source=Item.Source.WIKIDATA).count(),
-            "wikipedia_en": Item.objects.filter(
-                source=Item.Source.WIKIPEDIA_EN
-            ).count(),
-            "nlab": Item.objects.filter(source=Item.Source.NLAB).count(),
-            "mathworld": Item.objects.filter(source=Item.Source.MATHWORLD).count(),
-            "proof_wiki": Item.objects.filter(source=Item.Source.PROOF_WIKI).count(),
-            "encyclopedia_of_mathematics": Item.objects.filter(
-                source=Item.Source.ENCYCLOPEDIA_OF_MATHEMATICS
-            ).count(),
-            "agda_unimath": Item.objects.filter(
-                source=Item.Source.AGDA_UNIMATH
-            ).count(),
+            key: items_per_source.get(source, 0)
+            for key, source in [
+                ("wikidata", Item.Source.WIKIDATA),
+                ("wikipedia_en", Item.Source.WIKIPEDIA_EN),
+                ("nlab", Item.Source.NLAB),
+                ("mathworld", Item.Source.MATHWORLD),
+                ("proof_wiki", Item.Source.PROOF_WIKI),
+                (
+                    "encyclopedia_of_mathematics",
+                    Item.Source.ENCYCLOPEDIA_OF_MATHEMATICS,
+                ),
+                ("agda_unimath", Item.Source.AGDA_UNIMATH),
+            ]
         },
     }
     return render(request, "index.html", context)
@@ -49,7 +58,9 @@ def search(request):
 
 def redirect_item_to_concept(request, source, identifier):
     # should this be a permanent redirect?
-    item = get_object_or_404(Item, source=source, identifier=identifier)
+    item = get_object_or_404(
+        Item.objects.select_related("concept"), source=source, identifier=identifier
+    )
     return redirect("/concept/" + item.concept.name)
 
 
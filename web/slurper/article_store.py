@@ -0,0 +1,293 @@
+import threading
+from collections import OrderedDict
+
+from concepts.blob_store import text_hash
+from concepts.models import ArticleKeywords
+from slurper.keyword_util import (
+    NLP_BATCH_SIZE,
+    NLP_PROCESSES,
+    extract_keywords_batch,
+    pipeline_signature,
+)
+from slurper.wikipedia import ArticleFetcher
+
+# Number of article texts kept for titles asked for again. Results are
+# written in order, so a text is only needed again by the chunks of
+# results in flight; later ones skip the Wikipedia item written already.
+ARTICLE_CACHE_SIZE = 1000
+
+
+def normalize_title(title):
+    """Normalize an article title the way MediaWiki does, so that the
+    spellings used by different results map to the same article."""
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+
+class CachedKeywords:
+    """Stands for the keywords of a text cached in the database, until
+    ArticleStore.load_keywords reads them."""
+
+    def __init__(self, text_hash):
+        self.text_hash = text_hash
+
+
+class ArticleStore:
+    """
+    Wikipedia articles and their keywords, shared by all slurpers of a run.
+
+    The same article is linked from the results of several queries, so
+    articles are remembered by normalized title and only fetched the first
+    time they are asked for, including those that came back empty or whose
+    fetch failed. A title asked for by several threads at the same time is
+    fetched by only one of them. Only the texts of the most recent articles
+    are kept, so memory does not grow with the number of articles.
+
+    Keywords are remembered by the hash of the article text and extracted in
+    batches, only once per distinct text. They are also cached across
+    imports in the database, so unchanged articles are never processed
+    again. Extraction may run on a thread that must not use the database:
+    it only checks the hashes loaded beforehand by load_cached, and the
+    keywords it finds cached are read by load_keywords on the thread that
+    uses the database.
+    """
+
+    def __init__(
+        self,
+        fetcher=None,
+        nlp_batch_size=NLP_BATCH_SIZE,
+        nlp_processes=NLP_PROCESSES,
+        cache_size=ARTICLE_CACHE_SIZE,
+    ):
+        """
+        Args:
+            fetcher: ArticleFetcher used for unknown titles (default: a new one)
+            nlp_batch_size: Number of articles spaCy processes at once
+            nlp_processes: Number of processes running spaCy
+            cache_size: Number of article texts kept for reuse
+        """
+        self.fetcher = fetcher or ArticleFetcher()
+        self.nlp_batch_size = nlp_batch_size
+        self.nlp_processes = nlp_processes
+        self.cache_size = cache_size
+        # normalized title -> content hash, or None if there is no article
+        self._titles = {}
+        # normalized titles whose fetch failed
+        self._failed = set()
+        # content hash -> article text, least recently used first
+        self._texts = OrderedDict()
+        # content hash -> keywords
+        self._keywords = {}
+        # hashes of the texts whose keywords are cached in the database
+        self._cached = None
+        # content hash -> keywords extracted in this run, not saved yet
+        self._extracted = {}
+        # normalized title -> event set once the fetch of the title is done
+        self._fetching = {}
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.reused = 0
+        self.keywords_extracted = 0
+        self.keywords_cached = 0
+
+    def articles(self, titles):
+        """
+        Get the articles with the given titles, fetching the unknown ones.
+
+        Args:
+            titles: Iterable of article titles, as they appear in article URLs
+
+        Returns:
+            A dictionary mapping each title to the article text, or to None
+            if there is no article, leaving out the titles whose fetch failed
+            and those whose text is no longer kept
+        """
+        titles = list(dict.fromkeys(titles))
+        normalized = {title: normalize_title(title) for title in titles}
+        to_fetch = {}
+        waiting = []
+        with self._lock:
+            for title, key in normalized.items():
+                if key in self._titles or key in self._failed:
+                    self.reused += 1
+                elif key in self._fetching:
+                    waiting.append(self._fetching[key])
+                elif key not in to_fetch.values():
+                    to_fetch[title] = key
+                    self._fetching[key] = threading.Event()
+        fetched = {}
+        # texts fetched by this call, which it returns even if they are
+        # no longer kept
+        texts = {}
+        try:
+            if to_fetch:
+                fetched = self.fetcher.fetch_articles(to_fetch)
+        finally:
+            with self._lock:
+                for title, key in to_fetch.items():
+                    if title not in fetched:
+                        self._failed.add(key)
+                    elif fetched[title]:
+                        self._titles[key] = self._keep(fetched[title])
+                        texts[self._titles[key]] = fetched[title]
+                    else:
+                        self._titles[key] = None
+                    self._fetching.pop(key).set()
+                self.fetched += len(to_fetch)
+        for event in waiting:
+            event.wait()
+        result = {}
+        with self._lock:
+            for title, key in normalized.items():
+                if key not in self._titles:
+                    continue
+                h = self._titles[key]
+                if h is None:
+                    result[title] = None
+                elif h in texts:
+                    result[title] = texts[h]
+                elif h in self._texts:
+                    self._texts.move_to_end(h)
+                    result[title] = self._texts[h]
+        return result
+
+    def _keep(self, text):
+        """Keep an article text for reuse, forgetting the least recently
+        used one if there are too many, and return its hash."""
+        h = text_hash(text)
+        self._texts[h] = text
+        self._texts.move_to_end(h)
+        if len(self._texts) > self.cache_size:
+            self._texts.popitem(last=False)
+        return h
+
+    def keywords(self, pairs):
+        """
+        Get the keywords of many article texts, extracting them in batches
+        for the texts not seen before.
+
+        Args:
+            pairs: Iterable of (key, text) pairs, consumed lazily, where keys
+                are small and picklable and texts may be None
+
+        Yields:
+            (key, keywords) pairs in the order of the input, where the
+            keywords cached in the database are CachedKeywords
+        """
+        if self._cached is None:
+            self.load_cached()
+        known = {}
+
+        def to_extract():
+            for key, text in pairs:
+                h = text_hash(text) if text else None
+                with self._lock:
+                    if h is None or h in self._keywords:
+                        known[key] = self._keywords.get(h)
+                    elif h in self._cached:
+                        known[key] = CachedKeywords(h)
+                if key in known:
+                    # keep the order by passing an empty text along
+                    h = text = None
+                yield (h, key), text
+
+        for (h, key), keywords in extract_keywords_batch(
+            to_extract(), self.nlp_batch_size, self.nlp_processes
+        ):
+            if h is None:
+                yield key, known.pop(key)
+                continue
+            with self._lock:
+                if h not in self._keywords:
+                    self._keywords[h] = self._extracted[h] = keywords
+                    self.keywords_extracted += 1
+                keywords = self._keywords[h]
+            yield key, keywords
+
+    def keywords_by_chunk(self, chunks):
+        """
+        Get the keywords of chunks of article texts, all of which go through
+        the same batched extraction.
+
+        Args:
+            chunks: Iterable of lists of (key, text) pairs, consumed lazily
+
+        Yields:
+            For each chunk, once all of its keywords are known, a dictionary
+            mapping its keys to their keywords, where the keywords cached in
+            the database are CachedKeywords
+        """
+        results = {}
+
+        def pairs():
+            for n, chunk in enumerate(chunks):
+                results[n] = {}
+                for key, text in chunk:
+                    yield (n, key), text
+                # marks the end of the chunk
+                yield (n, None), None
+
+        for (n, key), keywords in self.keywords(pairs()):
+            if key is None:
+                yield results.pop(n)
+            else:
+                results[n][key] = keywords
+
+    def load_cached(self):
+        """Load the hashes of the texts whose keywords are cached in the
+        database, which keywords checks instead of querying it."""
+        cached = ArticleKeywords.objects.filter(pipeline=pipeline_signature())
+        self._cached = set(cached.values_list("text_hash", flat=True))
+
+    def load_keywords(self, keywords):
+        """
+        Read the keywords cached in the database for the CachedKeywords
+        among the values of a dictionary, and put them in their place.
+
+        Args:
+            keywords: Dictionary mapping keys to keywords, as yielded by
+                keywords_by_chunk
+        """
+        with self._lock:
+            hashes = {
+                value.text_hash
+                for value in keywords.values()
+                if isinstance(value, CachedKeywords)
+            }.difference(self._keywords)
+        if hashes:
+            cached = ArticleKeywords.objects.filter(
+                pipeline=pipeline_signature(), text_hash__in=hashes
+            ).values_list("text_hash", "keywords")
+            with self._lock:
+                for h, item_keywords in cached:
+                    if h not in self._keywords:
+                        self._keywords[h] = item_keywords
+                        self.keywords_cached += 1
+        with self._lock:
+            for key, value in keywords.items():
+                if isinstance(value, CachedKeywords):
+                    keywords[key] = self._keywords[value.text_hash]
+
+    def save_keywords(self):
+        """Add the keywords extracted since the last call to the cache in
+        the database."""
+        with self._lock:
+            extracted, self._extracted = self._extracted, {}
+        ArticleKeywords.objects.bulk_create(
+            [
+                ArticleKeywords(
+                    text_hash=h, pipeline=pipeline_signature(), keywords=keywords
+                )
+                for h, keywords in extracted.items()
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+    def report(self):
+        message = (
+            f"articles: {self.fetched} fetched, {self.reused} reused; "
+            f"keywords: {self.keywords_extracted} extracted, "
+            f"{self.keywords_cached} cached"
+        )
+        return message
@@ -0,0 +1,256 @@
+from concepts.bulk import BATCH_SIZE
+from concepts.models import Item, Link, PendingLink
+from concepts.utils import chunked
+from django.db import transaction
+
+
+class ItemWriter:
+    """
+    Diffs items against the previous snapshot and writes the differences in
+    batches.
+
+    Every item gets a hash of its content, which is compared with the one
+    stored in an ItemIndex: new items are inserted with bulk_create, items
+    whose hash changed are updated with bulk_update and unchanged items are
+    not written at all. When the items come with keywords, an item whose
+    keywords were extracted from another version of its article than the
+    stored ones is changed as well, so that keywords extracted by a later
+    import are written even if nothing else changed. Each batch is written
+    in a single transaction. As with saving items one by one, the first
+    item of an import with a given source and identifier wins. Use as a
+    context manager to write the last batch on exit.
+
+    Items whose article could not be fetched (article_failed is set) keep
+    the article and keywords of their previous version, which are read
+    back with a query per batch before they are diffed. Likewise, updated
+    items whose stored keywords are still current (keywords_current is set)
+    keep them, read back with a query per batch before they are written.
+    """
+
+    def __init__(
+        self,
+        index=None,
+        dry_run=False,
+        keywords=True,
+        batch_size=BATCH_SIZE,
+        on_flush=None,
+        changes=None,
+    ):
+        """
+        Args:
+            index: ItemIndex of the previous snapshot, possibly shared with
+                other writers of the same import (default: load a new one)
+            dry_run: Count the differences without writing them
+            keywords: Whether the items come with the keywords of their
+                articles, which are then updated along with the articles
+            batch_size: Number of written items per transaction
+            on_flush: Function called in the transaction of every batch,
+                e.g. to record the progress of the import
+            changes: ConceptChanges recording the updated and deleted items
+        """
+        self.index = index if index is not None else ItemIndex()
+        self.dry_run = dry_run
+        self.keywords = keywords
+        self.update_fields = (
+            Item.CONTENT_FIELDS + Item.ARTICLE_FIELDS + ["content_hash"]
+        )
+        if keywords:
+            self.update_fields += Item.KEYWORD_FIELDS
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.changes = changes
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self._inserts = []
+        self._updates = []
+        self._failed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, item: Item):
+        key = (item.source, item.identifier)
+        if self.index.was_seen(key):
+            return
+        self.index.mark_seen(key)
+        if getattr(item, "article_failed", False) and key in self.index:
+            self._failed.append(item)
+            if len(self._failed) >= self.batch_size:
+                self._restore_articles()
+            return
+        self._diff(key, item)
+
+    def _diff(self, key, item):
+        item.content_hash = item.compute_content_hash()
+        if key not in self.index:
+            self._inserts.append(item)
+        elif self.index.content_hash(key) != item.content_hash or (
+            self.keywords and self.index.keywords_hash(key) != item.keywords_hash
+        ):
+            item.pk = self.index.get(*key)
+            self._updates.append(item)
+        else:
+            self.unchanged += 1
+        if len(self._inserts) + len(self._updates) >= self.batch_size:
+            self.flush()
+
+    def _restore_articles(self):
+        failed, self._failed = self._failed, []
+        fields = ["article_hash"] + Item.ARTICLE_FIELDS + Item.KEYWORD_FIELDS
+        previous = {
+            pk: values
+            for pk, *values in Item.objects.filter(
+                pk__in=[self.index.get(item.source, item.identifier) for item in failed]
+            ).values_list("id", *fields)
+        }
+        for item in failed:
+            key = (item.source, item.identifier)
+            for field, value in zip(fields, previous[self.index.get(*key)]):
+                setattr(item, field, value)
+            self._diff(key, item)
+
+    def _restore_keywords(self, updates):
+        current = {
+            item.pk: item
+            for item in updates
+            if getattr(item, "keywords_current", False)
+        }
+        if current:
+            previous = Item.objects.filter(pk__in=current).values_list(
+                "id", *Item.KEYWORD_FIELDS
+            )
+            for pk, *values in previous:
+                for field, value in zip(Item.KEYWORD_FIELDS, values):
+                    setattr(current[pk], field, value)
+
+    def flush(self):
+        if self._failed:
+            self._restore_articles()
+        inserts, self._inserts = self._inserts, []
+        updates, self._updates = self._updates, []
+        if not self.dry_run and (inserts or updates):
+            if self.keywords:
+                self._restore_keywords(updates)
+            for item in inserts + updates:
+                item.store_article()
+            with transaction.atomic():
+                Item.objects.bulk_create(inserts, ignore_conflicts=True)
+                Item.objects.bulk_update(updates, self.update_fields)
+                if self.on_flush is not None:
+                    self.on_flush()
+            if self.changes is not None:
+                self.changes.add_items(item.pk for item in updates)
+        self.inserted += len(inserts)
+        self.updated += len(updates)
+
+    def delete_unseen(self, sources):
+        """Delete the items of the given sources that were in the previous
+        snapshot but not in this one, together with their links. Links to
+        them from the items of other imports become pending links, which
+        are created again if the items come back."""
+        self.flush()
+        pks = self.index.unseen(sources)
+        if not self.dry_run:
+            for batch in chunked(pks, self.batch_size):
+                if self.changes is not None:
+                    self.changes.add_concepts(
+                        Item.objects.filter(pk__in=batch)
+                        .exclude(concept=None)
+                        .values_list("concept_id", flat=True)
+                    )
+                with transaction.atomic():
+                    self._keep_pending(batch, sources)
+                    Item.objects.filter(pk__in=batch).delete()
+        self.deleted += len(pks)
+
+    def _keep_pending(self, batch, sources):
+        links = (
+            Link.objects.filter(destination__in=batch)
+            .exclude(source__source__in=sources)
+            # recomputed by link_same rather than imported
+            .exclude(label=Link.Label.NAME_EQ)
+            .values_list(
+                "source_id", "destination__source", "destination__identifier", "label"
+            )
+        )
+        PendingLink.objects.bulk_create(
+            [
+                PendingLink(
+                    source_id=source_id,
+                    destination_source=destination_source,
+                    destination_identifier=identifier,
+                    label=label,
+                )
+                for source_id, destination_source, identifier, label in links
+            ],
+            ignore_conflicts=True,
+        )
+
+    def report(self):
+        message = (
+            f"items: {self.inserted} inserted, {self.updated} updated, "
+            f"{self.unchanged} unchanged, {self.deleted} deleted"
+        )
+        return message
+
+
+class ItemIndex:
+    """
+    In-memory map from (source, identifier) to item id, content hash and
+    keywords hash, loaded with a single query.
+
+    During an import it holds the previous snapshot that new items are
+    diffed against, and serves as an identity map: it records which items
+    the import has already produced, so that raw items do not have to ask
+    the database. Once the items are written, a fresh index resolves link
+    endpoints.
+    """
+
+    def __init__(self):
+        self._items = {
+            (source, identifier): (pk, content_hash, keywords_hash)
+            for pk, source, identifier, content_hash, keywords_hash in (
+                Item.objects.values_list(
+                    "id", "source", "identifier", "content_hash", "keywords_hash"
+                ).iterator()
+            )
+        }
+        self._seen = set()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, source, identifier):
+        pk, _, _ = self._items.get((source, identifier), (None, None, None))
+        return pk
+
+    def content_hash(self, key):
+        _, content_hash, _ = self._items.get(key, (None, None, None))
+        return content_hash
+
+    def keywords_hash(self, key):
+        """article_hash of the article the stored keywords of the item were
+        extracted from."""
+        _, _, keywords_hash = self._items.get(key, (None, None, None))
+        return keywords_hash
+
+    def mark_seen(self, key):
+        self._seen.add(key)
+
+    def was_seen(self, key):
+        return key in self._seen
+
+    def unseen(self, sources):
+        """Ids of the indexed items of the given sources that the import has
+        not produced."""
+        return [
+            pk
+            for (source, identifier), (pk, _, _) in self._items.items()
+            if source in sources and (source, identifier) not in self._seen
+        ]
@@ -0,0 +1,73 @@
+from concepts.models import ImportCheckpoint
+
+
+class Checkpoint:
+    """Progress of one step of an import run."""
+
+    def __init__(self, row, enabled):
+        self._row = row
+        self._enabled = enabled
+
+    @property
+    def position(self):
+        return self._row.position
+
+    @property
+    def marker(self):
+        return self._row.marker
+
+    @property
+    def done(self):
+        return self._row.done
+
+    def save(self, **fields):
+        """Record progress. Call this in the transaction writing the data
+        that it covers, so that both are committed together."""
+        for name, value in fields.items():
+            setattr(self._row, name, value)
+        if self._enabled:
+            self._row.save()
+
+
+class ImportRun:
+    """
+    Checkpoints of the steps of an import, e.g. one per slurper, which let
+    an interrupted import resume from the last batch that it committed
+    instead of starting over. Responses are replayed from the HTTP cache
+    when resuming, so the results that were fetched but not written yet
+    are not downloaded again either.
+    """
+
+    def __init__(self, name, resume=False, dry_run=False):
+        """
+        Args:
+            name: Name of the import, which should include the options that
+                select what it imports
+            resume: Continue from the checkpoints of a previous run with the
+                same name instead of discarding them
+            dry_run: Read the checkpoints, but never write them
+        """
+        self.name = name
+        self.dry_run = dry_run
+        rows = ImportCheckpoint.objects.filter(run=name)
+        if resume:
+            self._rows = {row.step: row for row in rows}
+        else:
+            if not dry_run:
+                rows.delete()
+            self._rows = {}
+
+    @property
+    def resumed(self):
+        """Steps with progress recorded by a previous run."""
+        return sorted(self._rows)
+
+    def checkpoint(self, step):
+        if step not in self._rows:
+            self._rows[step] = ImportCheckpoint(run=self.name, step=step)
+        return Checkpoint(self._rows[step], enabled=not self.dry_run)
+
+    def finish(self):
+        """Forget the checkpoints of a completed run."""
+        if not self.dry_run:
+            ImportCheckpoint.objects.filter(run=self.name).delete()
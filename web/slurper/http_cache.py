@@ -0,0 +1,343 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+from slurper.http_client import shared_client
+
+# response headers worth keeping alongside the cached body
+_KEPT_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class OfflineCacheMiss(requests.exceptions.RequestException):
+    """Raised in offline mode when a request has no cached response."""
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of HTTP GET responses.
+
+    Response bodies are stored once per content hash under ``blobs/``, and
+    each request (URL, parameters and Accept header) has a small JSON entry
+    under ``entries/`` pointing to its body. Entries younger than the TTL are
+    served directly, older ones are revalidated with their ETag or
+    Last-Modified date. Once the bodies exceed the size bound, the least
+    recently used entries are evicted. In offline mode the cache is never
+    bypassed and stale entries are served as they are.
+    """
+
+    def __init__(self, directory, ttl, max_size, offline=False, client=None):
+        self.directory = Path(directory)
+        self.client = client or shared_client()
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._size = None
+
+    def get(
+        self, url, params=None, headers=None, timeout=None, limiter=None, stream=False
+    ):
+        """
+        Perform a GET request through the cache.
+
+        Args:
+            url: The requested URL
+            params: Optional query parameters
+            headers: Optional request headers
+            timeout: Timeout of the request (default: the client's timeout)
+            limiter: Optional rate limiter, only consulted when the request
+                actually goes over the network
+            stream: Leave the body to be read from response.raw, in which
+                case a fresh body is stored as it is read
+
+        Returns:
+            A requests.Response, either fresh from the network or
+            rebuilt from the cache (in which case from_cache is set)
+
+        Raises:
+            OfflineCacheMiss: In offline mode, if the response is not cached
+        """
+        headers = dict(headers or {})
+        key = self._key(url, params, headers)
+        entry = self._read_entry(key)
+
+        if entry is not None and (
+            self.offline or time.time() - entry["fetched_at"] < self.ttl
+        ):
+            return self._cached_response(key, entry, stream)
+        if self.offline:
+            raise OfflineCacheMiss(f"No cached response for {url}")
+
+        if entry is not None:
+            if "ETag" in entry["headers"]:
+                headers["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        if limiter is not None:
+            limiter.acquire()
+        response = self.client.get(
+            url, params=params, headers=headers, timeout=timeout, stream=stream
+        )
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            entry["fetched_at"] = time.time()
+            self._write_entry(key, entry)
+            return self._cached_response(key, entry, stream)
+        if response.status_code == 200:
+            if stream:
+                response.raw = io.BufferedReader(
+                    _StoringReader(self, key, url, params, response)
+                )
+            else:
+                self._store(key, url, params, response)
+        response.from_cache = False
+        return response
+
+    @staticmethod
+    def _key(url, params, headers):
+        request = [url, sorted((params or {}).items()), headers.get("Accept")]
+        return hashlib.sha256(json.dumps(request).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return self.directory / "entries" / key[:2] / f"{key}.json"
+
+    def _blob_path(self, digest):
+        return self.directory / "blobs" / digest[:2] / digest
+
+    def _read_entry(self, key):
+        try:
+            with open(self._entry_path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._blob_path(entry["blob"]).exists():
+            return None
+        return entry
+
+    def _write_entry(self, key, entry):
+        self._write_atomically(self._entry_path(key), json.dumps(entry).encode("utf-8"))
+
+    @staticmethod
+    def _write_atomically(path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _store(self, key, url, params, response):
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        new_blob = not blob_path.exists()
+        if new_blob:
+            self._write_atomically(blob_path, content)
+        self._add_entry(key, url, params, response, digest, len(content) * new_blob)
+
+    def _add_entry(self, key, url, params, response, digest, added_size):
+        self._write_entry(
+            key,
+            {
+                "url": url,
+                "params": params,
+                "blob": digest,
+                "encoding": response.encoding,
+                "fetched_at": time.time(),
+                "headers": {
+                    name: response.headers[name]
+                    for name in _KEPT_HEADERS
+                    if name in response.headers
+                },
+            },
+        )
+        if added_size:
+            with self._lock:
+                if self._size is not None:
+                    self._size += added_size
+                if self.size() > self.max_size:
+                    self.evict()
+
+    def _cached_response(self, key, entry, stream=False):
+        # mark as recently used for eviction
+        try:
+            os.utime(self._entry_path(key))
+        except OSError:
+            pass
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry["url"]
+        response.encoding = entry["encoding"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        if stream:
+            response.raw = open(self._blob_path(entry["blob"]), "rb")
+        else:
+            response._content = self._blob_path(entry["blob"]).read_bytes()
+        response.from_cache = True
+        return response
+
+    def size(self):
+        """Total size of the stored bodies in bytes."""
+        if self._size is None:
+            self._size = sum(
+                path.stat().st_size for path in self.directory.glob("blobs/*/*")
+            )
+        return self._size
+
+    def evict(self):
+        """Evict least recently used entries until the bodies fit in 90% of
+        the size bound, then remove the bodies no entry refers to anymore."""
+        entries = []
+        for path in self.directory.glob("entries/*/*.json"):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entries.append((path.stat().st_mtime, path, json.load(f)["blob"]))
+            except (OSError, ValueError):
+                path.unlink(missing_ok=True)
+        entries.sort(key=lambda entry: entry[0])
+
+        blob_users = {}
+        for _, _, digest in entries:
+            blob_users[digest] = blob_users.get(digest, 0) + 1
+        size = self.size()
+        target = 0.9 * self.max_size
+        evicted = 0
+        for _, path, digest in entries:
+            if size <= target:
+                break
+            path.unlink(missing_ok=True)
+            evicted += 1
+            blob_users[digest] -= 1
+            if blob_users[digest] == 0:
+                blob_path = self._blob_path(digest)
+                try:
+                    size -= blob_path.stat().st_size
+                    blob_path.unlink()
+                except OSError:
+                    pass
+        for blob_path in self.directory.glob("blobs/*/*"):
+            # skip temporary files of blobs still being written
+            if len(blob_path.name) == 64 and blob_path.name not in blob_users:
+                size -= blob_path.stat().st_size
+                blob_path.unlink(missing_ok=True)
+        self._size = size
+        logging.log(
+            logging.INFO,
+            f"Evicted {evicted} cached responses, {size} bytes remaining.",
+        )
+
+
+class _StoringReader(io.RawIOBase):
+    """
+    Reads the body of a streamed response and stores it in the cache at
+    the same time. The body is written to a temporary file next to the
+    blobs, and becomes a blob with an entry once it has been read to the
+    end; a body that is closed before is discarded.
+    """
+
+    def __init__(self, cache, key, url, params, response):
+        self.cache = cache
+        self.key = key
+        self.url = url
+        self.params = params
+        self.response = response
+        self._raw = response.raw
+        self._hash = hashlib.sha256()
+        self._size = 0
+        directory = cache.directory / "blobs"
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory)
+        self._file = os.fdopen(fd, "wb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._raw.read(len(buffer))
+        if not data:
+            self._finish()
+            return 0
+        buffer[: len(data)] = data
+        self._file.write(data)
+        self._hash.update(data)
+        self._size += len(data)
+        return len(data)
+
+    def _finish(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        digest = self._hash.hexdigest()
+        blob_path = self.cache._blob_path(digest)
+        if blob_path.exists():
+            os.unlink(self._tmp_path)
+            added_size = 0
+        else:
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self._tmp_path, blob_path)
+            added_size = self._size
+        self.cache._add_entry(
+            self.key, self.url, self.params, self.response, digest, added_size
+        )
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            os.unlink(self._tmp_path)
+        self._raw.close()
+        super().close()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache():
+    """The response cache shared by all slurpers, configured in settings."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache(
+                settings.HTTP_CACHE_DIR,
+                ttl=settings.HTTP_CACHE_TTL,
+                max_size=settings.HTTP_CACHE_MAX_SIZE,
+            )
+        return _shared_cache
+
+
+def use_cache(cache):
+    """Replace the shared cache, e.g. by one replaying recorded responses.
+
+    Returns:
+        The cache used before
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        previous, _shared_cache = _shared_cache, cache
+    return previous
+
+
+def set_offline(offline):
+    """Switch the shared cache to replaying responses without any network."""
+    shared_cache().offline = offline
+    if offline:
+        logging.log(logging.INFO, "Offline mode: replaying cached responses only.")
+
+
+def get(url, params=None, headers=None, timeout=None, limiter=None, stream=False):
+    return shared_cache().get(
+        url,
+        params=params,
+        headers=headers,
+        timeout=timeout,
+        limiter=limiter,
+        stream=stream,
+    )
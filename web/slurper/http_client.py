@@ -0,0 +1,146 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from web.settings import WIKIPEDIA_CONTACT_EMAIL
+
+# (connect, read) timeout in seconds of requests that do not set their own
+DEFAULT_TIMEOUT = (5, 30)
+# Maximum number of requests in flight to a single host
+DEFAULT_HOST_CONCURRENCY = 8
+# WDQS allows a handful of parallel queries per client
+WDQS_CONCURRENCY = 5
+HOST_CONCURRENCY = {"query.wikidata.org": WDQS_CONCURRENCY}
+
+
+class HttpClient:
+    """
+    HTTP client shared by everything that talks to the network.
+
+    Every host gets its own session, so connections are pooled and kept
+    alive across requests, and a semaphore bounding the number of requests
+    in flight to it, counting streamed responses until their body is
+    closed. All requests identify us with the same User-Agent and
+    accept every compression the installed urllib3 can decode (gzip and
+    deflate, plus brotli and zstd if their packages are installed).
+    """
+
+    def __init__(
+        self,
+        timeout=DEFAULT_TIMEOUT,
+        host_concurrency=None,
+        default_host_concurrency=DEFAULT_HOST_CONCURRENCY,
+    ):
+        self.timeout = timeout
+        self.host_concurrency = (
+            HOST_CONCURRENCY if host_concurrency is None else host_concurrency
+        )
+        self.default_host_concurrency = default_host_concurrency
+        self._sessions = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _concurrency(self, host):
+        return self.host_concurrency.get(host, self.default_host_concurrency)
+
+    def _session(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                # one pool per session, as the session only talks to one host
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self._concurrency(host)
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(
+                    {
+                        "User-Agent": f"MathSwitch/1.0 ({WIKIPEDIA_CONTACT_EMAIL})",
+                        "Accept-Encoding": ACCEPT_ENCODING,
+                    }
+                )
+                self._sessions[host] = session
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    self._concurrency(host)
+                )
+            return self._sessions[host], self._semaphores[host]
+
+    def get(self, url, params=None, headers=None, timeout=None, stream=False):
+        """
+        Perform a GET request.
+
+        Args:
+            url: The requested URL
+            params: Optional query parameters
+            headers: Optional request headers
+            timeout: Timeout of the request (default: the client's timeout)
+            stream: Leave the body to be read, decompressed, from
+                response.raw, which keeps the slot of the request until
+                it is closed
+
+        Returns:
+            A requests.Response
+        """
+        session, semaphore = self._session(urlsplit(url).netloc)
+        semaphore.acquire()
+        try:
+            response = session.get(
+                url,
+                params=params,
+                headers=headers,
+                timeout=self.timeout if timeout is None else timeout,
+                stream=stream,
+            )
+            if not stream:
+                # read the body while holding the slot
+                response.content
+        except BaseException:
+            semaphore.release()
+            raise
+        if not stream:
+            semaphore.release()
+            return response
+        response.raw.decode_content = True
+        _release_on_close(response.raw, semaphore)
+        return response
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._semaphores.clear()
+
+
+def _release_on_close(raw, semaphore):
+    """Release the slot of a streamed response once its body is closed,
+    which also happens when it is garbage collected, so that bodies are
+    not read outside the limit of their host."""
+    close = raw.close
+    released = threading.Lock()
+
+    def release_and_close():
+        try:
+            close()
+        finally:
+            # only once, however many times the body is closed
+            if released.acquire(blocking=False):
+                semaphore.release()
+
+    raw.close = release_and_close
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def shared_client():
+    """The HTTP client shared by all slurpers."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
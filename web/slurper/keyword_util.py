@@ -1,22 +1,56 @@
+import threading
+
 import spacy
 
+from web.settings import NLP_MAX_LENGTH, NLP_PROFILE
+
 # TODO SST: Move to readme.md
 # Load the scientific English model from scispacy
 # Note: You need to download this model first with:
 #  make install-scispacy
 
+NLP_MODEL = "en_core_sci_lg"
+# Components left out of the pipeline by each profile: keyword extraction
+# only looks at the entities, which the tagger, parser and lemmatizer do not
+# contribute to
+PROFILES = {
+    "ner": ["tagger", "attribute_ruler", "lemmatizer", "parser"],
+    "full": [],
+}
+
+# Number of texts spaCy processes at once
+NLP_BATCH_SIZE = 32
+# Number of processes running spaCy in batch extraction (1: this process)
+NLP_PROCESSES = 1
+
 # Lazy-loaded spaCy model
 _nlp = None
+_nlp_lock = threading.Lock()
 
 
 def _get_nlp():
     """Lazy-load the spaCy model only when needed."""
     global _nlp
-    if _nlp is None:
-        _nlp = spacy.load("en_core_sci_lg")
+    with _nlp_lock:
+        if _nlp is None:
+            _nlp = spacy.load(NLP_MODEL, exclude=PROFILES[NLP_PROFILE])
     return _nlp
 
 
+def pipeline_signature():
+    """Identifies the pipeline extracting keywords, so that keywords cached
+    from a different pipeline are not reused."""
+    return f"{NLP_MODEL}:{NLP_PROFILE}:{NLP_MAX_LENGTH}"
+
+
+def _truncate(text):
+    """Cut the text to the configured maximum length, at a word boundary."""
+    if not NLP_MAX_LENGTH or len(text) <= NLP_MAX_LENGTH:
+        return text
+    cut = text.rfind(" ", 0, NLP_MAX_LENGTH + 1)
+    return text[: cut if cut > 0 else NLP_MAX_LENGTH]
+
+
 def extract_keywords(text):
     """
     Extract keywords from text using spaCy's named entity recognition.
@@ -31,5 +65,36 @@ def extract_keywords(text):
         return []
 
     nlp = _get_nlp()
-    doc = nlp(text)
+    doc = nlp(_truncate(text))
     return doc.ents
+
+
+def _keywords_as_string(entities):
+    keyword_list = [entity.text.lower() for entity in entities]
+    return ", ".join(keyword_list) if keyword_list else None
+
+
+def extract_keywords_batch(pairs, batch_size=NLP_BATCH_SIZE, n_process=NLP_PROCESSES):
+    """
+    Extract keywords from many texts, which spaCy processes in batches and,
+    if n_process is greater than 1, in several processes at the same time.
+
+    Args:
+        pairs: Iterable of (key, text) pairs, consumed lazily. Keys are sent
+            to the other processes, so they have to be small and picklable.
+        batch_size: Number of texts processed at once
+        n_process: Number of processes
+
+    Yields:
+        (key, keywords) pairs in the order of the input, with the keywords
+        lowercased and separated by commas, or None if there are none
+    """
+    nlp = _get_nlp()
+    docs = nlp.pipe(
+        ((_truncate(text or ""), key) for key, text in pairs),
+        as_tuples=True,
+        batch_size=batch_size,
+        n_process=n_process,
+    )
+    for doc, key in docs:
+        yield key, _keywords_as_string(doc.ents)
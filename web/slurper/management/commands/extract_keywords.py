@@ -0,0 +1,100 @@
+from collections import deque
+
+from concepts.models import Item
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from slurper.article_store import ArticleStore
+from slurper.keyword_util import NLP_BATCH_SIZE, NLP_PROCESSES
+
+# Number of items whose keywords are written in one transaction
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Extract the keywords of the items whose articles have no keywords yet "
+        "or changed since their keywords were extracted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of items whose keywords are saved together",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=NLP_PROCESSES,
+            help="Number of processes extracting keywords",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=NLP_BATCH_SIZE,
+            help="Number of articles spaCy processes at once",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Stop after this many items",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Extract the keywords of all items with an article, e.g. after "
+            "changing NLP_PROFILE",
+        )
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(article_hash=None)
+        if not options["force"]:
+            items = items.without_keywords()
+        items = items.only("id", "article_offset", "article_length", "article_hash")
+        total = items.count()
+        if options["limit"] is not None:
+            total = min(total, options["limit"])
+        store = ArticleStore(
+            nlp_batch_size=options["batch_size"], nlp_processes=options["workers"]
+        )
+        chunk_size = options["chunk_size"]
+
+        def chunks():
+            # Chunks are read by increasing id, so that a run that is
+            # interrupted loses at most the chunk in progress: the saved
+            # chunks drop out of without_keywords, and with --force the run
+            # has to be started over.
+            last_pk = 0
+            remaining = total
+            while remaining > 0:
+                chunk = list(
+                    items.filter(pk__gt=last_pk).order_by("pk")[
+                        : min(chunk_size, remaining)
+                    ]
+                )
+                if not chunk:
+                    return
+                last_pk = chunk[-1].pk
+                remaining -= len(chunk)
+                in_flight.append(chunk)
+                yield [(item.pk, item.article_text) for item in chunk]
+
+        in_flight = deque()
+        done = 0
+        for keywords in store.keywords_by_chunk(chunks()):
+            chunk = in_flight.popleft()
+            store.load_keywords(keywords)
+            for item in chunk:
+                item.keywords = keywords[item.pk]
+                item.keywords_hash = item.article_hash
+            with transaction.atomic():
+                Item.objects.bulk_update(chunk, Item.KEYWORD_FIELDS)
+                store.save_keywords()
+            done += len(chunk)
+            self.stdout.write(f"\r  keywords {done}/{total}".ljust(50), ending="")
+        self.stdout.write(
+            f"\r  done: {done} items, keywords {store.keywords_extracted} "
+            f"extracted, {store.keywords_cached} cached.".ljust(60)
+        )
@@ -1,7 +1,51 @@
+from concepts.bulk import ConceptChanges
 from django.core.management.base import BaseCommand
-from slurper import source_agda_unimath
+from slurper import http_cache, source_agda_unimath
+from slurper.checkpoint import ImportRun
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            action="append",
+            dest="sources",
+            choices=source_agda_unimath.SLURPERS.names(),
+            help="Only import from the named slurper (repeatable, default: all)",
+        )
+        parser.add_argument(
+            "--offline",
+            action="store_true",
+            help="Replay responses from the HTTP cache without using the network",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be inserted, updated and deleted",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted import with the same --source options "
+            "from its last checkpoint",
+        )
+
     def handle(self, *args, **options):
-        source_agda_unimath.AU_SLURPER.save_items()
+        http_cache.set_offline(options["offline"])
+        run = ImportRun(
+            ":".join(["import_agda_unimath", *sorted(options["sources"] or [])]),
+            options["resume"],
+            options["dry_run"],
+        )
+        slurpers = source_agda_unimath.SLURPERS.create(options["sources"])
+        changes = ConceptChanges(options["dry_run"])
+        for name, slurper in slurpers.items():
+            writer, links = slurper.save_items(
+                options["dry_run"], run.checkpoint(name), changes
+            )
+            self.stdout.write(f"  {writer.report()}")
+            if links is not None:
+                self.stdout.write(f"  {links.report()}")
+        changes.apply()
+        self.stdout.write(f"  {changes.report()}")
+        run.finish()
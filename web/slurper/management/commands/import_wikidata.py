@@ -1,15 +1,179 @@
+from concepts.bulk import ConceptChanges, LinkWriter
+from concepts.models import Link, PendingLink
 from django.core.management.base import BaseCommand
-from slurper import source_wikidata
+from slurper import http_cache, source_wikidata, wikidata_dump
+from slurper.article_store import ArticleStore
+from slurper.bulk import ItemIndex, ItemWriter
+from slurper.checkpoint import ImportRun
+from slurper.http_client import WDQS_CONCURRENCY
+from slurper.keyword_util import NLP_PROCESSES
+from slurper.sparql_results import RESULT_FORMATS
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            action="append",
+            dest="sources",
+            choices=source_wikidata.SLURPERS.names(),
+            help="Only import from the named slurper (repeatable, default: all)",
+        )
+        parser.add_argument(
+            "--offline",
+            action="store_true",
+            help="Replay responses from the HTTP cache without using the network",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=WDQS_CONCURRENCY,
+            help="Maximum number of SPARQL queries running at the same time",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=source_wikidata.SPARQL_TIMEOUT[1],
+            help="Read timeout of a single SPARQL query in seconds",
+        )
+        parser.add_argument(
+            "--dump",
+            default=None,
+            help="Select the items from this Wikidata JSON dump (.json, .json.gz or "
+            ".json.bz2) instead of querying WDQS",
+        )
+        parser.add_argument(
+            "--dump-processes",
+            type=int,
+            default=wikidata_dump.DUMP_PROCESSES,
+            help="Number of processes parsing the dump",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=None,
+            help="Split every query into this many queries by item id, at most 10 "
+            f"(default: {source_wikidata.TOPIC_SHARDS} for the topic queries, "
+            "1 for the others)",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=None,
+            help="Stream results in pages of this size instead of all at once",
+        )
+        parser.add_argument(
+            "--result-format",
+            choices=list(RESULT_FORMATS),
+            default="csv",
+            help="Result format used for paged queries",
+        )
+        parser.add_argument(
+            "--nlp-processes",
+            type=int,
+            default=NLP_PROCESSES,
+            help="Number of processes extracting keywords from articles",
+        )
+        parser.add_argument(
+            "--skip-keywords",
+            action="store_true",
+            help="Leave keyword extraction to the extract_keywords command",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be inserted, updated and deleted",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted import with the same --source options "
+            "from its last checkpoint",
+        )
+
     def handle(self, *args, **options):
-        print("\r  waiting for Wikidata", end="")
-        n = len(source_wikidata.SLURPERS)
-        for i, slurper in enumerate(source_wikidata.SLURPERS):
-            print(f"\r  items {i}/{n}: {slurper.source.label}".ljust(50), end="")
-            slurper.save_items()
-        for i, slurper in enumerate(source_wikidata.SLURPERS):
-            print(f"\r  links {i}/{n}: {slurper.source.label}".ljust(50), end="")
-            slurper.save_links()
-        print("\r  done.".ljust(60))
+        http_cache.set_offline(options["offline"])
+        article_store = ArticleStore(nlp_processes=options["nlp_processes"])
+        # by default, slurpers keep their own number of shards
+        shards = {} if options["shards"] is None else {"shards": options["shards"]}
+        slurpers = source_wikidata.SLURPERS.create(
+            options["sources"],
+            timeout=(source_wikidata.SPARQL_TIMEOUT[0], options["timeout"]),
+            page_size=options["page_size"],
+            result_format=options["result_format"],
+            # each article is fetched and analysed once for all slurpers
+            article_store=article_store,
+            # a single database query for all slurpers
+            excluded_categories=source_wikidata.excluded_categories(),
+            **shards,
+        )
+        dry_run = options["dry_run"]
+        run = ImportRun(
+            ":".join(["import_wikidata", *sorted(options["sources"] or [])]),
+            options["resume"],
+            dry_run,
+        )
+        if run.resumed:
+            self.stdout.write(f"  resuming: {', '.join(run.resumed)}")
+        if options["dump"] is None:
+            self.stdout.write("\r  waiting for Wikidata", ending="")
+            results = source_wikidata.fetch_concurrently(
+                slurpers, options["concurrency"]
+            )
+        else:
+            self.stdout.write(f"\r  reading {options['dump']}", ending="")
+            results = source_wikidata.fetch_from_dump(
+                slurpers, options["dump"], options["dump_processes"]
+            )
+        n = len(slurpers)
+        fetched = {}
+        # components of the concepts that the import touches
+        changes = ConceptChanges(dry_run)
+        # previous snapshot and identity map of the items, shared by all slurpers
+        index = ItemIndex()
+        writers = []
+        for i, (name, slurper) in enumerate(results):
+            self.stdout.write(f"\r  items {i}/{n}: {name}".ljust(50), ending="")
+            writers.append(
+                slurper.save_items(
+                    index,
+                    dry_run,
+                    not options["skip_keywords"],
+                    checkpoint=run.checkpoint(name),
+                    changes=changes,
+                )
+            )
+            fetched[name] = slurper
+        # only a complete import of all slurpers knows what has disappeared
+        complete = options["sources"] is None and len(fetched) == n
+        deletion = run.checkpoint("delete")
+        if complete and not deletion.done:
+            with ItemWriter(index, dry_run, changes=changes) as writer:
+                writer.delete_unseen(source_wikidata.SOURCES)
+            writers.append(writer)
+            deletion.save(done=True)
+        # reload to learn the ids of the new items
+        index = ItemIndex()
+        labels = [Link.Label.WIKIDATA] if complete else []
+        # writing the links is a single transaction, so it is all or nothing
+        with LinkWriter(labels, dry_run, changes=changes) as links:
+            for i, (name, slurper) in enumerate(fetched.items()):
+                self.stdout.write(f"\r  links {i}/{n}: {name}".ljust(50), ending="")
+                slurper.save_links(index, links)
+        # links of other imports waiting for the items imported now
+        resolved = 0 if dry_run else PendingLink.objects.resolve(changes)
+        changes.apply()
+        if len(fetched) == n:
+            run.finish()
+        inserted, updated, unchanged, deleted = (
+            sum(getattr(writer, counter) for writer in writers)
+            for counter in ("inserted", "updated", "unchanged", "deleted")
+        )
+        self.stdout.write(
+            f"\r  {'dry run' if dry_run else 'done'}: items {inserted} inserted, "
+            f"{updated} updated, {unchanged} unchanged, {deleted} deleted; "
+            f"links {links.inserted} inserted, {links.deleted} deleted, "
+            f"{resolved} pending resolved.".ljust(60)
+        )
+        self.stdout.write(f"  {changes.report()}")
+        self.stdout.write(f"  {article_store.report()}")
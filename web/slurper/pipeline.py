@@ -0,0 +1,196 @@
+import queue
+import threading
+from collections import deque
+
+# Number of elements buffered between two stages
+QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Runs elements through a chain of concurrent stages.
+
+    A producer thread feeds the elements of a source into the first stage.
+    Every stage is a pool of worker threads applying a function to each
+    element and passing the result on, or a single thread running a function
+    over the stream of all elements, and the results of the last stage
+    are handed to a sink on the calling thread. Stages are connected by
+    bounded queues, so a slow stage holds back the ones before it instead of
+    letting work pile up in memory. Since only the calling thread runs the
+    sink, it is the natural place for database writes.
+
+    If any stage or the sink fails, all threads stop and the error is raised
+    from run.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stages = []
+
+    def add_stage(self, function, workers=1):
+        self.stages.append((function, workers))
+
+    def add_stream_stage(self, function):
+        """Add a stage calling function once with an iterator over all the
+        elements, passing on the elements of the iterator it returns. This
+        suits work done in batches across elements. The iterator must yield
+        one result per element, in the same order."""
+        self.stages.append((function, None))
+
+    def run(self, source, sink, ordered=False):
+        """
+        Run the elements of source through the stages into sink.
+
+        Args:
+            source: Iterable of elements
+            sink: Function called with every result on this thread
+            ordered: Hand the results to the sink in the order of their
+                elements, rather than as soon as they are done, which
+                workers of a stage may finish out of order
+        """
+        self._cancelled = threading.Event()
+        self._errors = []
+        stages = self.stages
+        if ordered:
+            source = enumerate(source)
+            stages = [_numbered(function, workers) for function, workers in stages]
+            sink = _Reorder(sink)
+        queues = [queue.Queue(self.queue_size) for _ in range(len(stages) + 1)]
+        threads = [threading.Thread(target=self._produce, args=(source, queues[0]))]
+        for (function, workers), in_queue, out_queue in zip(stages, queues, queues[1:]):
+            if workers is None:
+                threads.append(
+                    threading.Thread(
+                        target=self._stream, args=(function, in_queue, out_queue)
+                    )
+                )
+                continue
+            running = _Counter(workers)
+            threads += [
+                threading.Thread(
+                    target=self._work,
+                    args=(function, in_queue, out_queue, running),
+                )
+                for _ in range(workers)
+            ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while (element := self._get(queues[-1])) is not _DONE:
+                sink(element)
+        except BaseException:
+            self._cancelled.set()
+            raise
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def _fail(self, error):
+        self._errors.append(error)
+        self._cancelled.set()
+
+    def _put(self, q, element):
+        while not self._cancelled.is_set():
+            try:
+                q.put(element, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._cancelled.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _produce(self, source, out_queue):
+        try:
+            for element in source:
+                if not self._put(out_queue, element):
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        self._put(out_queue, _DONE)
+
+    def _stream(self, function, in_queue, out_queue):
+        def elements():
+            while (element := self._get(in_queue)) is not _DONE:
+                yield element
+
+        try:
+            for result in function(elements()):
+                if not self._put(out_queue, result):
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        self._put(out_queue, _DONE)
+
+    def _work(self, function, in_queue, out_queue, running):
+        while (element := self._get(in_queue)) is not _DONE:
+            try:
+                result = function(element)
+            except Exception as e:
+                self._fail(e)
+                return
+            if not self._put(out_queue, result):
+                return
+        # let the other workers of this stage know as well
+        self._put(in_queue, _DONE)
+        if running.decrement() == 0:
+            self._put(out_queue, _DONE)
+
+
+def _numbered(function, workers):
+    """Stage applying function to numbered elements, keeping their numbers."""
+    if workers is not None:
+        return (lambda element: (element[0], function(element[1])), workers)
+
+    def stream(elements):
+        numbers = deque()
+
+        def unnumbered():
+            for number, element in elements:
+                numbers.append(number)
+                yield element
+
+        for result in function(unnumbered()):
+            yield numbers.popleft(), result
+
+    return (stream, None)
+
+
+class _Reorder:
+    """Sink passing numbered results on to another sink in order."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.next = 0
+        self.pending = {}
+
+    def __call__(self, element):
+        number, result = element
+        self.pending[number] = result
+        while self.next in self.pending:
+            self.sink(self.pending.pop(self.next))
+            self.next += 1
+
+
+class _Counter:
+    def __init__(self, value):
+        self.value = value
+        self._lock = threading.Lock()
+
+    def decrement(self):
+        with self._lock:
+            self.value -= 1
+            return self.value
@@ -0,0 +1,41 @@
+class SlurperRegistry:
+    """
+    Named slurper definitions that are only instantiated on demand.
+
+    Registering a slurper stores a factory, so importing a source module
+    never touches the network or the database. Slurpers themselves fetch
+    their data the first time a stage asks for it.
+    """
+
+    def __init__(self):
+        self._factories = {}
+
+    def register(self, name, factory):
+        if name in self._factories:
+            raise ValueError(f"Slurper '{name}' is already registered.")
+        self._factories[name] = factory
+
+    def names(self):
+        return list(self._factories)
+
+    def create(self, names=None, **kwargs):
+        """
+        Instantiate slurpers in registration order.
+
+        Args:
+            names: Optional list of slurper names to instantiate (default: all)
+            kwargs: Extra keyword arguments passed on to every slurper
+
+        Returns:
+            A dictionary mapping slurper names to fresh slurper instances
+        """
+        if names is None:
+            names = self.names()
+        unknown = [name for name in names if name not in self._factories]
+        if unknown:
+            raise ValueError(f"Unknown slurper(s): {', '.join(unknown)}")
+        return {
+            name: factory(**kwargs)
+            for name, factory in self._factories.items()
+            if name in names
+        }
@@ -0,0 +1,219 @@
+import contextlib
+import csv
+import io
+import json
+import re
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from concepts.blob_store import BlobStore, use_store
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+from slurper import http_cache, wikipedia
+from slurper.rate_limit import TokenBucket
+from slurper.source_wikidata import SOURCE_QUERIES, TOPIC_QUERIES
+from slurper.wd_raw_item import WD_OTHER_SOURCES
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "benchmark"
+
+# Separates an identifier from the number of its copy
+_COPY = "~"
+_LIMIT = re.compile(r"LIMIT (\d+)\s*$")
+_AFTER = re.compile(r'FILTER\(STR\(\?item\) > "([^"]*)"\)')
+_SHARD_DIGIT = re.compile(r'STRENDS\(STR\(\?item\), "(\d)"\)')
+
+
+def _copy(value, k):
+    return value if k == 0 else f"{value}{_COPY}{k}"
+
+
+class FixtureClient:
+    """
+    Stands in for HttpClient, answering requests to WDQS, the MediaWiki API
+    and Agda Unimath from responses recorded in a fixtures directory.
+
+    The recorded items are replayed `scale` times. Every copy but the first
+    has its identifiers, names and articles suffixed with its number, so
+    that copies are distinct items with distinct articles, linked among
+    themselves as the originals are.
+    """
+
+    def __init__(self, scale=1, directory=FIXTURES_DIR):
+        directory = Path(directory)
+        self.scale = scale
+        with open(directory / "wdqs.json", encoding="utf-8") as f:
+            self.sparql_results = json.load(f)
+        with open(directory / "mediawiki.json", encoding="utf-8") as f:
+            self.articles = json.load(f)
+        with open(directory / "agda_unimath.json", encoding="utf-8") as f:
+            self.concept_index = json.load(f)
+        self.queries = {
+            **TOPIC_QUERIES,
+            **{
+                WD_OTHER_SOURCES[source]["slug"]: query
+                for source, query in SOURCE_QUERIES.items()
+            },
+        }
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None, timeout=None, stream=False):
+        with self._lock:
+            self.requests += 1
+        params = params or {}
+        headers = headers or {}
+        host = urlsplit(url).netloc
+        if host == "query.wikidata.org":
+            return self._sparql(url, params["query"], headers.get("Accept"))
+        if host == "en.wikipedia.org":
+            return self._mediawiki(url, params["titles"].split("|"))
+        if host == "unimath.github.io":
+            return _response(url, json.dumps(self._concept_index()), "application/json")
+        return _response(url, "", "text/plain", status_code=404)
+
+    def _bindings(self, query):
+        name = next(
+            (name for name, topic in self.queries.items() if topic in query), None
+        )
+        for k in range(self.scale):
+            for binding in self.sparql_results.get(name, []):
+                yield {
+                    var: {**term, "value": self._copy_term(var, term["value"], k)}
+                    for var, term in binding.items()
+                }
+
+    @staticmethod
+    def _copy_term(var, value, k):
+        if var in ("itemDescription", "aliases") or not value:
+            return value
+        return _copy(value, k)
+
+    def _sparql(self, url, query, accept):
+        bindings = list(self._bindings(query))
+        digits = tuple(_SHARD_DIGIT.findall(query))
+        if digits:
+            bindings = [b for b in bindings if b["item"]["value"].endswith(digits)]
+        if "ORDER BY STR(?item)" in query:
+            bindings.sort(key=lambda b: b["item"]["value"])
+        after = _AFTER.search(query)
+        if after is not None:
+            bindings = [b for b in bindings if b["item"]["value"] > after[1]]
+        limit = _LIMIT.search(query)
+        if limit is not None:
+            bindings = bindings[: int(limit[1])]
+        variables = list(dict.fromkeys(var for b in bindings for var in b))
+        if accept == "text/csv":
+            return _response(url, _csv(variables, bindings), accept)
+        if accept == "text/tab-separated-values":
+            return _response(url, _tsv(variables, bindings), accept)
+        body = {"head": {"vars": variables}, "results": {"bindings": bindings}}
+        return _response(url, json.dumps(body), "application/sparql-results+json")
+
+    def _mediawiki(self, url, titles):
+        normalized = []
+        pages = []
+        for i, title in enumerate(titles):
+            page_title = title.replace("_", " ")
+            if page_title != title:
+                normalized.append({"from": title, "to": page_title})
+            original, _, k = page_title.partition(_COPY)
+            text = self.articles.get(original)
+            page = {"ns": 0, "title": page_title}
+            if text is None:
+                pages.append({**page, "missing": True})
+            else:
+                # the recorded articles are plain text, which is valid wikitext
+                content = text if not k else f"{text} ({k})"
+                revision = {"slots": {"main": {"content": content}}}
+                pages.append({**page, "pageid": i + 1, "revisions": [revision]})
+        body = {
+            "batchcomplete": True,
+            "query": {"normalized": normalized, "pages": pages},
+        }
+        return _response(url, json.dumps(body), "application/json")
+
+    def _concept_index(self):
+        return [
+            {
+                key: value if key == "link" else _copy(value, k)
+                for key, value in entry.items()
+            }
+            for k in range(self.scale)
+            for entry in self.concept_index
+        ]
+
+
+@contextlib.contextmanager
+def replayed(scale=1, directory=FIXTURES_DIR, wikipedia_rate=10000):
+    """
+    Serve all requests of the slurpers from recorded responses, through a
+    scratch response cache, and keep articles in a scratch blob store.
+
+    Args:
+        scale: Number of times the recorded items are replayed
+        directory: Directory of the recorded responses
+        wikipedia_rate: Requests per second allowed to the MediaWiki API
+
+    Yields:
+        The FixtureClient answering the requests
+    """
+    client = FixtureClient(scale, directory)
+    with tempfile.TemporaryDirectory() as scratch:
+        previous_cache = http_cache.use_cache(
+            http_cache.ResponseCache(
+                Path(scratch) / "http_cache",
+                ttl=settings.HTTP_CACHE_TTL,
+                max_size=settings.HTTP_CACHE_MAX_SIZE,
+                client=client,
+            )
+        )
+        store = BlobStore(Path(scratch) / "articles.blob")
+        previous_store = use_store(store)
+        previous_limiter = wikipedia.RATE_LIMITER
+        wikipedia.RATE_LIMITER = TokenBucket(wikipedia_rate)
+        try:
+            yield client
+        finally:
+            wikipedia.RATE_LIMITER = previous_limiter
+            use_store(previous_store)
+            store.close()
+            http_cache.use_cache(previous_cache)
+
+
+def _response(url, text, content_type, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.encoding = "utf-8"
+    response.headers = CaseInsensitiveDict({"Content-Type": content_type})
+    response._content = text.encode("utf-8")
+    response.raw = io.BytesIO(response._content)
+    return response
+
+
+def _csv(variables, bindings):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(variables)
+    for binding in bindings:
+        writer.writerow([binding.get(var, {}).get("value", "") for var in variables])
+    return out.getvalue()
+
+
+def _tsv(variables, bindings):
+    def term(value):
+        if value is None:
+            return ""
+        if value["type"] == "uri":
+            return f"<{value['value']}>"
+        escaped = value["value"].replace("\\", "\\\\").replace('"', '\\"')
+        escaped = escaped.replace("\t", "\\t").replace("\n", "\\n")
+        return f'"{escaped}"'
+
+    lines = ["\t".join(f"?{var}" for var in variables)]
+    for binding in bindings:
+        lines.append("\t".join(term(binding.get(var)) for var in variables))
+    return "\n".join(lines) + "\n"
@@ -1,9 +1,13 @@
-import logging
+from functools import cached_property
 from typing import Optional
 
-import requests
-from concepts.models import Item, Link
-from django.db.utils import IntegrityError
+from concepts.bulk import LinkWriter
+from concepts.models import CONCEPT_BATCH_SIZE, Item, Link, PendingLink
+from concepts.utils import chunked
+from django.db import transaction
+from slurper import http_cache
+from slurper.bulk import ItemIndex, ItemWriter
+from slurper.registry import SlurperRegistry
 
 
 class AgdaUnimathSlurper:
@@ -18,10 +22,13 @@ class AgdaUnimathSlurper:
         )
         self.name_map = lambda item: item["name"]
         self.desc_map = lambda _: None
-        self.raw_data = self.fetch_json()
+
+    @cached_property
+    def raw_data(self):
+        return self.fetch_json()
 
     def fetch_json(self):
-        response = requests.get(self.JSON_URL)
+        response = http_cache.get(self.JSON_URL)
         return response.json()
 
     def json_to_item(self, item) -> Optional[Item]:
@@ -33,34 +40,105 @@ class AgdaUnimathSlurper:
             description=self.desc_map(item),
         )
 
-    def save_items(self):
-        for json_item in self.raw_data:
-            try:
-                item = self.json_to_item(json_item)
-                item.save()
-                if "wikidata" in json_item:
-                    wd_id = json_item["wikidata"]
-                    try:
-                        destinationItem = Item.objects.get(
-                            source=Item.Source.WIKIDATA,
-                            identifier=wd_id,
-                        )
-                        Link.save_new(item, destinationItem, Link.Label.AGDA_UNIMATH)
-                    except Item.DoesNotExist:
-                        logging.log(
-                            logging.WARNING,
-                            f"Item WD {wd_id} does not exist.",
-                        )
-                    except IntegrityError:
-                        logging.log(
-                            logging.WARNING,
-                            f"Repeated link: AUm {item.identifier} -> WD {wd_id}.",
+    def save_items(self, dry_run=False, checkpoint=None, changes=None):
+        """
+        Diff the concept index against the items in the database, writing
+        the new and changed items and deleting those that have disappeared,
+        then save the links.
+
+        Args:
+            dry_run: Only count the items and links that would be written
+                or deleted
+            checkpoint: Checkpoint recording how many entries have their
+                items written and whether the links are saved, from which
+                the import continues if an earlier one was interrupted
+            changes: ConceptChanges recording the written items and links
+
+        Returns:
+            The item writer and the link writer, which count the changes, or
+            None instead of the link writer if the links were saved already
+        """
+        index = ItemIndex()
+        position = 0
+        if checkpoint is not None and checkpoint.position:
+            entries = self.raw_data[: checkpoint.position]
+            if entries and self.id_map(entries[-1]) == checkpoint.marker:
+                for json_item in entries:
+                    index.mark_seen((self.source, self.id_map(json_item)))
+                position = checkpoint.position
+
+        def save_checkpoint():
+            checkpoint.save(position=position, marker=marker)
+
+        on_flush = save_checkpoint if checkpoint is not None else None
+        marker = checkpoint.marker if position else ""
+        with ItemWriter(
+            index, dry_run=dry_run, on_flush=on_flush, changes=changes
+        ) as writer:
+            for json_item in self.raw_data[position:]:
+                # counted first, as adding it may write the batch it ends
+                position += 1
+                marker = self.id_map(json_item)
+                writer.add(self.json_to_item(json_item))
+            writer.delete_unseen([self.source])
+        links = None
+        if not (checkpoint is not None and checkpoint.done):
+            links = self.save_links(changes, dry_run)
+        if checkpoint is not None:
+            checkpoint.save(position=position, marker=marker, done=True)
+        return writer, links
+
+    def save_links(self, changes=None, dry_run=False):
+        """
+        Save the links from the concepts to the Wikidata items they refer
+        to in bulk, replacing the previous ones. References to items that
+        have not been imported are kept as pending links, which the next
+        Wikidata import resolves.
+
+        Args:
+            changes: ConceptChanges recording the written links
+            dry_run: Only count the links that would be written or deleted
+                and the pending ones, leaving the pending links as they are
+
+        Returns:
+            The link writer, which counts inserted, deleted and pending links
+        """
+        items = dict(
+            Item.objects.filter(source=self.source).values_list("identifier", "id")
+        )
+        references = [
+            (items[self.id_map(json_item)], json_item["wikidata"])
+            for json_item in self.raw_data
+            if "wikidata" in json_item and self.id_map(json_item) in items
+        ]
+        destinations = {}
+        for batch in chunked({wd_id for _, wd_id in references}, CONCEPT_BATCH_SIZE):
+            destinations.update(
+                Item.objects.filter(
+                    source=Item.Source.WIKIDATA, identifier__in=batch
+                ).values_list("identifier", "id")
+            )
+        pending = []
+        with LinkWriter([Link.Label.AGDA_UNIMATH], dry_run, changes=changes) as writer:
+            for source_id, wd_id in references:
+                if wd_id in destinations:
+                    writer.add(source_id, destinations[wd_id], Link.Label.AGDA_UNIMATH)
+                else:
+                    pending.append(
+                        PendingLink(
+                            source_id=source_id,
+                            destination_source=Item.Source.WIKIDATA,
+                            destination_identifier=wd_id,
+                            label=Link.Label.AGDA_UNIMATH,
                         )
-            except IntegrityError:
-                logging.log(
-                    logging.WARNING,
-                    f"Item {item.identifier} is already in the database.",
-                )
+                    )
+        if not dry_run:
+            with transaction.atomic():
+                PendingLink.objects.filter(label=Link.Label.AGDA_UNIMATH).delete()
+                PendingLink.objects.bulk_create(pending, ignore_conflicts=True)
+        writer.pending = len(pending)
+        return writer
 
 
-AU_SLURPER = AgdaUnimathSlurper()
+SLURPERS = SlurperRegistry()
+SLURPERS.register("agda-unimath", AgdaUnimathSlurper)
@@ -1,17 +1,42 @@
+import hashlib
+import json
 import logging
+import tempfile
 import time
-import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from itertools import islice
 
 import requests
+from concepts.blob_store import text_hash
+from concepts.bulk import LinkWriter
 from concepts.models import Item
-from django.db.utils import IntegrityError
-from slurper.wd_raw_item import WD_OTHER_SOURCES, BaseWdRawItem
-
-from web.settings import WIKIPEDIA_CONTACT_EMAIL
-
-# Wikipedia API contact email (required by Wikipedia API guidelines)
-# Set to None to disable Wikipedia article fetching
-_missing_email_logged = False
+from concepts.utils import chunked
+from slurper import http_cache, wikidata_dump
+from slurper.article_store import ArticleStore
+from slurper.bulk import ItemIndex, ItemWriter
+from slurper.http_client import WDQS_CONCURRENCY
+from slurper.pipeline import Pipeline
+from slurper.rate_limit import retry_after
+from slurper.registry import SlurperRegistry
+from slurper.sparql_results import RESULT_FORMATS, text_stream
+from slurper.wd_raw_item import WD_OTHER_SOURCES, BaseWdRawItem, WpENRawItem
+from slurper.wikipedia import article_title
+
+# (connect, read) timeout in seconds; WDQS itself gives up after 60s
+SPARQL_TIMEOUT = (10, 90)
+SPARQL_MAX_RETRIES = 4
+# 429 is rate limiting, 500/503 are what WDQS answers when a
+# query times out or the server is overloaded
+SPARQL_RETRY_STATUSES = (429, 500, 503)
+# Number of shards the broad topic queries are split into, by the last
+# digit of the item id, so that each stays well under the WDQS time limit
+TOPIC_SHARDS = 5
+# Number of results whose Wikipedia articles are fetched together
+ARTICLE_CHUNK_SIZE = 200
+# Number of chunks whose Wikipedia articles are fetched in parallel
+FETCH_WORKERS = 2
 
 # Wikidata entities to exclude from queries
 KNOWN_EXCLUDED_CATEGORIES = [
@@ -64,9 +89,13 @@ def _load_excluded_categories_from_results():
         return []
 
 
-RESULT_EXCLUDED_CATEGORIES = _load_excluded_categories_from_results()
-
-EXCLUDED_CATEGORIES = KNOWN_EXCLUDED_CATEGORIES + RESULT_EXCLUDED_CATEGORIES
+def excluded_categories():
+    """
+    Wikidata entities to exclude from queries: the known ones together with
+    those rejected by the categorizer. The latter require a database query,
+    so an import calls this once and passes the result to all its slurpers.
+    """
+    return KNOWN_EXCLUDED_CATEGORIES + _load_excluded_categories_from_results()
 
 
 # These are added to every query:
@@ -83,8 +112,7 @@ EXCLUDED_CATEGORIES = KNOWN_EXCLUDED_CATEGORIES + RESULT_EXCLUDED_CATEGORIES
 class WikidataSlurper:
     SPARQL_URL = "https://query.wikidata.org/sparql"
 
-    SPARQL_QUERY_OPTIONS = (
-        """
+    SPARQL_QUERY_OPTIONS = """
   OPTIONAL
   { ?item wdt:P18 ?image . }
   OPTIONAL
@@ -97,9 +125,7 @@ class WikidataSlurper:
   { ?item skos:altLabel ?itemAltLabel . FILTER (lang(?itemAltLabel) = "en") }
   # except for natural numbers and positive integers
   FILTER NOT EXISTS {
-    VALUES ?excludedType { """
-        + " ".join(EXCLUDED_CATEGORIES)
-        + """ }
+    VALUES ?excludedType { {excluded_categories} }
     ?item wdt:P31 ?excludedType .
   }
   # except for humans
@@ -108,11 +134,95 @@ class WikidataSlurper:
   SERVICE wikibase:label { bd:serviceParam wikibase:language "en". }
 }
 """
-    )
 
-    def __init__(self, source, query, limit=None):
+    def __init__(
+        self,
+        source,
+        query,
+        limit=None,
+        timeout=SPARQL_TIMEOUT,
+        page_size=None,
+        result_format="csv",
+        article_store=None,
+        shards=1,
+        excluded_categories=None,
+    ):
+        """
+        Args:
+            source: The source of the items the query returns
+            query: The triples selecting the items
+            limit: Optional limit on the number of results
+            timeout: (connect, read) timeout of a single request in seconds
+            page_size: If given, results are fetched in pages of this size
+                and streamed through a temporary file instead of being
+                kept in memory
+            result_format: Result format of paged requests, "csv" or "tsv"
+            article_store: ArticleStore of Wikipedia articles and their
+                keywords, which may be shared by several slurpers (default:
+                a new one)
+            shards: Number of queries, between 1 and 10, that the query is
+                split into by the last digit of the item id. The shards of
+                a query are fetched in parallel and retried independently.
+                Queries with a limit are never split.
+            excluded_categories: Wikidata entities whose instances the query
+                leaves out (default: KNOWN_EXCLUDED_CATEGORIES)
+        """
+        if not 1 <= shards <= 10:
+            raise ValueError(f"Cannot split a query into {shards} shards.")
         self.source = source
-        self.query = (
+        self.topic_query = query
+        self.limit = limit
+        self.timeout = timeout
+        self.page_size = page_size
+        self.result_format = result_format
+        self.article_store = article_store or ArticleStore()
+        self.shards = shards
+        self.excluded_categories = (
+            KNOWN_EXCLUDED_CATEGORIES
+            if excluded_categories is None
+            else excluded_categories
+        )
+        self._raw_data = None
+        self._spool = None
+
+    @property
+    def shard_count(self):
+        return self.shards if self.limit is None else 1
+
+    @property
+    def query(self):
+        """The query of the first shard."""
+        return self.shard_query(0)
+
+    def shard_query(self, shard):
+        return self._unlimited_query(shard) + (
+            f"LIMIT {self.limit}" if self.limit is not None else ""
+        )
+
+    @property
+    def _query_options(self):
+        return self.SPARQL_QUERY_OPTIONS.replace(
+            "{excluded_categories}", " ".join(self.excluded_categories)
+        )
+
+    def _shard_filter(self, shard):
+        if self.shard_count == 1:
+            return ""
+        digits = [digit for digit in range(10) if digit % self.shard_count == shard]
+        return (
+            "  FILTER("
+            + " || ".join(f'STRENDS(STR(?item), "{digit}")' for digit in digits)
+            + ")\n"
+        )
+
+    @staticmethod
+    def _keyset_filter(after):
+        if after is None:
+            return ""
+        return f'  FILTER(STR(?item) > "{after}")\n'
+
+    def _unlimited_query(self, shard=0, after=None):
+        return (
             """
 SELECT
   DISTINCT ?item ?itemLabel ?itemDescription ?image ?wp_en
@@ -122,17 +232,71 @@ SELECT
             + """
 WHERE {
 """
-            + query
+            + self.topic_query
+            + self._shard_filter(shard)
+            + self._keyset_filter(after)
             + self._sparql_source_vars_triples()
-            + self.SPARQL_QUERY_OPTIONS
+            + self._query_options
             + """
 GROUP BY ?item ?itemLabel ?itemDescription ?image ?wp_en """
             + " ".join([f"?{src['json_key']}" for src in WD_OTHER_SOURCES.values()])
             + """
 """
-            + (f"LIMIT {limit}" if limit is not None else "")
         )
-        self.raw_data = self.fetch_json()
+
+    def fetch(self):
+        shards = range(self.shard_count)
+        with ThreadPoolExecutor(max_workers=WDQS_CONCURRENCY) as executor:
+            self.merge(list(executor.map(self.fetch_shard, shards)))
+
+    def fetch_shard(self, shard):
+        """Fetch the results of a single shard, as a list or, if paging, as
+        a spool of JSON lines."""
+        if self.page_size is None:
+            return self.fetch_json(shard)
+        return self.fetch_pages(shard)
+
+    def merge(self, shard_results):
+        """
+        Keep the results of all shards, in the order of the shards, leaving
+        out duplicate results.
+
+        Args:
+            shard_results: The results of fetch_shard for every shard
+        """
+        if len(shard_results) == 1:
+            results = shard_results[0]
+        elif self.page_size is None:
+            results = list(_unique(shard_results, partial(json.dumps, sort_keys=True)))
+        else:
+            results = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+            for spool in shard_results:
+                spool.seek(0)
+            results.writelines(_unique(shard_results, str))
+            for spool in shard_results:
+                spool.close()
+        if self.page_size is None:
+            self._raw_data = results
+        else:
+            self._spool = results
+
+    def load_spool(self, spool):
+        """Use results spooled as JSON lines, e.g. selected from a dump,
+        instead of querying WDQS."""
+        self._spool = spool
+
+    def bindings(self):
+        """Iterate over the query results, fetching them first if needed."""
+        if self._raw_data is None and self._spool is None:
+            self.fetch()
+        if self._spool is None:
+            return iter(self._raw_data)
+        return self._spooled_bindings()
+
+    def _spooled_bindings(self):
+        self._spool.seek(0)
+        for line in self._spool:
+            yield json.loads(line)
 
     def _sparql_source_vars_select(self):
         def to_var(source_dict):
@@ -150,195 +314,474 @@ GROUP BY ?item ?itemLabel ?itemDescription ?image ?wp_en """
 
         return "\n".join(map(to_triple, WD_OTHER_SOURCES.values()))
 
-    def fetch_json(self):
-        response = requests.get(
-            self.SPARQL_URL,
-            params={"format": "json", "query": self.query},
-        )
-        return response.json()["results"]["bindings"]
-
-    def fetch_article(self, json_item, index=None, total=None):
-        global _missing_email_logged
-
-        # Check if contact email is configured
-        if WIKIPEDIA_CONTACT_EMAIL is None:
-            if not _missing_email_logged:
-                logging.log(
-                    logging.WARNING,
-                    "WIKIPEDIA_CONTACT_EMAIL is not set. "
-                    "Wikipedia article fetching is disabled. "
-                    "Please set WIKIPEDIA_CONTACT_EMAIL at the top of "
-                    "source_wikidata.py to enable article fetching.",
-                )
-                _missing_email_logged = True
-            return None
+    def _request(self, params, read, headers=None, shard=0, stream=False):
+        """
+        Run a SPARQL request, retrying it with exponential backoff.
 
-        wp_url = json_item["wp_en"]["value"]
-        # Decode URL-encoded characters (e.g., %E2%80%93 becomes –)
-        article_title = urllib.parse.unquote(wp_url.split("/wiki/")[-1])
+        Args:
+            params: Query parameters of the request
+            read: Function extracting the result from a successful response
+            headers: Optional request headers
+            shard: Shard of the query, for logging
+            stream: Leave the body of the response to be read by read
 
-        if index is not None and total is not None:
-            logging.log(
-                logging.INFO,
-                f"Fetching Wikipedia article [{index}/{total}]: {article_title}",
-            )
-        else:
+        Returns:
+            The result of read
+        """
+        retry_delay = 1
+        for attempt in range(SPARQL_MAX_RETRIES):
+            last_attempt = attempt == SPARQL_MAX_RETRIES - 1
+            try:
+                response = http_cache.get(
+                    self.SPARQL_URL,
+                    params=params,
+                    headers=headers,
+                    timeout=self.timeout,
+                    stream=stream,
+                )
+                if response.status_code not in SPARQL_RETRY_STATUSES or last_attempt:
+                    # also closes a streamed body that fails, keeping its slot
+                    with response:
+                        response.raise_for_status()
+                        return read(response)
+                response.close()
+                reason = f"HTTP {response.status_code}"
+                wait = retry_after(response, retry_delay)
+            except (
+                requests.exceptions.Timeout,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                if last_attempt:
+                    raise
+                reason = str(e)
+                wait = retry_delay
+            query = self.source.label
+            if self.shard_count > 1:
+                query += f" (shard {shard + 1}/{self.shard_count})"
             logging.log(
-                logging.INFO,
-                f"Fetching Wikipedia article: {article_title}",
+                logging.WARNING,
+                f"SPARQL query for {query} failed ({reason}), "
+                f"retrying in {wait}s (attempt {attempt + 1}/{SPARQL_MAX_RETRIES})",
             )
-        api_url = "https://en.wikipedia.org/w/api.php"
-        params = {
-            "action": "query",
-            "format": "json",
-            "titles": article_title,
-            "prop": "extracts",
-            "explaintext": True,
-            "exsectionformat": "plain",
-        }
-        headers = {
-            "User-Agent": f"MathSwitch/1.0 ({WIKIPEDIA_CONTACT_EMAIL})",
-            "Accept": "application/json",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
-        # Retry logic with exponential backoff
-        max_retries = 3
-        retry_delay = 1  # Start with 1 second
-        success = False
-        for attempt in range(max_retries):
-            try:
-                # Rate limiting: delay between requests (100 req/s max)
-                time.sleep(0.01)
+            time.sleep(wait)
+            retry_delay *= 2
+
+    def fetch_json(self, shard=0):
+        return self._request(
+            {"format": "json", "query": self.shard_query(shard)},
+            lambda response: response.json()["results"]["bindings"],
+            shard=shard,
+        )
 
-                # Timeout: (connect_timeout, read_timeout) in seconds
-                response = requests.get(
-                    api_url, params=params, headers=headers, timeout=(5, 30)
-                )
+    def fetch_page(self, after, page_size, shard=0):
+        """
+        Fetch a page of results, ordered by item, parsing the response while
+        it is read.
 
-                # Handle rate limiting
-                if response.status_code in (429, 403):
-                    if attempt < max_retries - 1:
-                        logging.log(
-                            logging.WARNING,
-                            f"Rate limited for {article_title}, retrying in "
-                            f"{retry_delay}s (attempt {attempt + 1}/{max_retries})",
-                        )
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                        continue
-                    else:
-                        logging.log(
-                            logging.ERROR,
-                            f"Failed to fetch {article_title} after "
-                            f"{max_retries} attempts (rate limited). Skipping article.",
-                        )
-                        break
-
-                response.raise_for_status()
-
-                if not response.text:
-                    logging.log(
-                        logging.WARNING,
-                        f"Empty response for Wikipedia article: "
-                        f"{article_title}. Skipping article.",
-                    )
-                    break
-
-                data = response.json()
-                pages = data.get("query", {}).get("pages", {})
-
-                # Get the first (and only) page
-                for page_id, page_data in pages.items():
-                    if "extract" in page_data:
-                        success = True
-                        return page_data["extract"]
-
-                # Success, break retry loop
+        Args:
+            after: The item the page starts after, or None for the first page
+            page_size: Maximum number of results of the page
+            shard: Shard of the query
+        """
+        mime_type, parse = RESULT_FORMATS[self.result_format]
+        query = self._unlimited_query(shard, after) + (
+            f"ORDER BY STR(?item)\nLIMIT {page_size}\n"
+        )
+
+        def read(response):
+            with text_stream(response) as stream:
+                return list(parse(stream))
+
+        return self._request(
+            {"query": query},
+            read,
+            headers={"Accept": mime_type},
+            shard=shard,
+            stream=True,
+        )
+
+    def fetch_pages(self, shard=0):
+        """
+        Page through the results and spool them to a temporary file as JSON
+        lines, so that only a single page is ever held in memory.
+
+        Pages are delimited by item rather than by offset, so that WDQS never
+        has to skip over the results of the previous pages. Since an item may
+        have several results, those of the last item of a full page are left
+        to the next one.
+        """
+        spool = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        after = None
+        count = 0
+        page_size = self.page_size
+        while self.limit is None or count < self.limit:
+            if self.limit is not None:
+                page_size = min(page_size, self.limit - count)
+            page = self.fetch_page(after, page_size, shard)
+            bindings = page
+            if len(page) == page_size and count + len(page) != self.limit:
+                last = page[-1]["item"]["value"]
+                bindings = [b for b in page if b["item"]["value"] != last]
+                if not bindings:
+                    # the results of a single item fill the whole page
+                    page_size *= 2
+                    continue
+            for binding in bindings:
+                spool.write(json.dumps(binding) + "\n")
+            count += len(bindings)
+            if bindings is page:
                 break
+            after = bindings[-1]["item"]["value"]
+        return spool
+
+    def fetch_articles(self, json_items):
+        """Fetch the Wikipedia articles of the given results in batches and
+        store them in the results as article_text. Results whose article
+        could not be fetched, or was fetched for earlier results and is no
+        longer kept, are marked with article_failed instead, so that the
+        article already saved is kept."""
+        pending = [
+            json_item
+            for json_item in json_items
+            if "wp_en" in json_item and "article_text" not in json_item
+        ]
+        articles = self.article_store.articles(
+            article_title(json_item["wp_en"]["value"]) for json_item in pending
+        )
+        for json_item in pending:
+            title = article_title(json_item["wp_en"]["value"])
+            if title not in articles:
+                json_item["article_failed"] = {"value": True}
+            elif articles[title] is not None:
+                json_item["article_text"] = {"value": articles[title]}
+        return json_items
+
+    def extract_keywords(self, chunks, index=None):
+        """
+        Extract the keywords of the fetched articles of the given chunks of
+        results and store them in the results, yielding each chunk once it
+        is done. All articles go through a single batched spaCy pipe.
 
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries - 1:
-                    logging.log(
-                        logging.WARNING,
-                        f"Request failed for {article_title}: "
-                        f"{e}, retrying in {retry_delay}s",
-                    )
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    logging.log(
-                        logging.ERROR,
-                        f"Failed to fetch {article_title}"
-                        f" after {max_retries} attempts: {e}. Skipping article.",
-                    )
-        if not success and "wp_en" in json_item:
-            logging.log(
-                logging.INFO,
-                f"Article {article_title} will have null value (fetch failed or empty)",
+        Results whose Wikipedia item in the index already has keywords
+        extracted from the same article are marked with keywords_current
+        instead, so that the item keeps them without running spaCy again.
+        """
+        in_flight = deque()
+
+        def keywords_current(json_item):
+            if index is None:
+                return False
+            key = WpENRawItem(json_item).key()
+            return index.keywords_hash(key) == text_hash(
+                json_item["article_text"]["value"]
             )
 
-        return None
+        def articles():
+            for json_items in chunks:
+                in_flight.append(json_items)
+                pending = []
+                for i, json_item in enumerate(json_items):
+                    if "article_text" not in json_item or "keywords" in json_item:
+                        continue
+                    if keywords_current(json_item):
+                        json_item["keywords_current"] = {"value": True}
+                    else:
+                        pending.append((i, json_item["article_text"]["value"]))
+                yield pending
+
+        for keywords in self.article_store.keywords_by_chunk(articles()):
+            json_items = in_flight.popleft()
+            for i, item_keywords in keywords.items():
+                json_items[i]["keywords"] = {"value": item_keywords}
+            yield json_items
+
+    def load_keywords(self, json_items):
+        """Read the keywords that extract_keywords found cached in the
+        database into the given results, on the thread using it."""
+        found = {
+            i: json_item["keywords"]["value"]
+            for i, json_item in enumerate(json_items)
+            if "keywords" in json_item
+        }
+        self.article_store.load_keywords(found)
+        for i, item_keywords in found.items():
+            json_items[i]["keywords"]["value"] = item_keywords
+
+    def get_items(self, json_items, index):
+        """
+        Yield the items described by the given results.
 
-    def get_items(self):
-        for json_item in self.raw_data:
+        Args:
+            json_items: SPARQL results
+            index: ItemIndex of the import, used to skip the Wikidata and
+                Wikipedia items that it has already produced
+        """
+        for json_item in json_items:
             raw_item = BaseWdRawItem.raw_item(self.source, json_item)
             yield raw_item.to_item()
             if self.source != Item.Source.WIKIDATA:
                 raw_item_wd = raw_item.switch_source_to(Item.Source.WIKIDATA)
-                if not raw_item_wd.item_exists():
+                if not index.was_seen(raw_item_wd.key()):
                     yield raw_item_wd.to_item()
             if raw_item.has_source(Item.Source.WIKIPEDIA_EN):
-                # Fetch Wikipedia article if available
-                if "wp_en" in json_item and "article_text" not in json_item:
-                    article_text = self.fetch_article(json_item)
-                    if article_text is not None:
-                        json_item["article_text"] = {"value": article_text}
-
                 raw_item_wp_en = raw_item.switch_source_to(Item.Source.WIKIPEDIA_EN)
-                if not raw_item_wp_en.item_exists():
+                if not index.was_seen(raw_item_wp_en.key()):
                     yield raw_item_wp_en.to_item()
 
-    def save_items(self):
-        for item in self.get_items():
+    def skip_items(self, checkpoint, index):
+        """
+        Skip the results whose items an interrupted import has written, as
+        recorded by its checkpoint, marking their items as seen in the
+        index without fetching their articles or writing them again.
+
+        Returns:
+            The number of skipped results, which is 0 if the results are no
+            longer the same as when the checkpoint was recorded
+        """
+        if not checkpoint.position:
+            return 0
+        last = next(islice(self.bindings(), checkpoint.position - 1, None), None)
+        if last is None or _marker(last) != checkpoint.marker:
+            logging.log(
+                logging.WARNING,
+                f"Results for {self.source.label} changed since the interrupted "
+                "import, starting over",
+            )
+            return 0
+        skipped = islice(self.bindings(), checkpoint.position)
+        for item in self.get_items(skipped, index):
+            index.mark_seen((item.source, item.identifier))
+        return checkpoint.position
+
+    def save_items(
+        self, index=None, dry_run=False, keywords=True, checkpoint=None, changes=None
+    ):
+        """
+        Save the items of all results, running the import as a pipeline:
+        chunks of results have their Wikipedia articles fetched, then their
+        keywords extracted, and are finally handed to a batched item writer
+        on this thread. All three stages work on different chunks at the
+        same time. Only items that are new or changed are written.
+
+        Args:
+            index: ItemIndex of the previous snapshot, which may be shared by
+                several slurpers (default: load a new one)
+            dry_run: Only count the items that would be written
+            keywords: Whether to extract keywords, which can otherwise be
+                done later by the extract_keywords command
+            checkpoint: Checkpoint recording how many results have their
+                items written, with every batch, and from which the import
+                continues if an earlier one was interrupted
+            changes: ConceptChanges recording the written items
+
+        Returns:
+            The item writer, which counts inserted, updated and unchanged
+            items
+        """
+        if index is None:
+            index = ItemIndex()
+        position = self.skip_items(checkpoint, index) if checkpoint else 0
+        marker = checkpoint.marker if position else ""
+
+        def write(json_items):
+            nonlocal position, marker
+            if keywords:
+                self.load_keywords(json_items)
+            for item in self.get_items(json_items, index):
+                writer.add(item)
+            position += len(json_items)
+            marker = _marker(json_items[-1])
+
+        def save_checkpoint():
+            # a batch written in the middle of a chunk only counts the
+            # chunks before; the rest of the chunk is found unchanged
+            # when resuming
+            checkpoint.save(position=position, marker=marker)
+
+        pipeline = Pipeline()
+        pipeline.add_stage(self.fetch_articles, workers=FETCH_WORKERS)
+        if keywords:
+            self.article_store.load_cached()
+            pipeline.add_stream_stage(partial(self.extract_keywords, index=index))
+        on_flush = save_checkpoint if checkpoint is not None else None
+        with ItemWriter(
+            index, dry_run, keywords, on_flush=on_flush, changes=changes
+        ) as writer:
+            bindings = islice(self.bindings(), position, None)
+            # in order, so that the checkpoint covers all results before it
+            pipeline.run(chunked(bindings, ARTICLE_CHUNK_SIZE), write, ordered=True)
+        if keywords and not dry_run:
+            self.article_store.save_keywords()
+        if checkpoint is not None:
+            checkpoint.save(position=position, marker=marker, done=True)
+        return writer
+
+    def save_links(self, index=None, writer=None):
+        """
+        Save the links between the items of all results in bulk.
+
+        Args:
+            index: ItemIndex of the saved items (default: load a new one)
+            writer: LinkWriter collecting the links, which may be shared by
+                several slurpers (default: write the links of this slurper)
+        """
+        if index is None:
+            index = ItemIndex()
+        if writer is None:
+            with LinkWriter() as writer:
+                return self.save_links(index, writer)
+        for json_item in self.bindings():
+            BaseWdRawItem.raw_item(self.source, json_item).save_links(index, writer)
+        return writer
+
+
+def _unique(shard_results, serialize):
+    """Chain the results of several shards, leaving out those that are the
+    same when serialized."""
+    seen = set()
+    for results in shard_results:
+        for result in results:
+            digest = hashlib.blake2b(
+                serialize(result).encode("utf-8"), digest_size=16
+            ).digest()
+            if digest not in seen:
+                seen.add(digest)
+                yield result
+
+
+def _marker(json_item):
+    return json_item["item"]["value"]
+
+
+def fetch_concurrently(slurpers, max_workers=WDQS_CONCURRENCY):
+    """
+    Fetch the results of several slurpers in parallel, shard by shard.
+
+    Args:
+        slurpers: Dictionary mapping slurper names to slurpers
+        max_workers: Maximum number of queries running at the same time
+
+    Yields:
+        (name, slurper) pairs in the order in which all shards of their
+        queries complete. Slurpers with a shard that ultimately fails are
+        logged and skipped, as their results would be incomplete.
+    """
+    # queries read excluded categories from the database,
+    # so build them here rather than in the worker threads
+    for slurper in slurpers.values():
+        slurper.query
+    results = {name: {} for name in slurpers}
+    # futures whose results are handed on, which must not be closed
+    merged = set()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        executor.submit(slurper.fetch_shard, shard): (name, shard)
+        for name, slurper in slurpers.items()
+        for shard in range(slurper.shard_count)
+    }
+    try:
+        for future in as_completed(futures):
+            name, shard = futures[future]
+            slurper = slurpers[name]
+            if name not in results:
+                # another shard failed
+                continue
             try:
-                item.save()
-            except IntegrityError:
-                logging.log(
-                    logging.INFO,
-                    f"Item {item.source} {item.identifier} is already in the database.",
+                results[name][shard] = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                shard_name = f"{name} (shard {shard + 1}/{slurper.shard_count})"
+                logging.log(logging.ERROR, f"Failed to fetch {shard_name}: {e}")
+                del results[name]
+                for other, (other_name, _) in futures.items():
+                    if other_name == name:
+                        other.cancel()
+                continue
+            if len(results[name]) == slurper.shard_count:
+                shard_results = results.pop(name)
+                merged.update(
+                    other
+                    for other, (other_name, _) in futures.items()
+                    if other_name == name
                 )
+                slurper.merge([shard_results[i] for i in range(len(shard_results))])
+                yield name, slurper
+    finally:
+        # also when the caller stops early: stop the queries not started
+        # yet and close the spools of the shards that are not used
+        executor.shutdown(cancel_futures=True)
+        for future in futures:
+            if future in merged or future.cancelled() or future.exception():
+                continue
+            _close(future.result())
 
-    def save_links(self):
-        for json_item in self.raw_data:
-            BaseWdRawItem.raw_item(self.source, json_item).save_links()
 
+def _close(shard_result):
+    """Close the spool of a shard fetched in pages, lists need nothing."""
+    if hasattr(shard_result, "close"):
+        shard_result.close()
 
-SLURPERS = [
-    WikidataSlurper(Item.Source.WIKIDATA, query)
-    for query in [
-        """
+
+def fetch_from_dump(slurpers, path, processes=wikidata_dump.DUMP_PROCESSES):
+    """
+    Select the results of several slurpers from a local Wikidata JSON dump
+    instead of querying WDQS, applying the criteria of their queries.
+
+    Args:
+        slurpers: Dictionary mapping slurper names to slurpers
+        path: Path of the dump, possibly compressed with gzip or bzip2
+        processes: Number of processes parsing the dump
+
+    Yields:
+        (name, slurper) pairs once the whole dump is read
+    """
+    excluded = [category.removeprefix("wd:") for category in excluded_categories()]
+    spools = wikidata_dump.select(path, excluded, processes)
+    for name, slurper in slurpers.items():
+        spool = spools.get(name)
+        if spool is None:
+            spool = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        slurper.load_spool(spool)
+        yield name, slurper
+
+
+TOPIC_QUERIES = {
+    "math-topics": """
   # anything part of a topic that is studied by mathmatics
   ?item wdt:P31 ?topic .
   ?topic wdt:P2579 wd:Q395 .
 """,
-        """
+    "studied-by-area": """
   # concepts studied by an area of mathematics
   ?item wdt:P2579 ?area .
   ?area wdt:P31 wd:Q1936384 .
 """,
-        """
+    "concept-of-area": """
   # concepts of areas of mathematics
   ?item p:P31 ?of .
   ?of ps:P31 wd:Q151885 .
   ?of pq:P642/p:P31/ps:P31 wd:Q1936384 .
 """,
-    ]
-]
+}
 
-SLURPERS += [
-    WikidataSlurper(
-        source,
-        f"\n  ?item {property['wd_property']} ?{property['json_key']} .\n",
-    )
+# items with an identifier in one of the other sources
+SOURCE_QUERIES = {
+    source: f"\n  ?item {property['wd_property']} ?{property['json_key']} .\n"
     for source, property in WD_OTHER_SOURCES.items()
-]
+}
+
+# Sources of the items of which a full import produces a complete snapshot
+SOURCES = [Item.Source.WIKIDATA, Item.Source.WIKIPEDIA_EN, *WD_OTHER_SOURCES]
+
+SLURPERS = SlurperRegistry()
+
+for name, query in TOPIC_QUERIES.items():
+    SLURPERS.register(
+        name,
+        partial(WikidataSlurper, Item.Source.WIKIDATA, query, shards=TOPIC_SHARDS),
+    )
+
+for source, property in WD_OTHER_SOURCES.items():
+    SLURPERS.register(
+        property["slug"], partial(WikidataSlurper, source, SOURCE_QUERIES[source])
+    )
@@ -0,0 +1,58 @@
+import csv
+import io
+import re
+
+# https://www.w3.org/TR/sparql11-results-csv-tsv/
+# Both parsers produce bindings shaped like those of the JSON result format,
+# i.e. {"variable": {"value": ...}}, leaving out unbound variables.
+
+_TSV_LITERAL = re.compile(r'^"(?P<value>.*)"(@[\w-]+|\^\^<[^>]*>)?$', re.DOTALL)
+_TSV_ESCAPES = re.compile(r"\\(.)")
+_TSV_UNESCAPED = {"t": "\t", "n": "\n", "r": "\r", '"': '"', "'": "'", "\\": "\\"}
+
+
+def text_stream(response):
+    """Decode the body of a response requested with stream=True as UTF-8
+    text while it is read."""
+    return io.TextIOWrapper(response.raw, encoding="utf-8", newline="")
+
+
+def iter_csv_bindings(stream):
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    for row in reader:
+        yield {var: {"value": value} for var, value in zip(header, row) if value}
+
+
+def _tsv_term_value(term):
+    if term.startswith("<") and term.endswith(">"):
+        return term[1:-1]
+    match = _TSV_LITERAL.match(term)
+    if match is None:
+        # numbers and booleans are written without quotes
+        return term
+    return _TSV_ESCAPES.sub(
+        lambda m: _TSV_UNESCAPED.get(m.group(1), m.group(0)), match["value"]
+    )
+
+
+def iter_tsv_bindings(stream):
+    header = stream.readline().rstrip("\r\n")
+    if not header:
+        return
+    variables = [var.lstrip("?") for var in header.split("\t")]
+    for line in stream:
+        terms = line.rstrip("\r\n").split("\t")
+        yield {
+            var: {"value": _tsv_term_value(term)}
+            for var, term in zip(variables, terms)
+            if term
+        }
+
+
+RESULT_FORMATS = {
+    "csv": ("text/csv", iter_csv_bindings),
+    "tsv": ("text/tab-separated-values", iter_tsv_bindings),
+}
@@ -1,3 +1,1410 @@
-# from django.test import TestCase
+import contextlib
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+import requests
+from concepts.blob_store import BlobStore, text_hash, use_store
+from concepts.bulk import ConceptChanges
+from concepts.models import ArticleKeywords, ImportCheckpoint, Item, Link, PendingLink
+from concepts.utils import chunked
+from django.core.management import call_command
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from slurper import keyword_util, source_agda_unimath, source_wikidata
+from slurper.article_store import ArticleStore, CachedKeywords
+from slurper.bulk import ItemIndex, ItemWriter
+from slurper.http_cache import OfflineCacheMiss, ResponseCache
+from slurper.http_client import HttpClient
+from slurper.pipeline import Pipeline
+from slurper.rate_limit import retry_after
+from slurper.registry import SlurperRegistry
+from slurper.replay import replayed
+from slurper.source_wikidata import WikidataSlurper
+from slurper.sparql_results import iter_csv_bindings, iter_tsv_bindings, text_stream
+from slurper.wikipedia import BATCH_SIZE, ArticleFetcher, plain_text
+
+from web.query_budget import QueryBudgetMixin
+
+
+def run(command, **options):
+    with contextlib.redirect_stdout(io.StringIO()):
+        call_command(command, **options)
+
+
+def snapshot():
+    return (
+        set(Item.objects.values_list("source", "identifier", "content_hash")),
+        set(
+            Link.objects.values_list(
+                "source__identifier", "destination__identifier", "label"
+            )
+        ),
+    )
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedItemWriter(ItemWriter):
+    """Writes small batches and fails on the third, counting the batches of
+    all writers, as every slurper has its own."""
+
+    batches = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, batch_size=20, **kwargs)
+
+    def flush(self):
+        if self._inserts or self._updates:
+            InterruptedItemWriter.batches += 1
+            if InterruptedItemWriter.batches == 3:
+                raise Interrupted()
+        super().flush()
+
+
+# The import pipeline writes from worker threads, which only see committed
+# data, hence TransactionTestCase.
+class ImportQueryBudgetTest(QueryBudgetMixin, TransactionTestCase):
+    def import_wikidata(self, scale):
+        with replayed(scale):
+            with self.assertQueryBudget(60, label=f"import_wikidata x{scale}"):
+                run("import_wikidata", skip_keywords=True)
+        return Item.objects.count()
+
+    def test_import_wikidata(self):
+        # The number of queries must not grow with the number of items.
+        items = self.import_wikidata(1)
+        self.assertGreater(self.import_wikidata(4), items)
+
+    def test_reimport_wikidata(self):
+        self.import_wikidata(2)
+        self.import_wikidata(2)
+
+    def test_import_agda_unimath(self):
+        with replayed(4):
+            run("import_wikidata", skip_keywords=True)
+            with self.assertQueryBudget(15, label="import_agda_unimath"):
+                run("import_agda_unimath")
+        self.assertTrue(Link.objects.filter(label=Link.Label.AGDA_UNIMATH).exists())
+
+    def test_pending_links(self):
+        with replayed(2):
+            run("import_agda_unimath")
+            pending = PendingLink.objects.count()
+            self.assertGreater(pending, 0)
+            self.assertFalse(
+                Link.objects.filter(label=Link.Label.AGDA_UNIMATH).exists()
+            )
+            with self.assertQueryBudget(60, label="import_wikidata"):
+                run("import_wikidata", skip_keywords=True)
+        links = Link.objects.filter(label=Link.Label.AGDA_UNIMATH)
+        self.assertEqual(links.count() + PendingLink.objects.count(), pending)
+        self.assertGreater(links.count(), 0)
+
+
+class AgdaUnimathDryRunTest(TransactionTestCase):
+    def dry_run(self):
+        output = io.StringIO()
+        with self.assertNoLogs(level="INFO"):
+            call_command("import_agda_unimath", dry_run=True, stdout=output)
+        output = output.getvalue()
+        # every summary is written once, by the command
+        self.assertEqual(output.count("items:"), 1)
+        self.assertEqual(output.count("links:"), 1)
+        return output
+
+    def test_dry_run_reports_links(self):
+        with replayed(2):
+            run("import_agda_unimath")
+            pending = PendingLink.objects.count()
+            PendingLink.objects.all().delete()
+            self.assertIn(
+                f"links: 0 inserted, 0 deleted, {pending} pending", self.dry_run()
+            )
+            self.assertFalse(PendingLink.objects.exists())
+            run("import_wikidata", skip_keywords=True)
+            self.assertIn(f"links: {pending} inserted, 0 deleted", self.dry_run())
+        self.assertFalse(Link.objects.filter(label=Link.Label.AGDA_UNIMATH).exists())
+
+
+class KeywordImportTest(TransactionTestCase):
+    def setUp(self):
+        self.nlp = FakeNlp()
+        patcher = mock.patch("slurper.keyword_util._get_nlp", return_value=self.nlp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_current_keywords_kept(self):
+        with replayed(2):
+            run("import_wikidata", nlp_processes=1)
+            keywords = dict(
+                Item.objects.exclude(keywords=None).values_list("id", "keywords")
+            )
+            self.assertTrue(keywords)
+            # without the cache, only the index tells the keywords are current
+            ArticleKeywords.objects.all().delete()
+            changed = Item.objects.filter(pk__in=keywords)
+            changed.update(description="Changed", content_hash="")
+            self.nlp.texts.clear()
+            run("import_wikidata", nlp_processes=1)
+        self.assertEqual([text for text in self.nlp.texts if text], [])
+        self.assertFalse(changed.filter(description="Changed").exists())
+        self.assertEqual(
+            dict(Item.objects.exclude(keywords=None).values_list("id", "keywords")),
+            keywords,
+        )
+        self.assertFalse(Item.objects.without_keywords().exists())
+
+    def test_keywords_after_skipped(self):
+        with replayed(2):
+            run("import_wikidata", skip_keywords=True)
+            stale = Item.objects.without_keywords()
+            self.assertTrue(stale.exists())
+            # only the keywords are new, which must still be written
+            run("import_wikidata", nlp_processes=1)
+        self.assertFalse(stale.exists())
+        self.assertTrue(Item.objects.exclude(keywords=None).exists())
+
+
+class ConceptUpdateTest(TransactionTestCase):
+    def concept_groups(self):
+        groups = {}
+        for source, identifier, concept_id in Item.objects.values_list(
+            "source", "identifier", "concept"
+        ):
+            groups.setdefault(concept_id, set()).add((source, identifier))
+        return {frozenset(group) for group in groups.values()}
+
+    def test_imports_update_concepts(self):
+        with replayed(2):
+            run("import_agda_unimath")
+            run("compute_concepts")
+            # resolves the pending links and adds the Wikidata items
+            run("import_wikidata", skip_keywords=True)
+        self.assertFalse(Item.objects.filter(concept=None).exists())
+        updated = self.concept_groups()
+        # some Agda Unimath concepts got linked to Wikidata items
+        self.assertTrue(any(len({source for source, _ in g}) > 1 for g in updated))
+        run("clear_concepts")
+        run("compute_concepts")
+        self.assertEqual(self.concept_groups(), updated)
+
+
+class ResumeImportTest(TransactionTestCase):
+    def setUp(self):
+        InterruptedItemWriter.batches = 0
+
+    def test_resume_import_wikidata(self):
+        with replayed(2):
+            run("import_wikidata", skip_keywords=True)
+            expected = snapshot()
+            Item.objects.all().delete()
+            with self.assertRaises(Interrupted):
+                with (
+                    mock.patch(
+                        "slurper.source_wikidata.ItemWriter", InterruptedItemWriter
+                    ),
+                    mock.patch("slurper.source_wikidata.ARTICLE_CHUNK_SIZE", 5),
+                ):
+                    run("import_wikidata", skip_keywords=True)
+            written = sum(ImportCheckpoint.objects.values_list("position", flat=True))
+            self.assertGreater(written, 0)
+            skipped = []
+            original = WikidataSlurper.skip_items
+
+            def skip_items(slurper, checkpoint, index):
+                skipped.append(original(slurper, checkpoint, index))
+                return skipped[-1]
+
+            with mock.patch.object(
+                WikidataSlurper, "skip_items", autospec=True, side_effect=skip_items
+            ):
+                run("import_wikidata", skip_keywords=True, resume=True)
+        # the results written before the interruption were skipped
+        self.assertEqual(sum(skipped), written)
+        self.assertEqual(snapshot(), expected)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_resume_import_agda_unimath(self):
+        with replayed(5):
+            run("import_agda_unimath")
+            expected = snapshot()
+            Item.objects.all().delete()
+            with self.assertRaises(Interrupted):
+                with mock.patch(
+                    "slurper.source_agda_unimath.ItemWriter", InterruptedItemWriter
+                ):
+                    run("import_agda_unimath")
+            self.assertEqual(ImportCheckpoint.objects.get().position, 40)
+            run("import_agda_unimath", resume=True)
+        self.assertEqual(snapshot(), expected)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+class ShardedImportTest(TransactionTestCase):
+    def test_shards_give_the_same_items(self):
+        snapshots = []
+        for options in [{"shards": 1}, {"shards": 10}, {"shards": 3, "page_size": 7}]:
+            Item.objects.all().delete()
+            with replayed(3):
+                run("import_wikidata", skip_keywords=True, **options)
+            snapshots.append(snapshot())
+        self.assertEqual(snapshots[1], snapshots[0])
+        self.assertEqual(snapshots[2], snapshots[0])
+
+
+def statement(prop, value, rank="normal", qualifiers=None):
+    def snak(value):
+        if isinstance(value, str) and value[0] == "Q" and value[1:].isdigit():
+            value = {"entity-type": "item", "id": value}
+        return {"snaktype": "value", "property": prop, "datavalue": {"value": value}}
+
+    result = {"mainsnak": snak(value), "rank": rank}
+    if qualifiers:
+        result["qualifiers"] = {
+            qualifier: [
+                {
+                    "snaktype": "value",
+                    "property": qualifier,
+                    "datavalue": {"value": {"entity-type": "item", "id": value}},
+                }
+            ]
+            for qualifier, value in qualifiers.items()
+        }
+    return result
+
+
+def entity(id, label=None, sitelink=None, *statements):
+    result = {"type": "item", "id": id, "claims": {}}
+    if label:
+        result["labels"] = {"en": {"language": "en", "value": label}}
+    if sitelink:
+        result["sitelinks"] = {"enwiki": {"site": "enwiki", "title": sitelink}}
+    for s in statements:
+        result["claims"].setdefault(s["mainsnak"]["property"], []).append(s)
+    return result
+
+
+DUMP = [
+    # a class studied by mathematics and an area of mathematics
+    entity("Q1", "group", None, statement("P2579", "Q395")),
+    entity("Q2", "algebra", None, statement("P31", "Q1936384")),
+    entity(
+        "Q10",
+        "cyclic group",
+        "Cyclic group",
+        statement("P31", "Q1"),
+        statement("P4215", "cyclic+group"),
+        statement("P2812", "CyclicGroup"),
+        statement("P2812", "ModuloMultiplicationGroup"),
+    ),
+    entity("Q11", "ring", "Ring (mathematics)", statement("P2579", "Q2")),
+    entity(
+        "Q12",
+        "ideal",
+        None,
+        statement("P31", "Q151885", qualifiers={"P642": "Q2"}),
+        statement("P6781", "Definition:Ideal"),
+    ),
+    # deprecated statements are not truthy
+    entity("Q13", "not a group", None, statement("P31", "Q1", rank="deprecated")),
+    # humans are left out even with an identifier in another source
+    entity(
+        "Q14", "Emmy Noether", None, statement("P31", "Q5"), statement("P2812", "x")
+    ),
+]
+
+
+class WikidataDumpTest(TransactionTestCase):
+    def import_dump(self, processes):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "latest-all.json.gz"
+            with gzip.open(path, "wt", encoding="utf-8") as dump:
+                dump.write("[\n" + ",\n".join(json.dumps(e) for e in DUMP) + "\n]\n")
+            with replayed():
+                run(
+                    "import_wikidata",
+                    dump=str(path),
+                    dump_processes=processes,
+                    skip_keywords=True,
+                )
+
+    def test_import_dump(self):
+        self.import_dump(processes=1)
+        self.assertEqual(
+            set(Item.objects.values_list("source", "identifier")),
+            {
+                (Item.Source.WIKIDATA, "Q10"),
+                (Item.Source.WIKIDATA, "Q11"),
+                (Item.Source.WIKIDATA, "Q12"),
+                (Item.Source.WIKIPEDIA_EN, "Cyclic_group"),
+                (Item.Source.WIKIPEDIA_EN, "Ring_(mathematics)"),
+                (Item.Source.NLAB, "cyclic+group"),
+                (Item.Source.MATHWORLD, "CyclicGroup"),
+                (Item.Source.MATHWORLD, "ModuloMultiplicationGroup"),
+                (Item.Source.PROOF_WIKI, "Definition:Ideal"),
+            },
+        )
+        self.assertEqual(Link.objects.filter(source__identifier="Q10").count(), 4)
+        expected = snapshot()
+        Item.objects.all().delete()
+        self.import_dump(processes=2)
+        self.assertEqual(snapshot(), expected)
+
+
+class SlurperRegistryTest(SimpleTestCase):
+    def test_create(self):
+        created = []
+        registry = SlurperRegistry()
+        for name in ["a", "b", "c"]:
+            registry.register(name, lambda name=name, **kwargs: created.append(name))
+        self.assertEqual(created, [])
+        self.assertEqual(list(registry.create(["c", "a"], x=1)), ["a", "c"])
+        self.assertEqual(created, ["a", "c"])
+        with self.assertRaises(ValueError):
+            registry.create(["d"])
+        with self.assertRaises(ValueError):
+            registry.register("a", list)
+
+
+class LazySlurperTest(TestCase):
+    def test_creating_slurpers_fetches_nothing(self):
+        with (
+            mock.patch("slurper.http_cache.get", side_effect=AssertionError),
+            self.assertNumQueries(0),
+        ):
+            source_wikidata.SLURPERS.create()
+            source_agda_unimath.SLURPERS.create()
+
+
+class ExcludedCategoriesTest(TransactionTestCase):
+    def test_passed_to_queries(self):
+        slurpers = source_wikidata.SLURPERS.create(excluded_categories=["wd:Q1"])
+        for slurper in slurpers.values():
+            self.assertIn("VALUES ?excludedType { wd:Q1 }", slurper.query)
+
+    def test_loaded_once(self):
+        with (
+            replayed(1),
+            mock.patch(
+                "slurper.source_wikidata._load_excluded_categories_from_results",
+                return_value=[],
+            ) as load,
+        ):
+            run("import_wikidata", skip_keywords=True)
+        self.assertEqual(load.call_count, 1)
+
+
+def response(status_code=200, content=b"", headers=None):
+    result = requests.Response()
+    result.status_code = status_code
+    result._content = content
+    result.raw = io.BytesIO(content)
+    result.headers.update(headers or {})
+    result.url = "https://example.org/"
+    return result
+
+
+class ShardSlurper:
+    """Spools every shard, failing on one of them."""
+
+    query = ""
+
+    def __init__(self, shard_count=3, failing=None, delay=0):
+        self.shard_count = shard_count
+        self.failing = failing
+        self.delay = delay
+        self.spools = {}
+
+    def fetch_shard(self, shard):
+        if shard == self.failing:
+            raise requests.exceptions.ConnectionError("down")
+        if self.failing is not None:
+            # still running while the failure is handled
+            time.sleep(0.2)
+        time.sleep(self.delay)
+        self.spools[shard] = tempfile.TemporaryFile()
+        return self.spools[shard]
+
+    def merge(self, shard_results):
+        self.merged = shard_results
+
+
+class FetchConcurrentlyTest(SimpleTestCase):
+    def test_failed_shard(self):
+        slurpers = {"failing": ShardSlurper(failing=0), "ok": ShardSlurper()}
+        with self.assertLogs(level="ERROR"):
+            fetched = dict(source_wikidata.fetch_concurrently(slurpers, 1))
+        self.assertEqual(list(fetched), ["ok"])
+        self.assertEqual(len(slurpers["ok"].merged), 3)
+        self.assertFalse(any(spool.closed for spool in slurpers["ok"].merged))
+        failing = slurpers["failing"]
+        # a shard started meanwhile is discarded, the last one never sent
+        self.assertNotIn(2, failing.spools)
+        self.assertTrue(all(spool.closed for spool in failing.spools.values()))
+
+    def test_stopped_early(self):
+        slurpers = {name: ShardSlurper(1, delay=0.1) for name in "abcd"}
+        fetched = source_wikidata.fetch_concurrently(slurpers, 1)
+        name, slurper = next(fetched)
+        fetched.close()
+        self.assertEqual(name, "a")
+        self.assertFalse(slurper.spools[0].closed)
+        # the shard running meanwhile is discarded, the queued ones never run
+        self.assertTrue(slurpers["b"].spools[0].closed)
+        time.sleep(0.2)
+        self.assertEqual(slurpers["c"].spools, {})
+        self.assertEqual(slurpers["d"].spools, {})
+
+    def test_retry(self):
+        slurper = source_wikidata.SLURPERS.create(["math-topics"])["math-topics"]
+        responses = [
+            response(503, headers={"Retry-After": "7"}),
+            response(500),
+            response(200, b"results"),
+        ]
+        with (
+            mock.patch("slurper.http_cache.get", side_effect=responses),
+            mock.patch("slurper.source_wikidata.time.sleep") as sleep,
+            self.assertLogs(level="WARNING"),
+        ):
+            result = slurper._request({"query": ""}, lambda r: r.content)
+        self.assertEqual(result, b"results")
+        # as asked by the server, then the doubled default
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [7, 2])
+
+    def test_retries_exhausted(self):
+        slurper = source_wikidata.SLURPERS.create(["math-topics"])["math-topics"]
+        with (
+            mock.patch("slurper.http_cache.get", return_value=response(503)),
+            mock.patch("slurper.source_wikidata.time.sleep"),
+            self.assertLogs(level="WARNING"),
+            self.assertRaises(requests.exceptions.HTTPError),
+        ):
+            slurper._request({"query": ""}, lambda r: r.content)
+
+
+class SparqlResultsTest(SimpleTestCase):
+    def test_csv(self):
+        stream = io.StringIO(
+            "item,itemLabel,aliases\r\n"
+            'http://www.wikidata.org/entity/Q1,"ring, commutative","a ""b"""\r\n'
+            'http://www.wikidata.org/entity/Q2,"two\nlines",\r\n'
+        )
+        self.assertEqual(
+            list(iter_csv_bindings(stream)),
+            [
+                {
+                    "item": {"value": "http://www.wikidata.org/entity/Q1"},
+                    "itemLabel": {"value": "ring, commutative"},
+                    "aliases": {"value": 'a "b"'},
+                },
+                {
+                    "item": {"value": "http://www.wikidata.org/entity/Q2"},
+                    "itemLabel": {"value": "two\nlines"},
+                },
+            ],
+        )
+
+    def test_tsv(self):
+        stream = io.StringIO(
+            "?item\t?itemLabel\t?aliases\t?count\n"
+            '<http://www.wikidata.org/entity/Q1>\t"ring"@en\t"a \\"b\\"\\tc"\t3\n'
+            '<http://www.wikidata.org/entity/Q2>\t"two\\nlines"@en-gb\t\t'
+            '"4"^^<http://www.w3.org/2001/XMLSchema#integer>\n'
+        )
+        self.assertEqual(
+            list(iter_tsv_bindings(stream)),
+            [
+                {
+                    "item": {"value": "http://www.wikidata.org/entity/Q1"},
+                    "itemLabel": {"value": "ring"},
+                    "aliases": {"value": 'a "b"\tc'},
+                    "count": {"value": "3"},
+                },
+                {
+                    "item": {"value": "http://www.wikidata.org/entity/Q2"},
+                    "itemLabel": {"value": "two\nlines"},
+                    "count": {"value": "4"},
+                },
+            ],
+        )
+
+    def test_empty(self):
+        self.assertEqual(list(iter_csv_bindings(io.StringIO(""))), [])
+        self.assertEqual(list(iter_tsv_bindings(io.StringIO(""))), [])
+
+    def test_json(self):
+        binding = {
+            "item": {"type": "uri", "value": "http://www.wikidata.org/entity/Q1"},
+            "itemLabel": {"type": "literal", "xml:lang": "en", "value": "ring"},
+        }
+        body = {"head": {"vars": ["item", "itemLabel"]}}
+        body["results"] = {"bindings": [binding]}
+        slurper = source_wikidata.SLURPERS.create(["math-topics"])["math-topics"]
+        with mock.patch(
+            "slurper.http_cache.get",
+            return_value=response(content=json.dumps(body).encode()),
+        ):
+            self.assertEqual(slurper.fetch_json(), [binding])
+
+
+class PagingTest(SimpleTestCase):
+    def slurper(self, page_size, limit=None):
+        slurper = source_wikidata.SLURPERS.create(["math-topics"])["math-topics"]
+        slurper.page_size = page_size
+        slurper.limit = limit
+        return slurper
+
+    def fetch_pages(self, slurper, items):
+        bindings = [{"item": {"value": item}, "n": {"value": i}} for i, item in items]
+        pages = []
+
+        def fetch_page(after, page_size, shard=0):
+            pages.append((after, page_size))
+            return [b for b in bindings if after is None or b["item"]["value"] > after][
+                :page_size
+            ]
+
+        with mock.patch.object(slurper, "fetch_page", fetch_page):
+            spool = slurper.fetch_pages()
+        spool.seek(0)
+        return [json.loads(line) for line in spool], pages
+
+    def test_keyset(self):
+        # the results of an item are never split over two pages, and a
+        # single item filling a whole page widens it
+        items = [(0, "Q1"), (1, "Q2"), (2, "Q2"), (3, "Q2"), (4, "Q3"), (5, "Q4")]
+        bindings, pages = self.fetch_pages(self.slurper(2), items)
+        self.assertEqual([b["n"]["value"] for b in bindings], list(range(6)))
+        self.assertEqual(pages, [(None, 2), ("Q1", 2), ("Q1", 4), ("Q2", 4)])
+
+    def test_limit(self):
+        items = [(i, f"Q{i}") for i in range(5)]
+        bindings, pages = self.fetch_pages(self.slurper(2, limit=3), items)
+        self.assertEqual([b["n"]["value"] for b in bindings], [0, 1, 2])
+        self.assertEqual(pages, [(None, 2), ("Q0", 2)])
+
+    def test_query(self):
+        query = self.slurper(2)._unlimited_query(0, "http://www.wikidata.org/entity/Q5")
+        self.assertIn('FILTER(STR(?item) > "http://www.wikidata.org/entity/Q5")', query)
+        self.assertNotIn("OFFSET", query)
+
+
+class StreamedCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.client = mock.Mock()
+        self.cache = ResponseCache(
+            directory.name, ttl=60, max_size=10**6, client=self.client
+        )
+
+    def test_stored_once_read(self):
+        self.client.get.return_value = response(content=b"a,b\r\n1,2\r\n")
+        fresh = self.cache.get("https://example.org/", stream=True)
+        self.assertEqual(self.client.get.call_args.kwargs["stream"], True)
+        self.assertEqual(self.cache.size(), 0)
+        with text_stream(fresh) as stream:
+            self.assertEqual(
+                list(iter_csv_bindings(stream)),
+                [{"a": {"value": "1"}, "b": {"value": "2"}}],
+            )
+        self.assertEqual(self.cache.size(), 10)
+
+        cached = self.cache.get("https://example.org/", stream=True)
+        self.assertTrue(cached.from_cache)
+        with text_stream(cached) as stream:
+            self.assertEqual(stream.read(), "a,b\r\n1,2\r\n")
+        self.assertEqual(self.client.get.call_count, 1)
+
+    def test_discarded_if_not_read(self):
+        self.client.get.return_value = response(content=b"a,b\r\n1,2\r\n")
+        fresh = self.cache.get("https://example.org/", stream=True)
+        fresh.raw.read(3)
+        fresh.close()
+        self.cache.get("https://example.org/", stream=True).close()
+        self.assertEqual(self.client.get.call_count, 2)
+        self.assertEqual(list(Path(self.cache.directory, "blobs").iterdir()), [])
+
+
+class RetryAfterTest(SimpleTestCase):
+    def test_retry_after(self):
+        in_a_minute = datetime.now(timezone.utc) + timedelta(minutes=1)
+        for value, expected in [
+            (None, 5),
+            ("30", 30),
+            ("soon", 5),
+            (format_datetime(in_a_minute), 60),
+            # parsed as a naive datetime
+            (format_datetime(in_a_minute.replace(tzinfo=None)), 60),
+            (format_datetime(in_a_minute - timedelta(hours=1)), 0),
+        ]:
+            headers = {} if value is None else {"Retry-After": value}
+            wait = retry_after(response(503, headers=headers), 5)
+            self.assertAlmostEqual(wait, expected, delta=2, msg=value)
+
+
+class ResponseCacheTest(SimpleTestCase):
+    url = "https://example.org/"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.client = mock.Mock()
+        self.cache = ResponseCache(
+            directory.name, ttl=60, max_size=25, client=self.client
+        )
+
+    def get(self, url=url, **kwargs):
+        return self.cache.get(url, **kwargs)
+
+    def test_ttl(self):
+        self.client.get.return_value = response(content=b"fresh")
+        self.assertFalse(self.get().from_cache)
+        cached = self.get()
+        self.assertTrue(cached.from_cache)
+        self.assertEqual(cached.content, b"fresh")
+        self.assertEqual(self.client.get.call_count, 1)
+
+        self.client.get.return_value = response(content=b"newer")
+        with mock.patch("slurper.http_cache.time.time", return_value=time.time() + 61):
+            self.assertEqual(self.get().content, b"newer")
+        self.assertEqual(self.client.get.call_count, 2)
+
+    def test_revalidation(self):
+        validators = {"ETag": '"v1"', "Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT"}
+        self.client.get.return_value = response(content=b"body", headers=validators)
+        self.get()
+        self.client.get.return_value = response(304)
+        with mock.patch("slurper.http_cache.time.time", return_value=time.time() + 61):
+            revalidated = self.get()
+        headers = self.client.get.call_args.kwargs["headers"]
+        self.assertEqual(headers["If-None-Match"], '"v1"')
+        self.assertEqual(headers["If-Modified-Since"], validators["Last-Modified"])
+        self.assertTrue(revalidated.from_cache)
+        self.assertEqual(revalidated.content, b"body")
+        # revalidated entries are fresh again
+        self.get()
+        self.assertEqual(self.client.get.call_count, 2)
+
+    def test_lru_eviction(self):
+        for i, name in enumerate("ab"):
+            self.client.get.return_value = response(content=name.encode() * 10)
+            self.get(self.url + name)
+            # a was used more recently than b
+            os.utime(
+                self.cache._entry_path(self.cache._key(self.url + name, None, {})),
+                (2 - i, 2 - i),
+            )
+        self.client.get.return_value = response(content=b"c" * 10)
+        self.get(self.url + "c")
+        self.assertEqual(self.cache.size(), 20)
+
+        self.client.get.reset_mock()
+        self.assertEqual(self.get(self.url + "a").content, b"a" * 10)
+        self.assertEqual(self.get(self.url + "c").content, b"c" * 10)
+        self.client.get.assert_not_called()
+        self.client.get.return_value = response(content=b"b" * 10)
+        self.assertFalse(self.get(self.url + "b").from_cache)
+
+    def test_offline(self):
+        self.client.get.return_value = response(content=b"body")
+        self.get()
+        self.cache.offline = True
+        with mock.patch("slurper.http_cache.time.time", return_value=time.time() + 61):
+            self.assertEqual(self.get().content, b"body")
+        with self.assertRaises(OfflineCacheMiss):
+            self.get(self.url + "missing")
+        self.assertEqual(self.client.get.call_count, 1)
+
+
+def revision(title, content):
+    return {"title": title, "revisions": [{"slots": {"main": {"content": content}}}]}
+
+
+@mock.patch("slurper.wikipedia.WIKIPEDIA_CONTACT_EMAIL", "test@example.org")
+class ArticleFetcherTest(SimpleTestCase):
+    def fetch(self, titles, responses, batch_size=BATCH_SIZE):
+        fetcher = ArticleFetcher(batch_size=batch_size, workers=1)
+        with mock.patch.object(fetcher, "_request", side_effect=responses) as request:
+            articles = fetcher.fetch_articles(titles)
+        return articles, [call.args[0] for call in request.call_args_list]
+
+    def test_renames(self):
+        first = {
+            "continue": {"rvcontinue": "2|3", "continue": "||"},
+            "query": {
+                "normalized": [{"from": "Ring_theory", "to": "Ring theory"}],
+                "redirects": [
+                    {"from": "Ring theory", "to": "Rings"},
+                    {"from": "Field", "to": "Field (mathematics)"},
+                ],
+                "pages": [
+                    revision("Rings", "'''Rings''' are..."),
+                    {"title": "Field (mathematics)"},
+                    {"title": "Nothing", "missing": True},
+                ],
+            },
+        }
+        second = {
+            "batchcomplete": True,
+            "query": {
+                "normalized": [{"from": "Ring_theory", "to": "Ring theory"}],
+                "redirects": [{"from": "Field", "to": "Field (mathematics)"}],
+                "pages": [
+                    {"title": "Rings"},
+                    revision("Field (mathematics)", "[[Field]]s are..."),
+                ],
+            },
+        }
+        articles, params = self.fetch(
+            ["Ring_theory", "Field", "Nothing"], [first, second]
+        )
+        self.assertEqual(
+            articles,
+            {"Ring_theory": "Rings are...", "Field": "Fields are...", "Nothing": None},
+        )
+        self.assertEqual(params[0]["titles"], "Ring_theory|Field|Nothing")
+        self.assertEqual(params[1]["rvcontinue"], "2|3")
+
+    def test_batches(self):
+        titles = [f"Title {i}" for i in range(120)]
+        responses = [
+            {"query": {"pages": [revision(title, title) for title in batch]}}
+            for batch in chunked(titles, 50)
+        ]
+        articles, params = self.fetch(titles, responses, batch_size=50)
+        self.assertEqual(articles, {title: title for title in titles})
+        self.assertEqual(len(params), 3)
+
+    def test_failed_continuation(self):
+        first = {
+            "continue": {"rvcontinue": "2|3", "continue": "||"},
+            "query": {
+                "pages": [revision("Group", "Groups are..."), {"title": "Ring"}],
+            },
+        }
+        articles, params = self.fetch(["Group", "Ring"], [first, None])
+        # the articles fetched before the failure are kept, the others are
+        # left out as they are unknown
+        self.assertEqual(articles, {"Group": "Groups are..."})
+        self.assertEqual(len(params), 2)
+
+    def test_plain_text(self):
+        wikitext = (
+            "{{Short description|Algebraic structure}}\n"
+            "{{Infobox|image={{nested|x}}}}\n"
+            "A '''ring''' is a [[set (mathematics)|set]] with two "
+            "[[binary operation]]s.<ref name=a>Lang, p. 1</ref> "
+            "See [https://example.org the site].\n"
+            "[[File:Ring.svg|thumb|A [[ring (mathematics)|ring]]]]\n"
+            "<!-- hidden -->\n"
+            "== History ==\n"
+            "* Coined by [[David Hilbert|Hilbert]]&nbsp;&amp; others.\n"
+            '{| class="wikitable"\n| a || b\n|}\n'
+            "[[Category:Rings]]\n"
+        )
+        self.assertEqual(
+            plain_text(wikitext),
+            "A ring is a set with two binary operations. See the site.\n\n"
+            "History\nCoined by Hilbert\xa0& others.",
+        )
+
+
+class HttpClientTest(SimpleTestCase):
+    def test_hosts(self):
+        client = HttpClient(host_concurrency={"a.org": 2}, default_host_concurrency=3)
+        self.addCleanup(client.close)
+        lock = threading.Lock()
+        in_flight = {"a.org": 0, "b.org": 0}
+        most_in_flight = dict(in_flight)
+        sessions = {"a.org": set(), "b.org": set()}
+
+        def get(session, url, **kwargs):
+            host = urlsplit(url).netloc
+            with lock:
+                sessions[host].add(session)
+                in_flight[host] += 1
+                most_in_flight[host] = max(most_in_flight[host], in_flight[host])
+            time.sleep(0.05)
+            with lock:
+                in_flight[host] -= 1
+            return response()
+
+        urls = [f"https://{host}/{i}" for host in in_flight for i in range(6)]
+        with (
+            mock.patch.object(requests.Session, "get", autospec=True, side_effect=get),
+            ThreadPoolExecutor(max_workers=len(urls)) as executor,
+        ):
+            list(executor.map(client.get, urls))
+        self.assertEqual(most_in_flight, {"a.org": 2, "b.org": 3})
+        self.assertEqual([len(used) for used in sessions.values()], [1, 1])
+        session = sessions["a.org"].pop()
+        self.assertIn("MathSwitch", session.headers["User-Agent"])
+        self.assertIn("gzip", session.headers["Accept-Encoding"])
+
+    def test_stream(self):
+        client = HttpClient()
+        self.addCleanup(client.close)
+        streamed = response(content=b"body")
+        streamed.raw = mock.Mock()
+        with mock.patch.object(requests.Session, "get", return_value=streamed) as get:
+            self.assertIs(client.get("https://a.org/", stream=True), streamed)
+        self.assertTrue(get.call_args.kwargs["stream"])
+        self.assertTrue(streamed.raw.decode_content)
+        streamed.raw.read.assert_not_called()
+
+    def test_stream_keeps_slot(self):
+        client = HttpClient(host_concurrency={"a.org": 1})
+        self.addCleanup(client.close)
+        responses = [response(content=b"first"), response(content=b"second")]
+        with (
+            mock.patch.object(requests.Session, "get", side_effect=responses),
+            ThreadPoolExecutor(max_workers=1) as executor,
+        ):
+            streamed = client.get("https://a.org/1", stream=True)
+            second = executor.submit(client.get, "https://a.org/2")
+            time.sleep(0.05)
+            # the body of the first response is still being read
+            self.assertFalse(second.done())
+            self.assertEqual(streamed.raw.read(), b"first")
+            streamed.raw.close()
+            self.assertEqual(second.result(5).content, b"second")
+        streamed.close()
+
+
+class PipelineTest(SimpleTestCase):
+    @staticmethod
+    def slow_square(n):
+        # later elements finish first
+        time.sleep(0.01 * (5 - n % 5))
+        return n * n
+
+    def run_pipeline(self, pipeline, source, **kwargs):
+        results = []
+        pipeline.run(source, results.append, **kwargs)
+        return results
+
+    def test_stages(self):
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add_stage(self.slow_square, workers=4)
+        pipeline.add_stage(str)
+        results = self.run_pipeline(pipeline, range(20))
+        self.assertCountEqual(results, [str(n * n) for n in range(20)])
+
+    def test_ordered(self):
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add_stage(self.slow_square, workers=4)
+        pipeline.add_stream_stage(lambda elements: (-n for n in elements))
+        results = self.run_pipeline(pipeline, range(20), ordered=True)
+        self.assertEqual(results, [-n * n for n in range(20)])
+
+    def test_stream_stage(self):
+        batches = []
+
+        def batched(elements):
+            for batch in chunked(elements, 3):
+                batches.append(batch)
+                yield from batch
+
+        pipeline = Pipeline()
+        pipeline.add_stream_stage(batched)
+        self.assertEqual(self.run_pipeline(pipeline, range(7)), list(range(7)))
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_errors(self):
+        def failing_source():
+            yield 1
+            raise KeyError("source")
+
+        def failing_stream(elements):
+            return map(fail_on_3, elements)
+
+        for add_stage, source, error in [
+            (lambda p: p.add_stage(fail_on_3, workers=2), range(10**6), ValueError),
+            (lambda p: p.add_stream_stage(failing_stream), range(10**6), ValueError),
+            (lambda p: p.add_stage(str), failing_source(), KeyError),
+        ]:
+            pipeline = Pipeline()
+            add_stage(pipeline)
+            with self.assertRaises(error):
+                self.run_pipeline(pipeline, source)
+
+        pipeline = Pipeline()
+        pipeline.add_stage(int, workers=2)
+        with self.assertRaises(ValueError):
+            pipeline.run(range(10**6), fail_on_3)
+
+
+def fail_on_3(n):
+    if n == 3:
+        raise ValueError(n)
+    return n
+
+
+def wikidata_item(i, **fields):
+    fields.setdefault("name", f"item {i}")
+    return Item(
+        source=Item.Source.WIKIDATA,
+        identifier=f"Q{i}",
+        url=f"https://www.wikidata.org/wiki/Q{i}",
+        **fields,
+    )
+
+
+class ItemWriterTest(QueryBudgetMixin, TestCase):
+    def test_batches(self):
+        on_flush = mock.Mock()
+        with self.assertQueryBudget(select=1, insert=3, update=0):
+            with ItemWriter(batch_size=2, on_flush=on_flush) as writer:
+                for i in range(5):
+                    writer.add(wikidata_item(i))
+                # the first item with a given identifier wins
+                writer.add(wikidata_item(0, name="duplicate"))
+        self.assertEqual(on_flush.call_count, 3)
+        self.assertEqual(writer.inserted, 5)
+        self.assertEqual(
+            list(Item.objects.order_by("identifier").values_list("name", flat=True)),
+            [f"item {i}" for i in range(5)],
+        )
+
+    def test_diff(self):
+        with ItemWriter() as writer:
+            for i in range(3):
+                writer.add(wikidata_item(i))
+        # deleting an item also deletes its links, pending links and results
+        with self.assertQueryBudget(select=3, update=1, insert=1, delete=4):
+            with ItemWriter() as writer:
+                writer.add(wikidata_item(0))
+                writer.add(wikidata_item(1, name="renamed"))
+                writer.add(wikidata_item(3))
+                writer.delete_unseen([Item.Source.WIKIDATA])
+        self.assertEqual(
+            (writer.inserted, writer.updated, writer.unchanged, writer.deleted),
+            (1, 1, 1, 1),
+        )
+        self.assertEqual(
+            list(Item.objects.order_by("identifier").values_list("name", flat=True)),
+            ["item 0", "renamed", "item 3"],
+        )
+
+    def test_failed_article(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = BlobStore(Path(directory.name) / "articles.blob")
+        self.addCleanup(use_store, use_store(store))
+        self.addCleanup(store.close)
+        with ItemWriter() as writer:
+            for i in range(3):
+                item = wikidata_item(i, article_text=f"article {i}", keywords="a, b")
+                item.keywords_hash = item.article_hash
+                writer.add(item)
+        before = {item.identifier: item for item in Item.objects.all()}
+
+        with ItemWriter(batch_size=2) as writer:
+            for i, name in enumerate(["item 0", "renamed", "item 2"]):
+                item = wikidata_item(i, name=name)
+                # the fetch of the first two articles failed
+                item.article_failed = i < 2
+                writer.add(item)
+        self.assertEqual((writer.updated, writer.unchanged), (2, 1))
+        after = {item.identifier: item for item in Item.objects.all()}
+        self.assertEqual(after["Q1"].name, "renamed")
+        for identifier in ["Q0", "Q1"]:
+            self.assertEqual(after[identifier].article_text, f"article {identifier[1]}")
+            for field in ["article_hash", "keywords", "keywords_hash"]:
+                self.assertEqual(
+                    getattr(after[identifier], field),
+                    getattr(before[identifier], field),
+                )
+        # there is no article anymore
+        self.assertIsNone(after["Q2"].article_text)
+        self.assertIsNone(after["Q2"].article_hash)
+
+    def test_dry_run(self):
+        with ItemWriter(batch_size=2, dry_run=True) as writer:
+            for i in range(3):
+                writer.add(wikidata_item(i))
+        self.assertEqual(writer.inserted, 3)
+        self.assertFalse(Item.objects.exists())
+
+    def test_deleted_items_update_concepts(self):
+        a, b, c = Item.objects.bulk_create([wikidata_item(i) for i in range(3)])
+        Link.objects.bulk_create(
+            [
+                Link(source=a, destination=b, label=Link.Label.WIKIDATA),
+                Link(source=b, destination=c, label=Link.Label.WIKIDATA),
+            ]
+        )
+        call_command("compute_concepts")
+        changes = ConceptChanges()
+        index = ItemIndex()
+        for item in (a, c):
+            index.mark_seen((item.source, item.identifier))
+        with ItemWriter(index, changes=changes) as writer:
+            writer.delete_unseen([Item.Source.WIKIDATA])
+        changes.apply()
+        # the concept of the deleted item falls apart
+        a.refresh_from_db()
+        c.refresh_from_db()
+        self.assertNotEqual(a.concept_id, c.concept_id)
+
+
+class DeletedDestinationTest(TransactionTestCase):
+    def agda_unimath_links(self):
+        return set(
+            Link.objects.filter(label=Link.Label.AGDA_UNIMATH).values_list(
+                "source__identifier", "destination__identifier"
+            )
+        )
+
+    def test_reimport_restores_links(self):
+        with replayed(2):
+            run("import_wikidata", skip_keywords=True)
+            run("import_agda_unimath")
+            links = self.agda_unimath_links()
+            self.assertTrue(links)
+            # an import in which the linked Wikidata items have disappeared
+            destinations = Item.objects.filter(
+                incoming_items__label=Link.Label.AGDA_UNIMATH
+            )
+            index = ItemIndex()
+            for key in Item.objects.exclude(pk__in=destinations).values_list(
+                "source", "identifier"
+            ):
+                index.mark_seen(key)
+            with ItemWriter(index) as writer:
+                writer.delete_unseen(source_wikidata.SOURCES)
+            self.assertFalse(self.agda_unimath_links())
+            self.assertEqual(PendingLink.objects.count(), len(links))
+            # the next import brings them back, and their links with them
+            run("import_wikidata", skip_keywords=True)
+        self.assertEqual(self.agda_unimath_links(), links)
+        self.assertFalse(PendingLink.objects.exists())
+
+
+class GetItemsTest(TestCase):
+    def test_identity_map(self):
+        # a Wikidata item with a Wikipedia article is found by two queries
+        binding = {
+            "item": {"value": "http://www.wikidata.org/entity/Q1"},
+            "itemLabel": {"value": "ring"},
+            "nlabID": {"value": "ring"},
+            "wp_en": {"value": "https://en.wikipedia.org/wiki/Ring_(mathematics)"},
+        }
+        slurpers = source_wikidata.SLURPERS.create(["math-topics", "nlab"])
+        index = ItemIndex()
+        items = []
+        with self.assertNumQueries(0):
+            for slurper in slurpers.values():
+                for item in slurper.get_items([binding], index):
+                    index.mark_seen((item.source, item.identifier))
+                    items.append((item.source, item.identifier))
+        self.assertEqual(
+            items,
+            [
+                (Item.Source.WIKIDATA, "Q1"),
+                (Item.Source.WIKIPEDIA_EN, "Ring_(mathematics)"),
+                (Item.Source.NLAB, "ring"),
+            ],
+        )
+
+
+class ArticleStoreTest(SimpleTestCase):
+    def test_dedup(self):
+        fetcher = mock.Mock()
+        fetcher.fetch_articles.side_effect = lambda titles: {
+            title: f"{title} is..." for title in titles
+        }
+        store = ArticleStore(fetcher)
+        self.assertEqual(
+            store.articles(["Ring_theory", "ring theory", "Group"]),
+            {
+                "Ring_theory": "Ring_theory is...",
+                "ring theory": "Ring_theory is...",
+                "Group": "Group is...",
+            },
+        )
+        store.articles(["Ring theory", "Group"])
+        self.assertEqual(fetcher.fetch_articles.call_count, 1)
+        self.assertEqual((store.fetched, store.reused), (2, 2))
+
+    def test_concurrent(self):
+        # a title asked for while it is fetched waits for that fetch
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch_articles(titles):
+            started.set()
+            release.wait(5)
+            return {title: "Groups are..." for title in titles}
+
+        fetcher = mock.Mock()
+        fetcher.fetch_articles.side_effect = fetch_articles
+        store = ArticleStore(fetcher)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(store.articles, ["Group"])
+            started.wait(5)
+            second = executor.submit(store.articles, ["group"])
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual(first.result(), {"Group": "Groups are..."})
+            self.assertEqual(second.result(), {"group": "Groups are..."})
+        self.assertEqual(fetcher.fetch_articles.call_count, 1)
+
+    def test_failed_fetch(self):
+        fetcher = mock.Mock()
+        fetcher.fetch_articles.side_effect = [
+            {"Group": "Groups are...", "Nothing": None},
+            {"Ring": "Rings are..."},
+        ]
+        store = ArticleStore(fetcher)
+        # the fetch of Ring failed, so it is left out and not fetched again
+        for _ in range(2):
+            self.assertEqual(
+                store.articles(["Group", "Ring", "Nothing"]),
+                {"Group": "Groups are...", "Nothing": None},
+            )
+        self.assertEqual(fetcher.fetch_articles.call_count, 1)
+
+    def test_evicted(self):
+        fetcher = mock.Mock()
+        fetcher.fetch_articles.side_effect = lambda titles: {
+            title: f"{title} is..." for title in titles
+        }
+        store = ArticleStore(fetcher, cache_size=1)
+        self.assertEqual(
+            store.articles(["Group", "Ring"]),
+            {"Group": "Group is...", "Ring": "Ring is..."},
+        )
+        # the text of Group is no longer kept, and it is not fetched again
+        self.assertEqual(store.articles(["Group", "Ring"]), {"Ring": "Ring is..."})
+        self.assertEqual(fetcher.fetch_articles.call_count, 1)
+
+    def test_article_failed(self):
+        slurper = source_wikidata.SLURPERS.create(["math-topics"])["math-topics"]
+        slurper.article_store = ArticleStore(mock.Mock())
+        slurper.article_store.fetcher.fetch_articles.return_value = {}
+        url = "https://en.wikipedia.org/wiki/Group"
+        [json_item] = slurper.fetch_articles([{"wp_en": {"value": url}}])
+        self.assertIn("article_failed", json_item)
+        self.assertNotIn("article_text", json_item)
+
+
+class FakeNlp:
+    """Stands in for the spaCy model, recognizing capitalized words."""
+
+    def __init__(self):
+        self.texts = []
+        self.batch_sizes = []
+
+    def pipe(self, pairs, as_tuples, batch_size, n_process):
+        self.batch_sizes.append(batch_size)
+        for text, key in pairs:
+            self.texts.append(text)
+            entities = [mock.Mock(text=word) for word in text.split() if word.istitle()]
+            yield mock.Mock(ents=entities), key
+
+
+class ExtractKeywordsTest(SimpleTestCase):
+    def setUp(self):
+        self.nlp = FakeNlp()
+        patcher = mock.patch("slurper.keyword_util._get_nlp", return_value=self.nlp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch(self):
+        pairs = [(1, "Group Theory studies"), (2, None), (3, "nothing here")]
+        self.assertEqual(
+            list(keyword_util.extract_keywords_batch(iter(pairs), batch_size=2)),
+            [(1, "group, theory"), (2, None), (3, None)],
+        )
+        self.assertEqual(self.nlp.batch_sizes, [2])
+
+    @mock.patch("slurper.keyword_util.NLP_MAX_LENGTH", 12)
+    def test_max_length(self):
+        list(keyword_util.extract_keywords_batch([(1, "Ring Theory Studies Rings")]))
+        # cut at the last word boundary
+        self.assertEqual(self.nlp.texts, ["Ring Theory"])
+
+
+class KeywordCacheTest(TestCase):
+    def setUp(self):
+        self.nlp = FakeNlp()
+        patcher = mock.patch("slurper.keyword_util._get_nlp", return_value=self.nlp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cache(self):
+        ArticleKeywords.objects.bulk_create(
+            [
+                ArticleKeywords(
+                    text_hash=text_hash("Cached Text"),
+                    pipeline=keyword_util.pipeline_signature(),
+                    keywords="cached",
+                ),
+                ArticleKeywords(
+                    text_hash=text_hash("Other Pipeline"),
+                    pipeline="another pipeline",
+                    keywords="stale",
+                ),
+            ]
+        )
+        store = ArticleStore(mock.Mock(), nlp_batch_size=2)
+        pairs = [
+            (1, "Cached Text"),
+            (2, "Group Theory"),
+            (3, "Group Theory"),
+            (4, None),
+            (5, "Other Pipeline"),
+        ]
+        with self.assertNumQueries(1):
+            keywords = dict(store.keywords(iter(pairs)))
+        # cached keywords are only read on request
+        self.assertIsInstance(keywords[1], CachedKeywords)
+        store.load_keywords(keywords)
+        self.assertEqual(
+            keywords,
+            {
+                1: "cached",
+                2: "group, theory",
+                3: "group, theory",
+                4: None,
+                5: "other, pipeline",
+            },
+        )
+        # every distinct text not in the cache is analysed once
+        self.assertEqual(
+            [text for text in self.nlp.texts if text],
+            ["Group Theory", "Other Pipeline"],
+        )
+        self.assertEqual((store.keywords_extracted, store.keywords_cached), (2, 1))
+
+        store.save_keywords()
+        self.assertEqual(
+            ArticleKeywords.objects.filter(
+                pipeline=keyword_util.pipeline_signature()
+            ).count(),
+            3,
+        )
+        # the next import finds them all in the cache
+        store = ArticleStore(mock.Mock())
+        self.nlp.texts.clear()
+        store.load_keywords(dict(store.keywords(iter(pairs))))
+        self.assertEqual((store.keywords_extracted, store.keywords_cached), (0, 3))
+
+
+class NlpProfileTest(SimpleTestCase):
+    @mock.patch("slurper.keyword_util.NLP_PROFILE", "ner")
+    def test_ner_profile(self):
+        with (
+            mock.patch.object(keyword_util, "_nlp", None),
+            mock.patch("slurper.keyword_util.spacy.load") as load,
+        ):
+            keyword_util._get_nlp()
+        load.assert_called_once_with(
+            keyword_util.NLP_MODEL, exclude=keyword_util.PROFILES["ner"]
+        )
+
+
+class ExtractKeywordsCommandTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = BlobStore(Path(directory.name) / "articles.blob")
+        self.addCleanup(use_store, use_store(store))
+        self.addCleanup(store.close)
+        self.nlp = FakeNlp()
+        patcher = mock.patch("slurper.keyword_util._get_nlp", return_value=self.nlp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        articles = ["Alpha Beta", "Gamma Delta", "Epsilon Zeta", None]
+        for i, article in enumerate(articles):
+            wikidata_item(i, article_text=article, keywords="old").save()
+        self.items = list(Item.objects.order_by("pk"))
+        # the keywords of the second article are from a previous version,
+        # those of the third are up to date
+        Item.objects.filter(pk=self.items[1].pk).update(keywords_hash="0" * 64)
+        Item.objects.filter(pk=self.items[2].pk).update(keywords_hash=F("article_hash"))
+
+    def extract_keywords(self, **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command("extract_keywords", **options)
+        return list(Item.objects.order_by("pk").values_list("keywords", flat=True))
+
+    def test_stale(self):
+        self.assertEqual(
+            self.extract_keywords(),
+            ["alpha, beta", "gamma, delta", "old", "old"],
+        )
+        self.assertEqual(
+            [text for text in self.nlp.texts if text], ["Alpha Beta", "Gamma Delta"]
+        )
+        self.assertFalse(Item.objects.without_keywords().exists())
+
+    def test_limit(self):
+        self.assertEqual(
+            self.extract_keywords(limit=1), ["alpha, beta", "old", "old", "old"]
+        )
+        # the next run carries on
+        self.assertEqual(
+            self.extract_keywords(limit=1),
+            ["alpha, beta", "gamma, delta", "old", "old"],
+        )
+
+    def test_cached(self):
+        ArticleKeywords.objects.create(
+            text_hash=self.items[0].article_hash,
+            pipeline=keyword_util.pipeline_signature(),
+            keywords="cached",
+        )
+        self.assertEqual(
+            self.extract_keywords(), ["cached", "gamma, delta", "old", "old"]
+        )
+        self.assertEqual([text for text in self.nlp.texts if text], ["Gamma Delta"])
+
+    def test_query_budget(self):
+        # a few queries per chunk of items, not per item
+        for i in range(4, 40):
+            wikidata_item(i, article_text=f"Article {i}").save()
+        with self.assertQueryBudget(5, label="extract_keywords"):
+            run("extract_keywords")
+        self.assertFalse(Item.objects.without_keywords().exists())
+        self.assertEqual(self.nlp.batch_sizes, [keyword_util.NLP_BATCH_SIZE])
+
+
+class BenchmarkTest(TransactionTestCase):
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "benchmark.json"
+            call_command(
+                "benchmark_import",
+                stages=["import_wikidata", "import_agda_unimath"],
+                skip_keywords=True,
+                output=str(output),
+            )
+            report = json.loads(output.read_text())
+        wikidata, agda_unimath = report["stages"]
+        self.assertEqual(wikidata["items_added"], wikidata["items"])
+        self.assertGreater(agda_unimath["items_added"], 0)
+        self.assertEqual(
+            wikidata["items_added"] + agda_unimath["items_added"],
+            agda_unimath["items"],
+        )
+        self.assertGreaterEqual(
+            agda_unimath["cumulative_peak_rss_kb"], wikidata["cumulative_peak_rss_kb"]
+        )
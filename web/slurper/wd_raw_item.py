@@ -1,24 +1,27 @@
 from typing import Optional
 
 from concepts.models import Item, Link
-from slurper.keyword_util import extract_keywords
 
 WD_OTHER_SOURCES = {
     Item.Source.NLAB: {
         "wd_property": "wdt:P4215",
         "json_key": "nlabID",
+        "slug": "nlab",
     },
     Item.Source.MATHWORLD: {
         "wd_property": "wdt:P2812",
         "json_key": "mwID",
+        "slug": "mathworld",
     },
     Item.Source.PROOF_WIKI: {
         "wd_property": "wdt:P6781",
         "json_key": "pwID",
+        "slug": "proofwiki",
     },
     Item.Source.ENCYCLOPEDIA_OF_MATHEMATICS: {
         "wd_property": "wdt:P7554",
         "json_key": "eomID",
+        "slug": "eom",
     },
 }
 # Wikipedia is dealt with elsewhere
@@ -26,10 +29,14 @@ WD_OTHER_SOURCES = {
 
 class BaseWdRawItem:
     def __init__(self, source, json_item):
+        """
+        Args:
+            source: The source of the item
+            json_item: The SPARQL result the item is described by
+        """
         self.source = source
         self.raw = json_item
         self.wd_id = self.raw["item"]["value"]
-        self.item = self.get_item()
 
     def identifier(self):
         pass
@@ -50,11 +57,29 @@ class BaseWdRawItem:
         return None
 
     def article_text(self):
-        """Get the Wikipedia article text if available."""
-        if "article_text" in self.raw:
-            return self.raw["article_text"]["value"]
         return None
 
+    def article_failed(self):
+        """Whether the article could not be fetched, in which case the
+        previous one is kept."""
+        return False
+
+    def keywords_current(self):
+        """Whether the keywords stored for the item were extracted from the
+        same article, in which case they are kept."""
+        return False
+
+    def has_keywords(self):
+        """Whether keywords were extracted from the article beforehand,
+        which the import may skip."""
+        return self.article_text() is not None and "keywords" in self.raw
+
+    def keywords(self):
+        """Get the keywords extracted from the article text if available."""
+        if not self.has_keywords():
+            return None
+        return self.raw["keywords"]["value"]
+
     def has_source(self, source):
         if source == Item.Source.WIKIPEDIA_EN:
             return "wp_en" in self.raw
@@ -65,48 +90,45 @@ class BaseWdRawItem:
         return BaseWdRawItem.raw_item(source, self.raw)
 
     def to_item(self) -> Optional[Item]:
-        # Extract keywords from article text if available
-        article = self.article_text()
-        keywords = None
-
-        if article:
-            # Extract entities using spaCy
-            entities = extract_keywords(article)
-            # Convert to lowercase and create comma-separated string
-            keyword_list = [entity.text.lower() for entity in entities]
-            keywords = ", ".join(keyword_list) if keyword_list else None
-
-        return Item(
+        item = Item(
             source=self.source,
             identifier=self.identifier(),
             url=self.url(),
             name=self.name(),
             description=self.description(),
-            keywords=keywords,
-            article_text=article,
+            keywords=self.keywords(),
+            article_text=self.article_text(),
             aliases=self.aliases(),
         )
-
-    def _get_item_queryset(self):
-        return Item.objects.filter(source=self.source, identifier=self.identifier())
-
-    def item_exists(self):
-        return self._get_item_queryset().exists()
-
-    def get_item(self) -> Optional[Item]:
-        return self._get_item_queryset().first()
-
-    def save_link_to(self, source):
+        if self.has_keywords():
+            item.keywords_hash = item.article_hash
+        if self.keywords_current():
+            item.keywords_hash = item.article_hash
+        item.article_failed = self.article_failed()
+        item.keywords_current = self.keywords_current()
+        return item
+
+    def key(self):
+        return (self.source, self.identifier())
+
+    def save_link_to(self, source, index, writer):
         target = self.switch_source_to(source)
-        if target is not None:
-            destinationItem = target.get_item()
-            if self.item is not None and destinationItem is not None:
-                Link.save_new(self.item, destinationItem, Link.Label.WIKIDATA)
-
-    def save_links(self):
+        source_id = index.get(self.source, self.identifier())
+        destination_id = index.get(target.source, target.identifier())
+        if source_id is not None and destination_id is not None:
+            writer.add(source_id, destination_id, Link.Label.WIKIDATA)
+
+    def save_links(self, index, writer):
+        """
+        Add the links of this item to a link writer.
+
+        Args:
+            index: ItemIndex resolving the ids of the linked items
+            writer: LinkWriter collecting the links
+        """
         # always save a link to the Wikipedia item
         if self.has_source(Item.Source.WIKIPEDIA_EN):
-            self.save_link_to(Item.Source.WIKIPEDIA_EN)
+            self.save_link_to(Item.Source.WIKIPEDIA_EN, index, writer)
 
     @staticmethod
     def raw_item(source, json_item):
@@ -147,11 +169,11 @@ class WdRawItem(BaseWdRawItem):
         else:
             return None
 
-    def save_links(self):
-        super().save_links()
+    def save_links(self, index, writer):
+        super().save_links(index, writer)
         for source in WD_OTHER_SOURCES:
             if self.has_source(source):
-                self.save_link_to(source)
+                self.save_link_to(source, index, writer)
 
 
 class WpENRawItem(BaseWdRawItem):
@@ -167,6 +189,18 @@ class WpENRawItem(BaseWdRawItem):
     def name(self):
         return self.identifier()
 
+    def article_text(self):
+        """Get the Wikipedia article text if available."""
+        if "article_text" in self.raw:
+            return self.raw["article_text"]["value"]
+        return None
+
+    def article_failed(self):
+        return "article_failed" in self.raw
+
+    def keywords_current(self):
+        return "keywords_current" in self.raw
+
 
 class OtherWdRawItem(BaseWdRawItem):
     def __init__(self, source, json_item):
@@ -179,10 +213,10 @@ class OtherWdRawItem(BaseWdRawItem):
     def name(self):
         return self.identifier()
 
-    def save_links(self):
-        super().save_links()
+    def save_links(self, index, writer):
+        super().save_links(index, writer)
         # link back to WD items
-        self.save_link_to(WdRawItem(self.raw))
+        self.save_link_to(Item.Source.WIKIDATA, index, writer)
 
 
 class nLabRawItem(OtherWdRawItem):
@@ -0,0 +1,261 @@
+import bz2
+import gzip
+import itertools
+import json
+import logging
+import os
+import tempfile
+from multiprocessing import Pool
+from urllib.parse import quote
+
+from concepts.utils import chunked
+from slurper.wd_raw_item import WD_OTHER_SOURCES
+
+# Number of dump lines handed to a worker process at once
+DUMP_CHUNK_SIZE = 1000
+DUMP_PROCESSES = os.cpu_count() or 1
+
+ENTITY_URL = "http://www.wikidata.org/entity/"
+IMAGE_URL = "http://commons.wikimedia.org/wiki/Special:FilePath/"
+WIKIPEDIA_URL = "https://en.wikipedia.org/wiki/"
+# characters that Wikimedia leaves unencoded in page URLs
+_URL_SAFE = ";@$!*(),/~:"
+
+MATHEMATICS = "Q395"
+AREA_OF_MATHEMATICS = "Q1936384"
+MATHEMATICAL_CONCEPT = "Q151885"
+HUMAN = "Q5"
+
+
+def entity_lines(path):
+    """
+    Lines of the entities of a Wikidata JSON dump, which is a JSON array
+    with one entity per line, read from a .json, .json.gz or .json.bz2 file
+    without ever holding more than a line in memory. A pre-filtered subset
+    with the same layout works just as well.
+    """
+    if str(path).endswith(".gz"):
+        dump = gzip.open(path, "rt", encoding="utf-8")
+    elif str(path).endswith(".bz2"):
+        dump = bz2.open(path, "rt", encoding="utf-8")
+    else:
+        dump = open(path, encoding="utf-8")
+    with dump:
+        for line in dump:
+            line = line.strip().rstrip(",")
+            if line and line not in ("[", "]"):
+                yield line
+
+
+def _statements(entity, prop, truthy=True):
+    """Statements of a property, only those of the best rank if truthy, as
+    wdt: in SPARQL, or all of them, as p:."""
+    statements = entity.get("claims", {}).get(prop, [])
+    if not truthy:
+        return statements
+    preferred = [s for s in statements if s.get("rank") == "preferred"]
+    return preferred or [s for s in statements if s.get("rank") == "normal"]
+
+
+def _value(snak):
+    if snak.get("snaktype") != "value":
+        return None
+    value = snak["datavalue"]["value"]
+    return value["id"] if isinstance(value, dict) else value
+
+
+def _values(entity, prop, truthy=True):
+    values = (
+        _value(statement["mainsnak"]) for statement in _statements(entity, prop, truthy)
+    )
+    return [value for value in values if value is not None]
+
+
+def _scan_chunk(lines):
+    """Find the classes and areas that the selection of items refers to."""
+    topic_classes = set()
+    areas = set()
+    area_statements = set()
+    for line in lines:
+        entity = json.loads(line)
+        if MATHEMATICS in _values(entity, "P2579"):
+            topic_classes.add(entity["id"])
+        if AREA_OF_MATHEMATICS in _values(entity, "P31"):
+            areas.add(entity["id"])
+        if AREA_OF_MATHEMATICS in _values(entity, "P31", truthy=False):
+            area_statements.add(entity["id"])
+    return topic_classes, areas, area_statements
+
+
+class DumpSelection:
+    """
+    The criteria of the SPARQL queries of the Wikidata slurpers, applied to
+    the entities of a dump. Topic queries refer to other entities, such as
+    the classes studied by mathematics, which are collected by a first pass
+    over the dump.
+    """
+
+    def __init__(self, excluded, topic_classes, areas, area_statements):
+        """
+        Args:
+            excluded: Ids of the classes whose instances are left out
+            topic_classes: Ids of the classes studied by mathematics
+            areas: Ids of the areas of mathematics, by their truthy P31
+            area_statements: Ids of the entities with any P31 statement
+                making them an area of mathematics
+        """
+        self.excluded = set(excluded) | {HUMAN}
+        self.topic_classes = topic_classes
+        self.areas = areas
+        self.area_statements = area_statements
+
+    def slurpers(self, entity):
+        """Names of the slurpers whose query selects the entity."""
+        instance_of = set(_values(entity, "P31"))
+        if instance_of & self.excluded:
+            return []
+        names = []
+        if instance_of & self.topic_classes:
+            names.append("math-topics")
+        if set(_values(entity, "P2579")) & self.areas:
+            names.append("studied-by-area")
+        if self._is_concept_of_area(entity):
+            names.append("concept-of-area")
+        for property in WD_OTHER_SOURCES.values():
+            if _values(entity, property["wd_property"].removeprefix("wdt:")):
+                names.append(property["slug"])
+        return names
+
+    def _is_concept_of_area(self, entity):
+        for statement in _statements(entity, "P31", truthy=False):
+            if _value(statement["mainsnak"]) != MATHEMATICAL_CONCEPT:
+                continue
+            qualifiers = statement.get("qualifiers", {}).get("P642", [])
+            if any(_value(snak) in self.area_statements for snak in qualifiers):
+                return True
+        return False
+
+
+def bindings(entity):
+    """
+    SPARQL results describing an entity as the slurper queries do: one per
+    combination of image and identifiers in other sources, as the queries
+    group by them.
+    """
+    entity_id = entity["id"]
+    label = entity.get("labels", {}).get("en")
+    description = entity.get("descriptions", {}).get("en")
+    aliases = [alias["value"] for alias in entity.get("aliases", {}).get("en", [])]
+    binding = {
+        "item": {"type": "uri", "value": ENTITY_URL + entity_id},
+        # the label service falls back to the id
+        "itemLabel": {
+            "type": "literal",
+            "value": label["value"] if label else entity_id,
+        },
+        "aliases": {"type": "literal", "value": ", ".join(aliases)},
+    }
+    if description:
+        binding["itemDescription"] = {
+            "type": "literal",
+            "value": description["value"],
+        }
+    sitelink = entity.get("sitelinks", {}).get("enwiki")
+    if sitelink:
+        title = quote(sitelink["title"].replace(" ", "_"), safe=_URL_SAFE)
+        binding["wp_en"] = {"type": "uri", "value": WIKIPEDIA_URL + title}
+    optional = {
+        "image": [
+            {"type": "uri", "value": IMAGE_URL + quote(image.replace(" ", "_"))}
+            for image in _values(entity, "P18")
+        ]
+    }
+    for property in WD_OTHER_SOURCES.values():
+        optional[property["json_key"]] = [
+            {"type": "literal", "value": value}
+            for value in _values(entity, property["wd_property"].removeprefix("wdt:"))
+        ]
+    keys = list(optional)
+    for terms in itertools.product(*(optional[key] or [None] for key in keys)):
+        yield {
+            **binding,
+            **{key: term for key, term in zip(keys, terms) if term is not None},
+        }
+
+
+_selection = None
+
+
+def _init_worker(selection):
+    global _selection
+    _selection = selection
+
+
+def _select_chunk(lines):
+    selected = []
+    for line in lines:
+        entity = json.loads(line)
+        if entity.get("type") != "item":
+            continue
+        names = _selection.slurpers(entity)
+        if names:
+            selected.append((names, list(bindings(entity))))
+    return selected
+
+
+def _map(function, chunks, processes, initializer=None, initargs=()):
+    """Map a function over chunks of lines, in worker processes if there
+    is more than one, keeping the order of the chunks."""
+    if processes <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(function, chunks)
+        return
+    with Pool(processes, initializer, initargs) as pool:
+        yield from pool.imap(function, chunks)
+
+
+def select(path, excluded, processes=DUMP_PROCESSES, chunk_size=DUMP_CHUNK_SIZE):
+    """
+    Select the items of the Wikidata slurpers from a dump, in two passes:
+    the first collects the classes and areas of mathematics, the second
+    the items that the slurper queries would return. Both parse the dump
+    in chunks of lines spread over worker processes.
+
+    Args:
+        path: Path of the dump
+        excluded: Ids of the classes whose instances are left out
+        processes: Number of worker processes
+        chunk_size: Number of lines per chunk
+
+    Returns:
+        A dictionary mapping slurper names to temporary files of their
+        SPARQL results as JSON lines, in the order of the dump
+    """
+    topic_classes, areas, area_statements = set(), set(), set()
+    for chunk in _map(_scan_chunk, chunked(entity_lines(path), chunk_size), processes):
+        topic_classes |= chunk[0]
+        areas |= chunk[1]
+        area_statements |= chunk[2]
+    logging.log(
+        logging.INFO,
+        f"Dump: {len(topic_classes)} classes studied by mathematics, "
+        f"{len(areas)} areas of mathematics",
+    )
+    selection = DumpSelection(excluded, topic_classes, areas, area_statements)
+    spools = {}
+    chunks = _map(
+        _select_chunk,
+        chunked(entity_lines(path), chunk_size),
+        processes,
+        _init_worker,
+        (selection,),
+    )
+    for chunk in chunks:
+        for names, entity_bindings in chunk:
+            lines = [json.dumps(binding) + "\n" for binding in entity_bindings]
+            for name in names:
+                if name not in spools:
+                    spools[name] = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+                spools[name].writelines(lines)
+    return spools
@@ -0,0 +1,270 @@
+import html
+import logging
+import re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from concepts.utils import chunked
+from slurper import http_cache
+from slurper.rate_limit import TokenBucket, retry_after
+
+from web.settings import WIKIPEDIA_CONTACT_EMAIL
+
+API_URL = "https://en.wikipedia.org/w/api.php"
+# The API accepts up to 50 titles per request, and returns the wikitext of
+# all of their pages at once
+BATCH_SIZE = 50
+WORKERS = 4
+REQUESTS_PER_SECOND = 20
+MAX_RETRIES = 3
+
+# Shared by all fetchers, so that the rate holds across slurpers
+RATE_LIMITER = TokenBucket(REQUESTS_PER_SECOND)
+
+# Wikipedia API contact email (required by Wikipedia API guidelines)
+# Set to None to disable Wikipedia article fetching
+_missing_email_logged = False
+
+
+def article_title(wp_url):
+    """Title of the Wikipedia article with the given URL."""
+    # Decode URL-encoded characters (e.g., %E2%80%93 becomes –)
+    return urllib.parse.unquote(wp_url.split("/wiki/")[-1])
+
+
+_COMMENT = re.compile(r"<!--.*?-->", re.S)
+_REF = re.compile(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>", re.S | re.I)
+# elements whose content is not prose
+_NON_PROSE = re.compile(
+    r"<(math|chem|ce|gallery|imagemap|score|syntaxhighlight|source|timeline)\b"
+    r"[^>]*>.*?</\1>",
+    re.S | re.I,
+)
+_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+_TEMPLATE = re.compile(r"\{\{[^{}]*\}\}")
+_TABLE = re.compile(r"\{\|(?:(?!\{\|).)*?\|\}", re.S)
+_LINK = re.compile(r"\[\[([^\[\]]*)\]\]")
+_EXTERNAL_LINK = re.compile(r"\[(?:https?:)?//[^\s\]]*\s*([^\]]*)\]")
+_HEADING = re.compile(r"^(=+)\s*(.*?)\s*\1\s*$", re.M)
+_LIST_MARK = re.compile(r"^[*#:;]+\s*", re.M)
+_SWITCH = re.compile(r"__[A-Z]+__")
+_EMPHASIS = re.compile(r"'{2,}")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*")
+# links to pages of these namespaces are not part of the text
+_HIDDEN_NAMESPACES = ("file", "image", "category", "media")
+
+
+def _remove_nested(pattern, text):
+    """Remove the innermost matches of pattern until there are none left."""
+    while True:
+        text, n = pattern.subn("", text)
+        if not n:
+            return text
+
+
+def _link_text(match):
+    target, _, label = match[1].partition("|")
+    namespace, colon, _ = target.partition(":")
+    if colon and (namespace.strip().lower() in _HIDDEN_NAMESPACES or not namespace):
+        return ""
+    # the label of a piped link is what follows the last pipe
+    return (label.rpartition("|")[2] if label else target).strip()
+
+
+def plain_text(wikitext):
+    """
+    Turn the wikitext of an article into plain text, close to what the
+    TextExtracts API gives: templates, tables, references, files and
+    formulas are left out, links are replaced by their labels, and
+    headings are kept on lines of their own.
+    """
+    text = _COMMENT.sub("", wikitext)
+    text = _REF.sub("", text)
+    text = _NON_PROSE.sub("", text)
+    text = _remove_nested(_TEMPLATE, text)
+    text = _remove_nested(_TABLE, text)
+    # innermost first, so that the captions of files lose their links
+    # before the files are left out
+    while True:
+        text, n = _LINK.subn(_link_text, text)
+        if not n:
+            break
+    text = _EXTERNAL_LINK.sub(lambda match: match[1], text)
+    text = _TAG.sub("", text)
+    text = _HEADING.sub(lambda match: match[2], text)
+    text = _LIST_MARK.sub("", text)
+    text = _SWITCH.sub("", text)
+    text = _EMPHASIS.sub("", text)
+    text = html.unescape(text)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def _contact_email_configured():
+    global _missing_email_logged
+
+    if WIKIPEDIA_CONTACT_EMAIL is None:
+        if not _missing_email_logged:
+            logging.log(
+                logging.WARNING,
+                "WIKIPEDIA_CONTACT_EMAIL is not set. "
+                "Wikipedia article fetching is disabled. "
+                "Please set WIKIPEDIA_CONTACT_EMAIL in your .env file "
+                "to enable article fetching.",
+            )
+            _missing_email_logged = True
+        return False
+    return True
+
+
+class ArticleFetcher:
+    """
+    Fetches the plain text of English Wikipedia articles.
+
+    Titles are grouped into requests of up to 50 titles, which several
+    workers send under a shared token-bucket rate limiter. Returned pages
+    are mapped back to the requested titles through the normalizations and
+    redirects the API reports.
+
+    The TextExtracts API only returns one whole article per response, so
+    the current wikitext of all pages of a batch is fetched instead, and
+    turned into plain text locally. Pages that do not fit in a response
+    come with the next one, by following the continuation.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, workers=WORKERS, limiter=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.limiter = limiter or RATE_LIMITER
+
+    def fetch_articles(self, titles):
+        """
+        Fetch the articles with the given titles.
+
+        Args:
+            titles: Iterable of article titles, as they appear in article URLs
+
+        Returns:
+            A dictionary mapping each title to the article text, or to None
+            if there is no article. Titles whose fetch failed, or that are
+            not fetched since no contact email is configured, are left out.
+        """
+        titles = list(dict.fromkeys(titles))
+        if not titles or not _contact_email_configured():
+            return {}
+        logging.log(
+            logging.INFO,
+            f"Fetching {len(titles)} Wikipedia articles",
+        )
+        articles = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch_articles in executor.map(
+                self._fetch_batch, chunked(titles, self.batch_size)
+            ):
+                articles.update(batch_articles)
+        return articles
+
+    def _fetch_batch(self, titles):
+        params = {
+            "action": "query",
+            "format": "json",
+            "formatversion": 2,
+            "titles": "|".join(titles),
+            "prop": "revisions",
+            "rvprop": "content",
+            "rvslots": "main",
+            "redirects": True,
+        }
+        extracts = {}
+        renames = {}
+        continuation = {}
+        failed = False
+        while True:
+            data = self._request({**params, **continuation}, titles)
+            if data is None:
+                failed = True
+                break
+            query = data.get("query", {})
+            for rename in query.get("normalized", []) + query.get("redirects", []):
+                renames[rename["from"]] = rename["to"]
+            for page in query.get("pages", []):
+                if page.get("revisions"):
+                    wikitext = page["revisions"][0]["slots"]["main"]["content"]
+                    extracts[page["title"]] = plain_text(wikitext)
+            if "continue" not in data:
+                break
+            continuation = data["continue"]
+
+        articles = {}
+        for title in titles:
+            page_title = title
+            seen = set()
+            while page_title in renames and page_title not in seen:
+                seen.add(page_title)
+                page_title = renames[page_title]
+            if page_title not in extracts and failed:
+                # the extract may have been in a response that never came
+                continue
+            articles[title] = extracts.get(page_title)
+            if articles[title] is None:
+                logging.log(
+                    logging.INFO,
+                    f"Article {title} will have null value (fetch failed or empty)",
+                )
+        return articles
+
+    def _request(self, params, titles):
+        headers = {
+            "Accept": "application/json",
+            "Accept-Language": "en-US,en;q=0.9",
+        }
+        description = f"{titles[0]} and {len(titles) - 1} more"
+        retry_delay = 1
+        for attempt in range(MAX_RETRIES):
+            last_attempt = attempt == MAX_RETRIES - 1
+            try:
+                response = http_cache.get(
+                    API_URL, params=params, headers=headers, limiter=self.limiter
+                )
+                if response.status_code in (429, 403):
+                    if last_attempt:
+                        logging.log(
+                            logging.ERROR,
+                            f"Failed to fetch {description} after "
+                            f"{MAX_RETRIES} attempts (rate limited). "
+                            "Skipping articles.",
+                        )
+                        return None
+                    wait = retry_after(response, retry_delay)
+                    logging.log(
+                        logging.WARNING,
+                        f"Rate limited for {description}, backing off for "
+                        f"{wait}s (attempt {attempt + 1}/{MAX_RETRIES})",
+                    )
+                    # Hold back all workers, not just this one
+                    self.limiter.pause(wait)
+                    retry_delay *= 2
+                    continue
+                response.raise_for_status()
+                return response.json()
+            except http_cache.OfflineCacheMiss:
+                logging.log(
+                    logging.INFO,
+                    f"Articles {description} are not cached. Skipping articles.",
+                )
+                return None
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if last_attempt:
+                    logging.log(
+                        logging.ERROR,
+                        f"Failed to fetch {description} after "
+                        f"{MAX_RETRIES} attempts: {e}. Skipping articles.",
+                    )
+                    return None
+                logging.log(
+                    logging.WARNING,
+                    f"Request failed for {description}: "
+                    f"{e}, retrying in {retry_delay}s",
+                )
+                self.limiter.pause(retry_delay)
+                retry_delay *= 2
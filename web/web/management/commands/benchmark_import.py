@@ -0,0 +1,126 @@
+import contextlib
+import io
+import json
+import resource
+import time
+from pathlib import Path
+
+from concepts.models import Item, Link
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from slurper.replay import FIXTURES_DIR, replayed
+
+from web.query_budget import count_queries
+
+STAGES = ["import_wikidata", "import_agda_unimath", "link_same", "compute_concepts"]
+
+
+def peak_rss_kb():
+    """Peak resident set size so far of this process and its finished
+    children, such as spaCy workers, in KiB. It never decreases, so after
+    a stage it is the peak of that stage and all the stages before."""
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the import pipeline against a scratch database on recorded "
+        "responses and report its throughput as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=1,
+            help="Number of times the recorded items are replayed",
+        )
+        parser.add_argument(
+            "--stage",
+            action="append",
+            dest="stages",
+            choices=STAGES,
+            help="Only run the named stage (repeatable, default: all in order)",
+        )
+        parser.add_argument(
+            "--fixtures",
+            default=str(FIXTURES_DIR),
+            help="Directory of the recorded responses",
+        )
+        parser.add_argument(
+            "--skip-keywords",
+            action="store_true",
+            help="Import without extracting keywords, e.g. if spaCy is missing",
+        )
+        parser.add_argument(
+            "--wikipedia-rate",
+            type=float,
+            default=10000,
+            help="Requests per second allowed to the replayed MediaWiki API",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write the report to this file instead of the standard output",
+        )
+
+    def handle(self, *args, **options):
+        stage_options = {
+            "import_wikidata": {"skip_keywords": options["skip_keywords"]},
+        }
+        test_database = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with replayed(
+                options["scale"], options["fixtures"], options["wikipedia_rate"]
+            ) as client:
+                stages = [
+                    self.run_stage(stage, client, **stage_options.get(stage, {}))
+                    for stage in options["stages"] or STAGES
+                ]
+        finally:
+            connection.creation.destroy_test_db(test_database, verbosity=0)
+
+        report = json.dumps(
+            {"scale": options["scale"], "stages": stages}, indent=2, sort_keys=True
+        )
+        if options["output"] is None:
+            self.stdout.write(report)
+        else:
+            Path(options["output"]).write_text(report + "\n", encoding="utf-8")
+
+    def run_stage(self, stage, client, **options):
+        requests_before = client.requests
+        items_before = Item.objects.count()
+        links_before = Link.objects.count()
+        peak_rss_before = peak_rss_kb()
+        start = time.perf_counter()
+        with count_queries() as queries, contextlib.redirect_stdout(io.StringIO()):
+            call_command(stage, **options)
+        wall_time = time.perf_counter() - start
+        items = Item.objects.count()
+        links = Link.objects.count()
+        peak_rss = peak_rss_kb()
+        return {
+            "stage": stage,
+            "wall_time_s": round(wall_time, 4),
+            "items": items,
+            "links": links,
+            # rows added by this stage, not by the stages before
+            "items_added": items - items_before,
+            "links_added": links - links_before,
+            "items_per_s": round((items - items_before) / wall_time, 2),
+            "links_per_s": round((links - links_before) / wall_time, 2),
+            "queries": queries.total,
+            "queries_by_kind": dict(queries.counts),
+            "queries_per_item": round(queries.total / items, 3) if items else None,
+            "http_requests": client.requests - requests_before,
+            "cumulative_peak_rss_kb": peak_rss,
+            # by how much this stage raised the peak of the stages before
+            "peak_rss_growth_kb": peak_rss - peak_rss_before,
+        }
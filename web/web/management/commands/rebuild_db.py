@@ -3,18 +3,42 @@ from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--offline",
+            action="store_true",
+            help="Replay responses from the HTTP cache without using the network",
+        )
+        parser.add_argument(
+            "--from-scratch",
+            action="store_true",
+            help="Clear all items before importing instead of updating them",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted rebuild from the checkpoints of its "
+            "imports without clearing anything",
+        )
+
     def handle(self, *args, **options):
-        print("clearing data: agda-unimath")
-        call_command("clear_agda_unimath")
-        print("clearing data: Wikidata")
-        call_command("clear_wikidata")
-        print("clearing data: concepts")
-        call_command("clear_concepts")
+        if options["from_scratch"] and not options["resume"]:
+            print("clearing data: agda-unimath")
+            call_command("clear_agda_unimath")
+            print("clearing data: Wikidata")
+            call_command("clear_wikidata")
+            # computed again at the end, instead of after every import
+            print("clearing data: concepts")
+            call_command("clear_concepts")
         call_command("migrate")
         print("importing data: Wikidata")
-        call_command("import_wikidata")
+        call_command(
+            "import_wikidata", offline=options["offline"], resume=options["resume"]
+        )
         print("importing data: agda-unimath")
-        call_command("import_agda_unimath")
+        call_command(
+            "import_agda_unimath", offline=options["offline"], resume=options["resume"]
+        )
         print("linking: items with the same name")
         call_command("link_same")
         print("computing concepts")
@@ -0,0 +1,127 @@
+import contextlib
+import threading
+from collections import Counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Statements that only manage transactions and savepoints, which are not
+# held against budgets
+TRANSACTION_KEYWORDS = {"BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE"}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block of code runs more queries than its budget."""
+
+
+def classify(sql):
+    """Kind of an SQL statement: "select", "insert", "update", "delete",
+    "transaction" or "other"."""
+    keyword = sql.lstrip(" (").split(None, 1)[0].upper() if sql.strip() else ""
+    if keyword in TRANSACTION_KEYWORDS:
+        return "transaction"
+    if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        return keyword.lower()
+    if keyword == "WITH":
+        return "select"
+    return "other"
+
+
+class QueryLog:
+    """
+    Counts and classifies the SQL statements run while it is active, on all
+    database connections, including those opened by worker threads in the
+    meantime. Remembers the statements themselves so that a blown budget
+    can show what ran.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.counts[classify(sql)] += 1
+            self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def total(self):
+        """Number of statements, leaving out transaction management."""
+        return sum(
+            count for kind, count in self.counts.items() if kind != "transaction"
+        )
+
+    def _install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    @contextlib.contextmanager
+    def active(self):
+        installed = list(connections.all(initialized_only=True))
+        for connection in installed:
+            connection.execute_wrappers.append(self)
+        connection_created.connect(self._install)
+        try:
+            yield self
+        finally:
+            connection_created.disconnect(self._install)
+            for connection in connections.all(initialized_only=True):
+                if self in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(self)
+
+    def summary(self):
+        kinds = ", ".join(
+            f"{count} {kind}" for kind, count in sorted(self.counts.items())
+        )
+        return f"{self.total} queries ({kinds})"
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Count the queries of a block of code.
+
+    Yields:
+        The QueryLog of the block
+    """
+    log = QueryLog()
+    with log.active():
+        yield log
+
+
+@contextlib.contextmanager
+def query_budget(total=None, label="block", **kinds):
+    """
+    Fail if a block of code runs more queries than declared.
+
+    Args:
+        total: Maximum number of queries, leaving out transaction management
+        label: Name of the block in the error message
+        kinds: Maximum number of queries of the given kinds, e.g. select=2
+
+    Raises:
+        QueryBudgetExceeded: After the block, if it exceeded a budget
+    """
+    with count_queries() as log:
+        yield log
+    exceeded = [
+        f"{kind} {log.counts[kind]} > {budget}"
+        for kind, budget in kinds.items()
+        if log.counts[kind] > budget
+    ]
+    if total is not None and log.total > total:
+        exceeded.insert(0, f"total {log.total} > {total}")
+    if exceeded:
+        statements = "\n".join(f"  {sql}" for sql in log.statements[:20])
+        raise QueryBudgetExceeded(
+            f"{label} exceeded its query budget ({'; '.join(exceeded)}), "
+            f"ran {log.summary()}:\n{statements}"
+        )
+
+
+class QueryBudgetMixin:
+    """TestCase mixin asserting query budgets of blocks of code."""
+
+    def assertQueryBudget(self, total=None, label="block", **kinds):
+        return query_budget(total, label, **kinds)
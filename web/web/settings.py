@@ -135,3 +135,21 @@ STATIC_ROOT = "/var/www/mathswitch/static"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 WIKIPEDIA_CONTACT_EMAIL = config("WIKIPEDIA_CONTACT_EMAIL", default="my@email.com")
+
+# On-disk cache of responses fetched by the slurpers
+HTTP_CACHE_DIR = config("HTTP_CACHE_DIR", default=str(BASE_DIR / ".http_cache"))
+# Seconds after which cached responses are revalidated
+HTTP_CACHE_TTL = config("HTTP_CACHE_TTL", default=24 * 60 * 60, cast=int)
+# Bytes of response bodies kept before least recently used ones are evicted
+HTTP_CACHE_MAX_SIZE = config("HTTP_CACHE_MAX_SIZE", default=2 * 1024**3, cast=int)
+
+# Append-only file of the compressed Wikipedia articles of the items
+ARTICLE_STORE_PATH = config(
+    "ARTICLE_STORE_PATH", default=str(BASE_DIR / "articles.blob")
+)
+
+# spaCy pipeline profile used for keyword extraction: "ner" only runs the
+# components needed for named entities, "full" runs the whole pipeline
+NLP_PROFILE = config("NLP_PROFILE", default="ner")
+# Number of characters of an article passed to spaCy (0: the whole article)
+NLP_MAX_LENGTH = config("NLP_MAX_LENGTH", default=0, cast=int)